@@ -0,0 +1,167 @@
+"""
+Synthetic multi camera ball simulator, so the tracker can be driven with realistic input without the Bohs dataset.
+
+The ball is flown around the 68x105 pitch as a sequence of ground passes and lofted kicks. Every camera sees it where
+the ray from the camera through the ball hits the ground (which is where the homography puts it), projected back into
+the image through the inverse of the camera's homography. Pixel noise, dropped detections and false positives are then
+added on top.
+
+Cameras 1 and 3 are the real Jetsons, with the homographies from get_new_homographies(). For more cameras, virtual
+pinhole cameras are placed around the pitch, looking at the centre spot.
+"""
+from typing import List, NamedTuple, Tuple
+
+import numpy as np
+
+from triangulation_logic import MultiCameraTracker, JETSON1_REAL_WORLD, JETSON3_REAL_WORLD
+from utils.cache import default_cache_dir
+from utils.calibration import load_homographies
+from utils.config import IMAGE_HEIGHT, IMAGE_WIDTH, get_image_field_coordinates
+from utils.data_classes import DETECTIONS_DTYPE
+
+FIELD_WIDTH: float = 68.
+FIELD_LENGTH: float = 105.
+FULL_IMAGE: Tuple[Tuple[int, int], ...] = ((0, 0), (IMAGE_WIDTH, 0), (IMAGE_WIDTH, IMAGE_HEIGHT), (0, IMAGE_HEIGHT))
+
+
+class SimulatedCamera(NamedTuple):
+    camera_id: int
+    centre: np.ndarray  # (3,) real world position
+    homography: np.ndarray  # (3, 3) image -> pitch, like the tracker's
+    image_field_coordinates: Tuple[Tuple[int, int], ...]
+
+
+def pinhole_ground_homography(centre: np.ndarray, target: np.ndarray, focal_length: float = 1400.) -> np.ndarray:
+    """
+    Image -> ground homography of a pinhole camera at centre looking at target, with the principal point in the middle
+    of the image.
+    """
+    forward = target - centre
+    forward /= np.linalg.norm(forward)
+    right = np.cross(forward, [0., 0., 1.])
+    right /= np.linalg.norm(right)
+    down = np.cross(forward, right)
+    rotation = np.stack((right, down, forward))  # World -> camera
+
+    intrinsics = np.array([[focal_length, 0., IMAGE_WIDTH / 2], [0., focal_length, IMAGE_HEIGHT / 2], [0., 0., 1.]])
+    translation = -rotation @ centre
+    # Points on the ground have z=0, so only the x and y columns of the rotation matter
+    ground_to_image = intrinsics @ np.column_stack((rotation[:, 0], rotation[:, 1], translation))
+    homography = np.linalg.inv(ground_to_image)
+    return homography / homography[2, 2]
+
+
+def create_cameras(n_cameras: int) -> List[SimulatedCamera]:
+    """
+    The two Jetsons, plus n_cameras - 2 virtual cameras spread around the pitch at 8m high.
+    """
+    homographies = load_homographies(default_cache_dir())
+    field_coordinates = get_image_field_coordinates()
+    cameras = [
+        SimulatedCamera(1, JETSON1_REAL_WORLD.ravel(), homographies["1"], field_coordinates["1"]),
+        SimulatedCamera(3, JETSON3_REAL_WORLD.ravel(), homographies["3"], field_coordinates["3"]),
+    ][:n_cameras]
+
+    centre_spot = np.array([FIELD_WIDTH / 2, FIELD_LENGTH / 2, 0.])
+    n_virtual = n_cameras - len(cameras)
+    for i in range(n_virtual):
+        angle = 2 * np.pi * (i + 0.5) / n_virtual
+        centre = np.array([FIELD_WIDTH / 2 + 55 * np.cos(angle), FIELD_LENGTH / 2 + 70 * np.sin(angle), 8.])
+        cameras.append(SimulatedCamera(11 + i, centre, pinhole_ground_homography(centre, centre_spot), FULL_IMAGE))
+    return cameras
+
+
+def create_tracker(cameras: List[SimulatedCamera], **kwargs) -> MultiCameraTracker:
+    tracker = MultiCameraTracker(**kwargs)
+    for camera in cameras:
+        tracker.add_camera(camera.camera_id, camera.centre.reshape(3, 1), homography=camera.homography,
+                           image_field_coordinates=camera.image_field_coordinates)
+    return tracker
+
+
+def simulate_trajectory(
+        n_frames: int,
+        fps: float = 25.,
+        rng: np.random.Generator = None,
+        max_height: float = 15.,
+        lofted_fraction: float = 0.3,
+        speed_range: Tuple[float, float] = (5., 25.),
+) -> np.ndarray:
+    """
+    Flies the ball from one random point on the pitch to another, over and over. Each flight is either along the
+    ground, or (lofted_fraction of the time) a parabolic arc peaking at up to max_height metres.
+    :return: (n_frames, 3) ball positions, one per frame
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    positions = np.empty((n_frames, 3), dtype=np.float64)
+    start = np.array([FIELD_WIDTH / 2, FIELD_LENGTH / 2])
+
+    frame = 0
+    while frame < n_frames:
+        end = rng.uniform((1., 1.), (FIELD_WIDTH - 1, FIELD_LENGTH - 1))
+        duration = np.linalg.norm(end - start) / rng.uniform(*speed_range)
+        n = min(max(int(duration * fps), 1), n_frames - frame)
+        progress = np.arange(1, n + 1) / max(int(duration * fps), 1)
+
+        positions[frame:frame + n, :2] = start + np.outer(progress, end - start)
+        height = rng.uniform(0., max_height) if rng.uniform() < lofted_fraction else 0.
+        positions[frame:frame + n, 2] = 4 * height * progress * (1 - progress)
+
+        start = positions[frame + n - 1, :2]
+        frame += n
+    return positions
+
+
+def project_to_image(camera: SimulatedCamera, positions: np.ndarray) -> np.ndarray:
+    """
+    Where each ball position appears in the camera's image, i.e. the inverse of the tracker's homography applied to
+    where the ray from the camera through the ball hits the ground.
+    :return: (N, 2) pixel coordinates, NaN where the ball is above the camera
+    """
+    above = positions[:, 2] >= camera.centre[2]
+    scale = camera.centre[2] / np.where(above, np.nan, camera.centre[2] - positions[:, 2])
+    ground = camera.centre[:2] + (positions[:, :2] - camera.centre[:2]) * scale[:, None]
+
+    image = np.column_stack((ground, np.ones(len(ground)))) @ np.linalg.inv(camera.homography).T
+    return image[:, :2] / image[:, 2:]
+
+
+def simulate_detections(
+        cameras: List[SimulatedCamera],
+        positions: np.ndarray,
+        rng: np.random.Generator = None,
+        pixel_noise: float = 2.,
+        dropout: float = 0.1,
+        false_positive_rate: float = 0.05,
+) -> np.ndarray:
+    """
+    Detections of the ball by every camera for every frame.
+    :param positions: (n_frames, 3) ball positions, the frame index is used as the timestamp
+    :param pixel_noise: Standard deviation of the gaussian noise added to the detections, in pixels
+    :param dropout: Probability of a camera missing the ball in a frame
+    :param false_positive_rate: Expected number of false detections per camera per frame, anywhere in the image
+    :return: DETECTIONS_DTYPE array, sorted by timestamp
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    n_frames = len(positions)
+    frames = np.arange(n_frames, dtype=np.float64)
+    columns = []
+
+    for camera in cameras:
+        pixels = project_to_image(camera, positions) + rng.normal(0., pixel_noise, (n_frames, 2))
+        visible = (pixels[:, 0] >= 0) & (pixels[:, 0] < IMAGE_WIDTH) & (pixels[:, 1] >= 0) & \
+            (pixels[:, 1] < IMAGE_HEIGHT) & (rng.uniform(size=n_frames) >= dropout)
+        n_visible = int(visible.sum())
+        columns.append((np.full(n_visible, camera.camera_id), frames[visible], pixels[visible, 0],
+                        pixels[visible, 1], rng.uniform(0.6, 1., n_visible)))
+
+        n_false = rng.poisson(false_positive_rate * n_frames)
+        columns.append((np.full(n_false, camera.camera_id), rng.integers(0, n_frames, n_false).astype(np.float64),
+                        rng.uniform(0, IMAGE_WIDTH, n_false), rng.uniform(0, IMAGE_HEIGHT, n_false),
+                        rng.uniform(0.3, 0.9, n_false)))
+
+    detections = np.empty(sum(len(c[0]) for c in columns), dtype=DETECTIONS_DTYPE)
+    for name, ndx in (('camera_id', 0), ('timestamp', 1), ('x', 2), ('y', 3), ('probability', 4)):
+        detections[name] = np.concatenate([c[ndx] for c in columns])
+    detections['z'] = 0.
+    return detections[np.argsort(detections['timestamp'], kind='stable')]
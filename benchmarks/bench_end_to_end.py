@@ -0,0 +1,134 @@
+"""
+End to end throughput/ latency harness: drives the MultiCameraTracker with detections from the synthetic ball
+simulator (benchmarks/ball_simulator.py), at a range of camera counts.
+
+Run from the root of the repo:
+    python -m benchmarks.bench_end_to_end --cameras 2 3 4 8 --fps 25 --seconds 60 --output bench_end_to_end.json
+
+For every camera count it reports the frames/sec the tracker sustains frame by frame (multi_camera_analysis) and over
+the whole sequence at once (analyze_sequence), the per frame latency percentiles (overall and per tracker stage), how
+many frames go over the frame budget at the given fps, and the median error against the simulated ball positions.
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sys
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from benchmarks.ball_simulator import create_cameras, create_tracker, simulate_detections, simulate_trajectory
+from utils.data_classes import Detections, ThreeDPoints
+from utils.timer import LatencyHistogram
+
+
+def frames_of(detections: np.ndarray, n_frames: int) -> List[List[Detections]]:
+    """
+    Splits the simulated detections into the per frame lists multi_camera_analysis() takes, including the empty lists
+    of frames where no camera saw anything.
+    """
+    boundaries = np.searchsorted(detections['timestamp'], np.arange(1, n_frames))
+    return [[Detections(camera_id=camera_id, probability=probability, timestamp=timestamp, x=x, y=y, z=z)
+             for camera_id, timestamp, x, y, z, probability in frame.tolist()]
+            for frame in np.split(detections, boundaries)]
+
+
+def median_error(results: List, positions: np.ndarray) -> float:
+    """
+    Median distance in metres between the tracker's valid 3D points and where the ball actually was.
+    """
+    errors = [np.linalg.norm(np.array([r.x, r.y, r.z]) - positions[int(r.timestamp)])
+              for r in results if type(r) == ThreeDPoints and 0 <= r.timestamp < len(positions)]
+    return float(np.median(errors)) if errors else float("nan")
+
+
+def run_case(n_cameras: int, args) -> Dict:
+    rng = np.random.default_rng(args.seed)
+    cameras = create_cameras(n_cameras)
+    positions = simulate_trajectory(int(args.seconds * args.fps), fps=args.fps, rng=rng, max_height=args.max_height)
+    detections = simulate_detections(cameras, positions, rng=rng, pixel_noise=args.pixel_noise, dropout=args.dropout,
+                                     false_positive_rate=args.false_positives)
+    frames = frames_of(detections, len(positions))
+    budget_ns = int(1e9 / args.fps)
+
+    # Frame by frame, like the live system
+    tracker = create_tracker(cameras, use_formplane=not args.no_formplane, instrument=True)
+    latencies = LatencyHistogram()
+    results = []
+    over_budget = 0
+    # form_plane() prints whenever there's no plane, which would swamp the output (and the timings)
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter_ns()
+        for frame in frames:
+            frame_start = time.perf_counter_ns()
+            results.append(tracker.multi_camera_analysis(frame))
+            elapsed = time.perf_counter_ns() - frame_start
+            latencies.record(elapsed)
+            over_budget += elapsed > budget_ns
+        frame_by_frame_ns = time.perf_counter_ns() - start
+
+        # The whole sequence at once
+        sequence_tracker = create_tracker(cameras, use_formplane=not args.no_formplane)
+        start = time.perf_counter_ns()
+        sequence_tracker.analyze_sequence(detections)
+        sequence_ns = time.perf_counter_ns() - start
+
+    snapshot = latencies.snapshot()
+    return {
+        "cameras": n_cameras,
+        "frames": len(frames),
+        "detections": len(detections),
+        "fps_frame_by_frame": len(frames) / (frame_by_frame_ns / 1e9),
+        "fps_sequence": len(frames) / (sequence_ns / 1e9),
+        "p50_us": snapshot["p50_ns"] / 1e3,
+        "p95_us": snapshot["p95_ns"] / 1e3,
+        "p99_us": snapshot["p99_ns"] / 1e3,
+        "max_us": snapshot["max_ns"] / 1e3,
+        "frames_over_budget": over_budget,
+        "median_error_m": median_error(results, positions),
+        "stages": tracker.latency_percentiles(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End to end tracker benchmark on simulated multi camera detections")
+    parser.add_argument("--cameras", nargs="+", type=int, default=[2, 3, 4, 8], help="Camera counts to run")
+    parser.add_argument("--fps", type=float, default=25., help="Frame rate of the simulated cameras")
+    parser.add_argument("--seconds", type=float, default=60., help="Length of the simulated match")
+    parser.add_argument("--pixel-noise", type=float, default=2., help="Std of the detection noise, in pixels")
+    parser.add_argument("--dropout", type=float, default=0.1, help="Probability of a camera missing the ball")
+    parser.add_argument("--false-positives", type=float, default=0.05, help="False detections per camera per frame")
+    parser.add_argument("--max-height", type=float, default=15., help="Maximum height of lofted kicks, in metres")
+    parser.add_argument("--no-formplane", action="store_true", help="Create the trackers with use_formplane=False")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Path of a JSON file to save the results to")
+    args = parser.parse_args()
+
+    print(f"{'cameras':>8} {'frames':>8} {'fps (frames)':>13} {'fps (seq)':>10} {'p50 us':>8} {'p95 us':>8} "
+          f"{'p99 us':>8} {'over budget':>12} {'error m':>8}")
+    results = []
+    for n_cameras in args.cameras:
+        result = run_case(n_cameras, args)
+        results.append(result)
+        print(f"{result['cameras']:>8} {result['frames']:>8} {result['fps_frame_by_frame']:>13,.0f} "
+              f"{result['fps_sequence']:>10,.0f} {result['p50_us']:>8.1f} {result['p95_us']:>8.1f} "
+              f"{result['p99_us']:>8.1f} {result['frames_over_budget']:>12} {result['median_error_m']:>8.2f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": sys.version,
+                "numpy": np.__version__,
+                "platform": platform.platform(),
+                "args": vars(args),
+                "results": results,
+            }, f, indent=2)
+        print(f"Saved results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+Micro-benchmarks for the geometry kernels of the MultiCameraTracker, on synthetic detections.
+
+Run from the root of the repo:
+    python -m benchmarks.bench_geometry --sizes 2 16 256 --output bench_geometry.json
+    python -m benchmarks.bench_geometry --compare bench_geometry.json
+
+For every benchmark and size it reports the time per call (ns/op), and the number of memory blocks and bytes that are
+still allocated per call (i.e. garbage that has to be collected) plus the peak memory of a single call, via tracemalloc.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from triangulation_logic import MultiCameraTracker, JETSON1_REAL_WORLD, JETSON3_REAL_WORLD
+from utils.config import get_image_field_coordinates
+from utils.data_classes import Detections, ThreeDPoints
+
+
+def create_tracker() -> MultiCameraTracker:
+    tracker = MultiCameraTracker(use_formplane=True)
+    tracker.add_camera(1, JETSON1_REAL_WORLD.copy())
+    tracker.add_camera(3, JETSON3_REAL_WORLD.copy())
+    return tracker
+
+
+def synthetic_detections(size: int, rng: np.random.Generator, in_field: bool = True) -> List[Detections]:
+    """
+    Creates `size` detections spread over cameras 1 and 3. If in_field, they are all within the camera's field bounds
+    from utils.config, otherwise they are anywhere in the image.
+    """
+    field_coordinates = get_image_field_coordinates()
+    dets = []
+    for i in range(size):
+        camera_id = (1, 3)[i % 2]
+        if in_field:
+            # Random point inside the field polygon, as a convex combination of its corners
+            weights = rng.dirichlet(np.ones(4))
+            x, y = weights @ np.array(field_coordinates[str(camera_id)], dtype=np.float64)
+        else:
+            x, y = rng.uniform(0, 1920), rng.uniform(0, 1080)
+        dets.append(Detections(camera_id=camera_id, probability=rng.uniform(0.5, 1.), timestamp=0, x=x, y=y, z=0))
+    return dets
+
+
+def setup_triangulate(size: int, rng: np.random.Generator) -> Callable:
+    det_p, det_q = MultiCameraTracker.perform_homography(create_tracker(), synthetic_detections(2, rng))
+    return lambda: MultiCameraTracker.triangulate(det_p, JETSON1_REAL_WORLD, det_q, JETSON3_REAL_WORLD)
+
+
+def setup_perform_homography(size: int, rng: np.random.Generator) -> Callable:
+    tracker = create_tracker()
+    dets = synthetic_detections(size, rng)
+    return lambda: tracker.perform_homography(dets)
+
+
+def setup_remove_oob_detections(size: int, rng: np.random.Generator) -> Callable:
+    tracker = create_tracker()
+    dets = synthetic_detections(size, rng, in_field=False)
+    return lambda: tracker.remove_oob_detections(list(dets))
+
+
+def setup_filter_most_confident_dets(size: int, rng: np.random.Generator) -> Callable:
+    dets = synthetic_detections(size, rng)
+    return lambda: MultiCameraTracker.filter_most_confident_dets(dets)
+
+
+def setup_form_plane(size: int, rng: np.random.Generator) -> Callable:
+    tracker = create_tracker()
+    for i in range(10):
+        tracker.three_d_points.append(ThreeDPoints(x=rng.uniform(0, 68), y=rng.uniform(0, 105), z=0., timestamp=i))
+    return tracker.form_plane
+
+
+def setup_internal_height_estimation(size: int, rng: np.random.Generator) -> Callable:
+    tracker = create_tracker()
+    tracker.three_d_points.append(ThreeDPoints(x=20., y=40., z=0., timestamp=0))
+    tracker.three_d_points.append(ThreeDPoints(x=22., y=45., z=0., timestamp=1))
+    tracker.form_plane()
+    dets = tracker.perform_homography(synthetic_detections(1, rng))
+    return lambda: tracker.internal_height_estimation(dets)
+
+
+def setup_multi_camera_analysis(size: int, rng: np.random.Generator) -> Callable:
+    tracker = create_tracker()
+    dets = synthetic_detections(size, rng)
+    return lambda: tracker.multi_camera_analysis(dets)
+
+
+# name -> (setup function, whether the benchmark depends on the number of detections)
+BENCHMARKS: Dict[str, tuple] = {
+    "triangulate": (setup_triangulate, False),
+    "perform_homography": (setup_perform_homography, True),
+    "remove_oob_detections": (setup_remove_oob_detections, True),
+    "filter_most_confident_dets": (setup_filter_most_confident_dets, True),
+    "form_plane": (setup_form_plane, False),
+    "internal_height_estimation": (setup_internal_height_estimation, False),
+    "multi_camera_analysis": (setup_multi_camera_analysis, True),
+}
+
+
+def time_per_call(fn: Callable, min_time: float = 0.2, repeats: int = 5) -> Dict[str, float]:
+    """
+    Times fn, calling it enough times per repeat to take at least min_time seconds.
+    :return: Best and median ns per call over the repeats
+    """
+    loops = 1
+    while True:
+        start = time.perf_counter_ns()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter_ns() - start
+        if elapsed >= min_time * 1e9 or loops >= 1 << 24:
+            break
+        loops *= 2
+
+    results = []
+    for _ in range(repeats):
+        start = time.perf_counter_ns()
+        for _ in range(loops):
+            fn()
+        results.append((time.perf_counter_ns() - start) / loops)
+    return {"best_ns_per_op": min(results), "median_ns_per_op": float(np.median(results)), "loops": loops}
+
+
+def allocations_per_call(fn: Callable, loops: int = 200) -> Dict[str, float]:
+    """
+    Uses tracemalloc to measure the memory still allocated per call, and the peak memory of a single call.
+    """
+    fn()  # Warm up any caches so that they don't count as allocations
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+
+        before = tracemalloc.take_snapshot()
+        for _ in range(loops):
+            fn()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    stats = after.compare_to(before, 'filename')
+    return {
+        "retained_blocks_per_op": sum(stat.count_diff for stat in stats) / loops,
+        "retained_bytes_per_op": sum(stat.size_diff for stat in stats) / loops,
+        "peak_bytes_per_op": peak_bytes,
+    }
+
+
+def run_benchmarks(names: List[str], sizes: List[int], min_time: float, seed: int) -> List[dict]:
+    results = []
+    for name in names:
+        setup, sized = BENCHMARKS[name]
+        for size in (sizes if sized else [1]):
+            result = {"name": name, "size": size}
+            try:
+                fn = setup(size, np.random.default_rng(seed))
+                result.update(time_per_call(fn, min_time=min_time))
+                result.update(allocations_per_call(fn))
+            except Exception as e:  # Report broken benchmarks rather than losing the whole run
+                result["error"] = f"{type(e).__name__}: {e}"
+            results.append(result)
+            print(format_result(result))
+    return results
+
+
+def format_result(result: dict, baseline: dict = None) -> str:
+    label = f"{result['name']}[{result['size']}]"
+    if "error" in result:
+        return f"{label:<40} ERROR {result['error']}"
+    line = f"{label:<40} {result['best_ns_per_op']:>14,.0f} ns/op {result['retained_blocks_per_op']:>8.1f} blocks/op " \
+           f"{result['peak_bytes_per_op']:>10,} peak B"
+    if baseline is not None and "error" not in baseline:
+        line += f"   x{baseline['best_ns_per_op'] / result['best_ns_per_op']:.2f} vs baseline"
+    return line
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the MultiCameraTracker geometry kernels")
+    parser.add_argument("--benchmarks", nargs="+", default=list(BENCHMARKS), choices=list(BENCHMARKS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[2, 16, 256],
+                        help="Number of detections per call, for the benchmarks that take a list of detections")
+    parser.add_argument("--min-time", type=float, default=0.2, help="Minimum seconds per timing repeat")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Path of a JSON file to save the results to")
+    parser.add_argument("--compare", help="Path of a previous JSON results file to compare against")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.benchmarks, args.sizes, args.min_time, args.seed)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {(r["name"], r["size"]): r for r in json.load(f)["results"]}
+        print(f"\nCompared to {args.compare}:")
+        for result in results:
+            print(format_result(result, baseline.get((result["name"], result["size"]))))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": sys.version,
+                "numpy": np.__version__,
+                "platform": platform.platform(),
+                "results": results,
+            }, f, indent=2)
+        print(f"Saved results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
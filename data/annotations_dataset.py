@@ -0,0 +1,138 @@
+"""
+Annotation only counterpart of TriangulationBohsDataset, for evaluation and replaying the ground truth through the
+tracker. It is built straight from the parsed xml annotations (see data.utils.read_bohs_ground_truths), so it never
+opens an image, and doesn't need torch/ PIL/ cv2.
+
+The detections are in raw image coordinates, as annotated, so the tracker has to mirror Jetson3's x itself, i.e. be
+created with mirrored_cameras=utils.config.MIRRORED_CAMERAS. The default MultiCameraTracker() doesn't mirror anything.
+
+Usage:
+    dataset = AnnotationsDataset(annotations_folder_path, cameras=("jetson3_1_4_2022_time__20_40_14_25",
+                                                                    "jetson1_date_01_04_2022_time__20_40_14_25"))
+    tracker = MultiCameraTracker(mirrored_cameras=MIRRORED_CAMERAS)
+    tracker.add_camera(1, JETSON1_REAL_WORLD)
+    tracker.add_camera(3, JETSON3_REAL_WORLD)
+    # Frame by frame, like the live system
+    for detections in dataset:
+        tracker.multi_camera_analysis(detections)
+    # Or the whole match at once
+    results = tracker.analyze_sequence(dataset.detections_array())
+"""
+import re
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from data.utils import read_bohs_ground_truths
+from utils.data_classes import DETECTIONS_DTYPE, Detections
+
+
+def camera_id_from_name(camera_name: str) -> int:
+    """
+    Tracker camera id of a Bohs sequence, from the jetson number at the start of its name, i.e.
+    "jetson3_1_4_2022_time__20_40_14_25" -> 3
+    """
+    match = re.match(r'jetson(\d+)', camera_name)
+    if match is None:
+        raise ValueError(f"Can't get the camera id from {camera_name}, pass camera_ids explicitly")
+    return int(match.group(1))
+
+
+class AnnotationsDataset:
+    def __init__(
+            self,
+            annotations_folder_path: str,
+            cameras: Sequence[str],
+            camera_ids: Optional[Sequence[int]] = None,
+            start_frame: Optional[int] = None,
+            end_frame: Optional[int] = None,
+            only_matching_frames: bool = False,
+            probability: float = 0.9,
+    ):
+        """
+        :param annotations_folder_path: Path to the 'annotations' folder, with a <camera>.xml per camera
+        :param cameras: Names of the sequences (the xml files without the extension)
+        :param camera_ids: Tracker camera id of each sequence, defaults to camera_id_from_name()
+        :param start_frame: First frame number to include
+        :param end_frame: Frame number to stop before
+        :param only_matching_frames: Only include frames where every camera has the ball, otherwise frames where any
+            camera does
+        :param probability: Probability given to the detections (the same as utils.utils.x_y_to_detection by default)
+        """
+        self.cameras: List[str] = list(cameras)
+        self.camera_ids: List[int] = list(camera_ids) if camera_ids is not None else \
+            [camera_id_from_name(camera) for camera in self.cameras]
+        assert len(self.camera_ids) == len(self.cameras), "Need one camera id per camera"
+        self.probability: float = probability
+
+        ground_truths = read_bohs_ground_truths(annotations_folder_path, [f'{camera}.xml' for camera in self.cameras])
+        self.gt_annotations = {camera: ground_truths[f'{camera}.xml'] for camera in self.cameras}
+
+        # Every annotation of every camera as columns, sorted by frame (stable, so the xml order is kept within a
+        # frame, and the cameras are in the order they were given)
+        annotations = [self.gt_annotations[camera] for camera in self.cameras]
+        frames = np.concatenate([a.frames for a in annotations])
+        camera_ids_column = np.concatenate([np.full(len(a.frames), camera_id, dtype=np.int64)
+                                            for a, camera_id in zip(annotations, self.camera_ids)])
+        xs = np.concatenate([a.xs for a in annotations]).astype(np.float64)
+        ys = np.concatenate([a.ys for a in annotations]).astype(np.float64)
+
+        keep = np.ones(len(frames), dtype=bool)
+        if start_frame is not None:
+            keep &= frames >= start_frame
+        if end_frame is not None:
+            keep &= frames < end_frame
+        if only_matching_frames:
+            common = annotations[0].frames
+            for a in annotations[1:]:
+                common = np.intersect1d(common, a.frames)
+            keep &= np.isin(frames, common)
+
+        order = np.argsort(frames[keep], kind='stable')
+        self.frames_column: np.ndarray = frames[keep][order]
+        self.camera_ids_column: np.ndarray = camera_ids_column[keep][order]
+        self.xs: np.ndarray = xs[keep][order]
+        self.ys: np.ndarray = ys[keep][order]
+
+        # The frames, and where each one's rows start/ end
+        self.frame_numbers, self.frame_starts = np.unique(self.frames_column, return_index=True)
+        self.frame_ends: np.ndarray = np.append(self.frame_starts[1:], len(self.frames_column))
+
+    def __len__(self) -> int:
+        return len(self.frame_numbers)
+
+    def __getitem__(self, ndx: int) -> List[Detections]:
+        """
+        :return: The detections of every camera in the ndx'th frame, with the frame number as the timestamp. The x
+            coordinates are raw, see the module docstring on mirroring
+        """
+        if ndx < 0:
+            ndx += len(self)
+        if not 0 <= ndx < len(self):
+            raise IndexError(f"Frame index {ndx} out of range for {len(self)} frames")
+        start, end = self.frame_starts[ndx], self.frame_ends[ndx]
+        frame = int(self.frame_numbers[ndx])
+        return [Detections(camera_id=camera_id, probability=self.probability, timestamp=frame, x=x, y=y, z=0)
+                for camera_id, x, y in zip(self.camera_ids_column[start:end].tolist(), self.xs[start:end].tolist(),
+                                           self.ys[start:end].tolist())]
+
+    def detections_array(self) -> np.ndarray:
+        """
+        :return: Every detection as a DETECTIONS_DTYPE array, ready for MultiCameraTracker.analyze_sequence() of a
+            tracker with mirrored_cameras=utils.config.MIRRORED_CAMERAS (the x coordinates are raw)
+        """
+        arr = np.empty(len(self.frames_column), dtype=DETECTIONS_DTYPE)
+        arr['camera_id'] = self.camera_ids_column
+        arr['timestamp'] = self.frames_column
+        arr['x'] = self.xs
+        arr['y'] = self.ys
+        arr['z'] = 0.
+        arr['probability'] = self.probability
+        return arr
+
+    def frames_by_camera(self) -> Dict[int, np.ndarray]:
+        """
+        :return: Dict of camera id -> sorted unique frame numbers where that camera has the ball
+        """
+        return {camera_id: np.unique(self.frames_column[self.camera_ids_column == camera_id])
+                for camera_id in self.camera_ids}
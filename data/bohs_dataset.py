@@ -4,14 +4,15 @@ import torch
 
 import numpy as np
 
-from copy import deepcopy
 from PIL import Image
-from typing import List, Tuple, Union
+from typing import Dict, List, Tuple, Union
 
-from data.utils import read_bohs_ground_truth
+from data.utils import ANNOTATIONS_CACHE_FOLDER, BoxTable, build_box_table, frame_index, join_frames, \
+    read_bohs_ground_truths
 
 BALL_BBOX_SIZE = 20
 BALL_LABEL = 1
+BOHS_DATASET_PATH = r"C:\Users\timf3\OneDrive - Trinity College Dublin\Documents\Documents\datasets\Datasets\Bohs\bohs-preprocessed"  # CVAT output
 
 
 # I could have probably used inheritance here to some extent at least... IDK
@@ -38,32 +39,37 @@ class TriangulationBohsDataset(torch.utils.data.Dataset):
                          "jetson3_1_4_2022_time__20_40_14_25",
                          "jetson1_date_01_04_2022_time__20_40_14_25"
                  ),
-
+                 frame_offsets: Union[List[int], Tuple] = None,
+                 dataset_path: str = BOHS_DATASET_PATH,
                  ):
         """
         Initializes the dataset.
-        :param image_folder_path: Path to 'bohs-preprocessed' folder
+        :param dataset_path: Path to 'bohs-preprocessed' folder, with the 'unpacked_jpg' and 'annotations' folders
         :param only_ball_frames: Whether to only use ball frames.
         :param whole_dataset: Whether to use the whole dataset.
         :param dataset_size: The size of the dataset to use if not using whole_dataset.
         :param transform: The transform to apply to the dataset.
+        :param frame_offsets: Per camera frame offset, frame f of the first camera is paired with frame
+            f + frame_offsets[i] - frame_offsets[0] of camera i. Defaults to all 0 (same frame numbers).
         """
         print("Whole dataset: ", whole_dataset)
         assert start_frame < end_frame, "Start frame must be smaller than end frame"
         # TODO: this needs tidying up.
-        self.dataset_path: str = r"C:\Users\timf3\OneDrive - Trinity College Dublin\Documents\Documents\datasets\Datasets\Bohs\bohs-preprocessed"  # CVAT output
+        self.dataset_path: str = dataset_path
         # self.dataset_path: str = r"C:\Users\timf3\PycharmProjects\BohsNet\data\processed_bohsnet_xml_output"  # BohsNet output
         self.only_ball_frames = only_ball_frames
         self.whole_dataset = whole_dataset
         self.dataset_size = dataset_size
         self.small_dataset = small_dataset
         self.cameras: List[str] = cameras
+        self.frame_offsets: List[int] = list(frame_offsets) if frame_offsets is not None else [0] * len(cameras)
         self.image_name_length = image_name_length
         self.image_extension: str = image_extension
 
         self.only_matching_frames: bool = only_matching_frames  # Only show frames where both cameras have a frame with a ball.
 
         self.gt_annotations: dict = {}
+        self.box_tables: Dict[str, BoxTable] = {}  # Ground truth boxes per camera, built once in get_image_list
 
         # The folder paths we will be using.
         self.image_folder_path = os.path.join(self.dataset_path, 'unpacked_jpg')
@@ -73,8 +79,9 @@ class TriangulationBohsDataset(torch.utils.data.Dataset):
 
         self.n_images = len(self.image_list)
         print(f"Total number of Bohs Images: {self.n_images}")
-        self.ball_images_ndx = set(self.get_elems_with_ball())
-        self.no_ball_images_ndx = set([ndx for ndx in range(self.n_images) if ndx not in self.ball_images_ndx])
+        ball_mask = self.get_ball_mask()
+        self.ball_images_ndx = set(np.flatnonzero(ball_mask).tolist())
+        self.no_ball_images_ndx = set(np.flatnonzero(~ball_mask).tolist())
         print(f'BOHS: {format(len(self.ball_images_ndx))} frames with the ball')
         print(f'BOHS: {(len(self.no_ball_images_ndx))} frames without the ball')
 
@@ -83,41 +90,44 @@ class TriangulationBohsDataset(torch.utils.data.Dataset):
         # We now want to filter image_list to only include frames where both cameras have the ball
         if self.only_matching_frames and len(cameras) > 1:
             # self.image_list = self.get_matching_frames()
-            self.get_matching_frames()
-            if self.small_dataset:
-                self.image_list = self.image_list[start_frame:end_frame]
+            # Only the frames in the window are built
+            self.get_matching_frames(slice(start_frame, end_frame) if self.small_dataset else slice(None))
 
     def __len__(self):
         return self.n_images
 
     def __getitem__(self, ndx):
         # Returns transferred image as a normalized tensor
-        image_path_1, image_path_2, camera_id_1, camera_id_2, image_ndx_1, image_ndx_2 = self.image_list[ndx]
+        # Items of image_list are (image_path_1, ..., image_path_n, camera_id_1, ..., camera_id_n, image_ndx_1, ...)
+        item = self.image_list[ndx]
+        n_cameras = len(item) // 3
+        image_paths = item[:n_cameras]
+        camera_ids = item[n_cameras:2 * n_cameras]
+        image_ndxs = item[2 * n_cameras:]
 
-        image_1 = Image.open(image_path_1)
-        image_2 = Image.open(image_path_2)
+        images, boxes, labels = [], [], []
+        for image_path, camera_id, image_ndx in zip(image_paths, camera_ids, image_ndxs):
+            image = Image.open(image_path)
 
-        try:
-            box_1, label_1 = self.get_annotations(camera_id_1, image_ndx_1)
-            box_2, label_2 = self.get_annotations(camera_id_2, image_ndx_2)
-        except:
-            box_1 = [[]]
-            label_1 = []
-            box_2 = [[]]
-            label_2 = []
+            try:
+                box, label = self.get_annotations(camera_id, image_ndx)
+            except:
+                box = [[]]
+                label = []
 
-        # Convert PIL image to numpy array
-        image_1 = np.array(image_1)
-        image_2 = np.array(image_2)
+            # Convert PIL image to numpy array
+            image = np.array(image)
 
-        # Write an exception to catch if box_1 is [[]]
-        if box_1 != [[]]:
-            image_1 = self.draw_bboxes(image_1, box_1)
+            # Write an exception to catch if box is [[]] (or there's no ball in the frame)
+            if isinstance(box, np.ndarray) and len(box):
+                image = self.draw_bboxes(image, box)
 
-        if box_2 != [[]]:
-            image_2 = self.draw_bboxes(image_2, box_2)
+            images.append(image)
+            boxes.append(box)
+            labels.append(label)
 
-        return image_1, image_2, box_1, box_2, label_1, label_2, image_path_1, image_path_2
+        # i.e. image_1, image_2, box_1, box_2, label_1, label_2, image_path_1, image_path_2 for two cameras
+        return (*images, *boxes, *labels, *image_paths)
 
     def get_image_list(self) -> None:
         """
@@ -134,9 +144,12 @@ class TriangulationBohsDataset(torch.utils.data.Dataset):
             assert os.path.exists(
                 annotations_file_path), f"Annotations file path {annotations_file_path} does not exist."
 
-            # Read ground truth data for the sequence
-            self.gt_annotations[camera_id] = read_bohs_ground_truth(annotations_path=self.annotations_folder_path,
-                                                                    xml_file_name=f'{camera_id}.xml')
+        # Read ground truth data for the sequences, the cameras' xml files are parsed in parallel (or read from cache)
+        ground_truths = read_bohs_ground_truths(annotations_path=self.annotations_folder_path,
+                                                xml_file_names=[f'{camera_id}.xml' for camera_id in self.cameras])
+        for camera_id in self.cameras:
+            self.gt_annotations[camera_id] = ground_truths[f'{camera_id}.xml']
+            self.box_tables[camera_id] = build_box_table(self.gt_annotations[camera_id], BALL_BBOX_SIZE, BALL_LABEL)
 
             # TODO: also note that we are only using images that include the ball currently
             # TODO: I need to adjust this! Make it so we include all frames... or at least, with the only_ball_frames flag, we can choose to only include frames with the ball.
@@ -149,108 +162,73 @@ class TriangulationBohsDataset(torch.utils.data.Dataset):
 
             images_path = os.path.join(self.image_folder_path, camera_id)
 
+            # One scan of the folder (or its manifest) rather than an os.path.exists() per frame
+            frame_paths = frame_index(images_path, self.image_extension,
+                                      manifest_path=os.path.join(self.annotations_folder_path, ANNOTATIONS_CACHE_FOLDER,
+                                                                 f'{camera_id}_frames.json'))
+            n_missing = 0
             for e in annotated_frames:
-                e = str(e)
-                e = e.zfill(self.image_name_length)
-                file_path = os.path.join(images_path, f'frame_{e}{self.image_extension}')
-                if os.path.exists(file_path):
-                    self.image_list.append((file_path, camera_id, e))
+                file_path = frame_paths.get(e)
+                if file_path is not None:
+                    self.image_list.append((file_path, camera_id, str(e).zfill(self.image_name_length)))
                 else:
-                    print("doesn't exist", file_path)
-                    print("check whether its frame_000001.png or just 000001.png")
+                    n_missing += 1
+            if n_missing:
+                print(f"{n_missing} frames of {camera_id} don't exist in {images_path}")
+                print("check whether its frame_000001.png or just 000001.png")
 
     def get_annotations(self, camera_id, image_ndx):
-        # Prepare annotations as list of boxes (xmin, ymin, xmax, ymax) in pixel coordinates
-        # and torch int64 tensor of corresponding labels
-        boxes = []
-        labels = []
-        # Add annotations for the ball position: positions of the ball centre
-
+        """
+        Annotations as boxes (xmin, ymin, xmax, ymax) in pixel coordinates, and the int64 labels of the boxes. These are
+        read only views into self.box_tables, so don't modify them in place.
+        :return: (n, 4) float64 boxes and (n,) labels, n is 0 if the ball isn't in the frame
+        """
         # Convert image_ndx to int -> 'frame_0000001' -> 1
         image_ndx = int(image_ndx[-7:])
+        return self.box_tables[camera_id].lookup(image_ndx)
 
-        ball_pos = self.gt_annotations[camera_id].ball_pos[int(image_ndx)]
-        if ball_pos != [[]]:
-            for (x, y) in ball_pos:
-                x1 = x - BALL_BBOX_SIZE // 2
-                x2 = x1 + BALL_BBOX_SIZE
-                y1 = y - BALL_BBOX_SIZE // 2
-                y2 = y1 + BALL_BBOX_SIZE
-                boxes.append((x1, y1, x2, y2))
-                labels.append(BALL_LABEL)
-
-        return np.array(boxes, dtype=np.float64), np.array(labels, dtype=np.int64)
+    def get_ball_mask(self) -> np.ndarray:
+        """
+        :return: (n_images,) bool, whether each image of self.image_list has the ball in its ground truth
+        """
+        # Entries are (path, camera_id, image_ndx)
+        camera_ids = np.array([camera_id for _, camera_id, _ in self.image_list], dtype=object)
+        frames = np.array([int(image_ndx) for _, _, image_ndx in self.image_list], dtype=np.int64)
+        ball_mask = np.zeros(len(self.image_list), dtype=bool)
+        for camera_id, table in self.box_tables.items():
+            in_camera = camera_ids == camera_id
+            ball_mask[in_camera] = table.ball_counts(frames[in_camera]) > 0
+        return ball_mask
 
     def get_elems_with_ball(self):
         # Get indexes of images with ball ground truth
-        ball_images_ndx = []
-        for ndx, (_, camera_id, image_ndx) in enumerate(self.image_list):
-            ball_pos = self.gt_annotations[camera_id].ball_pos[int(image_ndx)]
-            if len(ball_pos) > 0 and ball_pos != [[]]:  # With the collate function, empty lists are converted to [[]]
-                ball_images_ndx.append(ndx)
+        return np.flatnonzero(self.get_ball_mask()).tolist()
 
-        return ball_images_ndx
-
-    def get_matching_frames(self) -> List[Tuple[str, str, str, str, str, str]]:
+    def get_matching_frames(self, window: slice = slice(None)) -> List[tuple]:
         """
-            This function will rewrite self.image_list to contain only frames where both cameras have a ball.
-            And where each item of the list will be as follows...
+            This function will rewrite self.image_list to contain only frames that every camera has (with the ball in
+            every camera if only_ball_frames, as get_image_list only lists those frames then). Frames are paired on
+            their frame numbers (shifted by self.frame_offsets). Each item of the list will be as follows...
                 (image_path_1, image_path_2, camera_id_1, camera_id_2, image_ndx_1, image_ndx_2)
-        :return image_list: A list of tuples containing the image paths for both cameras, and the camera ids and image ndx
+            ... with one path, camera id and image ndx per camera for more than 2 cameras.
+        :param window: Slice of the matching frames to keep (i.e. for small_dataset), only these are built
+        :return image_list: A list of tuples with the image paths, camera ids and image ndx of every camera
         """
-        matching_frames = []
-
-        if self.only_ball_frames:
-
-            x = self.gt_annotations[self.cameras[0]].ball_pos
-
-            for frame in self.gt_annotations[self.cameras[0]].ball_pos.keys():
-                if frame in self.gt_annotations[self.cameras[1]].ball_pos.keys():
-                    if self.gt_annotations[self.cameras[0]].ball_pos[frame] != [[]] and \
-                            self.gt_annotations[self.cameras[1]].ball_pos[frame] != [
-                        []]:  # If both cameras have the ball
-                        matching_frames.append(frame)
-
-            image_list: List[str, str, str, str, str, str] = []
-
-            for frame in matching_frames:
-                frame = str(frame).zfill(self.image_name_length)
-                image_path_1 = os.path.join(self.image_folder_path, self.cameras[0],
-                                            f'frame_{frame}{self.image_extension}')
-                image_path_2 = os.path.join(self.image_folder_path, self.cameras[1],
-                                            f'frame_{frame}{self.image_extension}')
-                image_list.append((image_path_1, image_path_2, self.cameras[0], self.cameras[1], frame, frame))
-
-        else:
-            # This is for if we don't have only ball frames. However we still need to ensure that the frames are matching.
-            # And that image_list values have 6 values.
-
-            # Plan: I'll iterate through image list until I find the index of the first frame from the 2nd camera_id
-            i = 0
-            second_camera_index = 0
-            second_camera_id = self.cameras[1]
-            reached_second_camera_id: bool = False
-            while reached_second_camera_id is False:
-                if self.image_list[i][1] == second_camera_id:
-                    reached_second_camera_id = True
-                    second_camera_index = i
-                else:
-                    i += 1
-
-            # No we will will create two image lists for each camera id
-            image_list_1 = deepcopy(self.image_list[:second_camera_index])
-            image_list_2 = deepcopy(self.image_list[second_camera_index:])
-
-            # Now we will iterate through both lists and add the matching frames to the self.image_list
-            # Get the length of the shorter list
-            shorter_list_length = min(len(image_list_1), len(image_list_2))
+        # Sorted frame numbers and their paths per camera, from the (path, camera_id, image_ndx) entries of image_list
+        camera_frames, camera_paths = [], []
+        for camera_id in self.cameras:
+            entries = sorted((int(image_ndx), path) for path, entry_camera_id, image_ndx in self.image_list
+                             if entry_camera_id == camera_id)
+            camera_frames.append(np.array([frame for frame, _ in entries], dtype=np.int64))
+            camera_paths.append([path for _, path in entries])
 
-            image_list = []
+        matches = join_frames(camera_frames, self.frame_offsets)[window]
 
-            # Note that each image_list has all frames. So we can just iterate through the shorter list. But do note that it doesn't neccessarily start from the start. This is very hacky but will just get it done for now.
-            for i in range(shorter_list_length):
-                image_list.append((image_list_1[i][0], image_list_2[i][0], self.cameras[0], self.cameras[1],
-                                   f"frame_{image_list_1[i][2]}", f"frame_{image_list_2[i][2]}"))
+        image_list = []
+        for row in matches.tolist():
+            image_paths = tuple(paths[i] for paths, i in zip(camera_paths, row))
+            image_ndxs = tuple(str(frames[i]).zfill(self.image_name_length) for frames, i in zip(camera_frames, row))
+            image_list.append(image_paths + tuple(self.cameras) + image_ndxs)
 
         # Update all our variables to reflect the new image list
         self.image_list = image_list
@@ -314,8 +292,8 @@ class SingleCameraTriangulationDataset(TriangulationBohsDataset):
         # Convert PIL image to numpy array
         image_1 = np.array(image_1)
 
-        # Write an exception to catch if box_1 is [[]]
-        if box_1 != [[]]:
+        # Write an exception to catch if box_1 is [[]] (or there's no ball in the frame)
+        if isinstance(box_1, np.ndarray) and len(box_1):
             image_1 = self.draw_bboxes(image_1, box_1)
 
         return image_1, box_1, label_1, image_path_1
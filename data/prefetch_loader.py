@@ -0,0 +1,136 @@
+"""
+Loads the items of a dataset ahead of the consumer, in a pool of threads (or processes), so that decoding the JPEGs
+isn't done one at a time on the thread that is rendering/ tracking.
+
+Usage:
+    for image_1, image_2, box_1, box_2, label_1, label_2, image_path_1, image_path_2 in PrefetchLoader(dataset):
+        ...
+
+Items always come out in the order of the dataset, however long each one takes to load. At most `prefetch` items (or
+batches) are loaded or waiting to be consumed at any time, which is what bounds the memory (a pair of full resolution
+frames is ~12MB).
+
+Threads are the default: PIL and cv2 release the GIL while decoding and drawing, and the frames don't need to be
+pickled back from another process. This is also why we don't use torch's DataLoader, which would send every frame
+through a pipe from its worker processes and convert them to tensors.
+"""
+import collections
+import concurrent.futures
+import os
+from typing import Any, Callable, Deque, List, Optional, Sequence
+
+import numpy as np
+
+
+def is_image_column(column: Sequence) -> bool:
+    """
+    Whether every item of the column is an image, i.e. an array of the same shape with at least 2 dimensions.
+    """
+    return all(isinstance(item, np.ndarray) and item.ndim >= 2 and item.shape == column[0].shape for item in column)
+
+
+def collate_paired_frames(batch: List[tuple]) -> tuple:
+    """
+    Collates a batch of TriangulationBohsDataset items, i.e. (image_1, image_2, box_1, box_2, label_1, label_2,
+    image_path_1, image_path_2), or the same with any number of cameras, into the same tuple where the images are
+    stacked into (B, H, W, C) arrays and everything else is a list.
+    """
+    return tuple(np.stack(column) if is_image_column(column) else list(column) for column in zip(*batch))
+
+
+# The dataset of this worker process, set once by _init_worker() so that the tasks only have to send indices
+_worker_dataset: Optional[Sequence] = None
+
+
+def _init_worker(dataset: Sequence) -> None:
+    global _worker_dataset
+    _worker_dataset = dataset
+
+
+def _load_items(indices: range, collate_fn: Optional[Callable[[List[Any]], Any]], dataset: Sequence = None) -> Any:
+    """
+    Loads one task's worth of items. Module level so that it can be sent to a process pool, where the dataset is the
+    worker's _worker_dataset.
+    """
+    if dataset is None:
+        dataset = _worker_dataset
+    if collate_fn is None:
+        return dataset[indices[0]]
+    return collate_fn([dataset[ndx] for ndx in indices])
+
+
+class PrefetchLoader:
+    def __init__(
+            self,
+            dataset: Sequence,
+            batch_size: Optional[int] = None,
+            num_workers: Optional[int] = None,
+            prefetch: Optional[int] = None,
+            collate_fn: Optional[Callable[[List[Any]], Any]] = None,
+            use_processes: bool = False,
+    ):
+        """
+        :param dataset: Anything with __len__ and __getitem__ (i.e. TriangulationBohsDataset)
+        :param batch_size: Items per batch, collated with collate_fn (collate_paired_frames by default). None yields the
+            items one at a time, as iterating the dataset does
+        :param num_workers: Threads (or processes) loading items, defaults to the number of cores (at most 8). 0 loads
+            the items on the calling thread as they are needed, without a pool or any prefetching
+        :param prefetch: Maximum number of items (or batches) loaded ahead, defaults to 2 * num_workers
+        :param collate_fn: Function from a list of items to a batch, called in the worker
+        :param use_processes: Use a process pool rather than threads. Only worth it if loading an item holds the GIL,
+            the dataset has to be picklable (it is sent to each worker once, the tasks are just indices)
+        """
+        self.dataset = dataset
+        self.batch_size: Optional[int] = batch_size
+        self.num_workers: int = min(os.cpu_count() or 1, 8) if num_workers is None else num_workers
+        self.prefetch: int = prefetch or 2 * self.num_workers
+        if batch_size is not None and collate_fn is None:
+            collate_fn = collate_paired_frames
+        self.collate_fn = collate_fn
+        self.use_processes: bool = use_processes
+
+    def __len__(self) -> int:
+        if self.batch_size is None:
+            return len(self.dataset)
+        return (len(self.dataset) + self.batch_size - 1) // self.batch_size
+
+    def tasks(self) -> List[range]:
+        step = self.batch_size or 1
+        return [range(start, min(start + step, len(self.dataset))) for start in range(0, len(self.dataset), step)]
+
+    def __iter__(self):
+        collate_fn = self.collate_fn if self.batch_size is not None else None
+        if self.num_workers == 0:
+            for indices in self.tasks():
+                yield _load_items(indices, collate_fn, self.dataset)
+            return
+
+        if self.use_processes:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.num_workers, initializer=_init_worker,
+                                                              initargs=(self.dataset,))
+            dataset = None
+        else:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.num_workers,
+                                                             thread_name_prefix="prefetch")
+            dataset = self.dataset
+        tasks = iter(self.tasks())
+        in_flight: Deque[concurrent.futures.Future] = collections.deque()
+
+        try:
+            for indices in tasks:
+                in_flight.append(executor.submit(_load_items, indices, collate_fn, dataset))
+                if len(in_flight) >= self.prefetch:
+                    break
+
+            while in_flight:
+                result = in_flight.popleft().result()
+                # Refill before handing the result over, so the workers keep going while the consumer is busy
+                indices = next(tasks, None)
+                if indices is not None:
+                    in_flight.append(executor.submit(_load_items, indices, collate_fn, dataset))
+                yield result
+        finally:
+            # i.e. the consumer stopped early, don't load the rest
+            for future in in_flight:
+                future.cancel()
+            executor.shutdown(wait=True)
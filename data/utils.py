@@ -1,8 +1,15 @@
+import json
 import numpy as np
 import os
 
 from collections import defaultdict
-from typing import Tuple, List
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, NamedTuple, Optional, Sequence, Tuple, List
+
+# Bump this whenever the way the annotations are parsed changes, so that old cache files are ignored
+ANNOTATIONS_CACHE_VERSION: int = 1
+ANNOTATIONS_CACHE_FOLDER: str = '.cache'  # Created inside of the annotations folder
+FRAME_MANIFEST_VERSION: int = 1
 
 
 class SequenceAnnotations:
@@ -16,6 +23,209 @@ class SequenceAnnotations:
         # ball_pos contains list of ball positions (x,y) on each frame; multiple balls per frame are possible
         self.ball_pos = defaultdict(list)  # Dict[frame_number] = List[(x, y)]
 
+        # The same annotations as columns, in the order they are in the xml file (set by read_bohs_ground_truth)
+        self.frames: np.ndarray = np.empty(0, dtype=np.int64)
+        self.xs: np.ndarray = np.empty(0, dtype=np.int64)
+        self.ys: np.ndarray = np.empty(0, dtype=np.int64)
+
+
+class BoxTable(NamedTuple):
+    """
+    Ground truth ball boxes of one camera in CSR form: the boxes of frame f are boxes[offsets[f]:offsets[f + 1]].
+    Both arrays are read only, so the slices can be handed out without copying.
+    """
+    offsets: np.ndarray  # (max_frame + 2,) intp
+    boxes: np.ndarray  # (N, 4) float64 (xmin, ymin, xmax, ymax), sorted by frame
+    labels: np.ndarray  # (N,) int64
+
+    def lookup(self, frame: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: (n, 4) boxes and (n,) labels of the frame, n is 0 for frames without the ball
+        """
+        if not 0 <= frame < len(self.offsets) - 1:
+            return self.boxes[:0], self.labels[:0]
+        start, end = self.offsets[frame], self.offsets[frame + 1]
+        return self.boxes[start:end], self.labels[start:end]
+
+    def ball_counts(self, frames: np.ndarray) -> np.ndarray:
+        """
+        :return: Number of balls in each of the frames (0 for frames outside of the table)
+        """
+        frames = np.asarray(frames, dtype=np.int64)
+        counts = np.diff(self.offsets)
+        in_table = (frames >= 0) & (frames < len(counts))
+        return np.where(in_table, counts[np.where(in_table, frames, 0)], 0)
+
+
+def build_box_table(annotations: SequenceAnnotations, box_size: int, label: int) -> BoxTable:
+    """
+    Builds the BoxTable of a camera from the columns of its SequenceAnnotations. The boxes are box_size squares centred
+    on the ball, the same as TriangulationBohsDataset.get_annotations used to build per frame.
+    """
+    order = np.argsort(annotations.frames, kind='stable')  # Keep the xml order of the balls within a frame
+    frames = annotations.frames[order]
+    xs, ys = annotations.xs[order], annotations.ys[order]
+
+    n_frames = int(frames.max()) + 1 if len(frames) else 0
+    offsets = np.zeros(n_frames + 1, dtype=np.intp)
+    np.cumsum(np.bincount(frames, minlength=n_frames), out=offsets[1:])
+
+    x1 = xs - box_size // 2
+    y1 = ys - box_size // 2
+    boxes = np.column_stack((x1, y1, x1 + box_size, y1 + box_size)).astype(np.float64).reshape(-1, 4)
+    labels = np.full(len(frames), label, dtype=np.int64)
+    for arr in (offsets, boxes, labels):
+        arr.flags.writeable = False
+    return BoxTable(offsets, boxes, labels)
+
+
+def _parse_bohs_xml(xml_file_path: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Streams through the CVAT xml file with iterparse, rather than building the whole tree, and returns the ball
+    positions as columns.
+
+    The same elements as before are read: the children of the children of the root (i.e. <points> of a <track>) that
+    have a frame attribute.
+
+    :params xml_file_path: path to the xml file
+    :returns: (frames, xs, ys) int64 arrays, in the order they are in the file
+    """
+    import xml.etree.ElementTree as ET
+
+    frames, xs, ys = [], [], []
+    depth = 0
+    for event, elem in ET.iterparse(xml_file_path, events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 2 and 'frame' in elem.attrib:
+            # We convert the string first to a float, and then to an int
+            x, y = elem.attrib['points'].split(',')[:2]
+            frames.append(int(elem.attrib['frame']))
+            xs.append(int(float(x)))
+            ys.append(int(float(y)))
+        if depth <= 1:
+            elem.clear()  # Done with this track, free its points
+
+    return np.array(frames, dtype=np.int64), np.array(xs, dtype=np.int64), np.array(ys, dtype=np.int64)
+
+
+def _annotations_cache_path(xml_file_path: str) -> str:
+    folder, file_name = os.path.split(xml_file_path)
+    return os.path.join(folder, ANNOTATIONS_CACHE_FOLDER,
+                        f'{os.path.splitext(file_name)[0]}_v{ANNOTATIONS_CACHE_VERSION}.npz')
+
+
+def _read_annotations_cache(xml_file_path: str) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    :returns: The cached columns of the xml file, or None if there isn't a cache for the current version of the file
+    """
+    stat = os.stat(xml_file_path)
+    cache_path = _annotations_cache_path(xml_file_path)
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with np.load(cache_path) as cache:
+            if int(cache['mtime_ns']) == stat.st_mtime_ns and int(cache['size']) == stat.st_size:
+                return cache['frames'], cache['xs'], cache['ys']
+    except (OSError, KeyError, ValueError) as e:
+        print(f"Couldn't read the annotations cache {cache_path}, reparsing: {e}")
+    return None
+
+
+def load_bohs_columns(xml_file_path: str, use_cache: bool = True) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns the (frames, xs, ys) columns of _parse_bohs_xml(), from an .npz cache next to the xml file (in
+    ANNOTATIONS_CACHE_FOLDER) when there is one for the current version of the file.
+
+    The cache stores the mtime and size of the xml it was parsed from, and is reparsed (and rewritten) when either
+    changes. If the cache can't be written the columns are just parsed.
+    :params xml_file_path: path to the xml file
+    :params use_cache: Whether to read and write the cache at all
+    """
+    if not use_cache:
+        return _parse_bohs_xml(xml_file_path)
+
+    cached = _read_annotations_cache(xml_file_path)
+    if cached is not None:
+        return cached
+
+    # stat before parsing, so that if the file changes while we parse it the cache is already out of date
+    stat = os.stat(xml_file_path)
+    frames, xs, ys = _parse_bohs_xml(xml_file_path)
+    cache_path = _annotations_cache_path(xml_file_path)
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # Write to a temp file first, so that another process never reads a half written cache
+        temp_path = f'{cache_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez(f, frames=frames, xs=xs, ys=ys, mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        print(f"Couldn't write the annotations cache {cache_path}: {e}")
+    return frames, xs, ys
+
+
+def _scan_frames(images_path: str, image_extension: str) -> Dict[int, str]:
+    """
+    One os.scandir() pass over the folder, picking out the frame_XXXXXXX<image_extension> files.
+    :returns: Dict of frame number -> file name
+    """
+    frames = {}
+    with os.scandir(images_path) as entries:
+        for entry in entries:
+            name = entry.name
+            if name.startswith('frame_') and name.endswith(image_extension):
+                number = name[len('frame_'):len(name) - len(image_extension)]
+                if number.isdigit():
+                    frames[int(number)] = name
+    return frames
+
+
+def frame_index(images_path: str, image_extension: str = '.jpg', manifest_path: Optional[str] = None) -> Dict[int, str]:
+    """
+    Index of the frames of a camera's image folder, so that finding a frame is a dict lookup rather than an
+    os.path.exists() (a stat, which is slow on network storage) per frame.
+
+    With a manifest_path, the index is saved there as json along with the folder's mtime, and reused for as long as the
+    folder's mtime doesn't change (adding or removing files changes it). If the manifest can't be written the folder is
+    just scanned.
+    :param images_path: Folder with the frame_XXXXXXX.jpg images of one camera
+    :param image_extension: Extension of the images, including the dot
+    :param manifest_path: Path of the json manifest, or None to always scan the folder
+    :returns: Dict of frame number -> image path
+    """
+    mtime_ns = os.stat(images_path).st_mtime_ns
+    frames = None
+
+    if manifest_path is not None and os.path.exists(manifest_path):
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            if manifest['version'] == FRAME_MANIFEST_VERSION and manifest['mtime_ns'] == mtime_ns and \
+                    manifest['image_extension'] == image_extension:
+                frames = dict(zip(manifest['frames'], manifest['names']))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Couldn't read the frame manifest {manifest_path}, rescanning: {e}")
+
+    if frames is None:
+        frames = _scan_frames(images_path, image_extension)
+        if manifest_path is not None:
+            numbers = sorted(frames)
+            try:
+                os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+                temp_path = f'{manifest_path}.{os.getpid()}.tmp'
+                with open(temp_path, 'w') as f:
+                    json.dump({'version': FRAME_MANIFEST_VERSION, 'mtime_ns': mtime_ns,
+                               'image_extension': image_extension, 'frames': numbers,
+                               'names': [frames[number] for number in numbers]}, f)
+                os.replace(temp_path, manifest_path)
+            except OSError as e:
+                print(f"Couldn't write the frame manifest {manifest_path}: {e}")
+
+    return {number: os.path.join(images_path, name) for number, name in frames.items()}
+
 
 def _load_bohs_groundtruth(xml_file_path: str) -> dict:
     """
@@ -31,24 +241,9 @@ def _load_bohs_groundtruth(xml_file_path: str) -> dict:
         ... where the elements of the list are as follows [start_frame, end_frame, x, y]
     """
 
-    import xml.etree.ElementTree as ET
-    tree = ET.parse(xml_file_path)
-    root = tree.getroot()
-    # print("root.tage", root.tag)  # >>> annotations
-    # print("atribbute", root.attrib)  # {}
-
-    gt = {"BallPos": []}
-    for child in root:
-        for subchild in child:
-            if "frame" in subchild.attrib:
-                frame = int(subchild.attrib['frame'])
-                # We convert the string first to a float, and then to an int
-                x = int(float(subchild.attrib['points'].split(',')[0]))
-                y = int(float(subchild.attrib['points'].split(',')[1]))
-
-                # We put frame in twice simply to match FootAndBall dataloader
-                gt["BallPos"].append([frame, frame, x, y])
-    return gt
+    frames, xs, ys = load_bohs_columns(xml_file_path)
+    # We put frame in twice simply to match FootAndBall dataloader
+    return {"BallPos": [[frame, frame, x, y] for frame, x, y in zip(frames.tolist(), xs.tolist(), ys.tolist())]}
 
 
 def _create_bohs_annotations(gt: dict, frame_shape: Tuple[int, int] = (1080, 1920)) -> SequenceAnnotations:
@@ -73,16 +268,86 @@ def _create_bohs_annotations(gt: dict, frame_shape: Tuple[int, int] = (1080, 192
     return annotations
 
 
-def read_bohs_ground_truth(annotations_path: str, xml_file_name: str) -> SequenceAnnotations:
+def _annotations_from_columns(frames: np.ndarray, xs: np.ndarray, ys: np.ndarray) -> SequenceAnnotations:
+    """
+    Same SequenceAnnotations as _create_bohs_annotations(_load_bohs_groundtruth()), straight from the columns.
+    """
+    annotations = SequenceAnnotations()
+    annotations.frames, annotations.xs, annotations.ys = frames, xs, ys
+    ball_pos = annotations.ball_pos
+    for frame, x, y in zip(frames.tolist(), xs.tolist(), ys.tolist()):
+        ball_pos[frame].append((x, y))
+    return annotations
+
+
+def read_bohs_ground_truth(annotations_path: str, xml_file_name: str, use_cache: bool = True) -> SequenceAnnotations:
     """
     Reads the groundtruth xml file and returns a SequenceAnnotations object
 
     :params annotations_path: path to the 'annotations' folder
     :params xml_file_name: name of the xml file
+    :params use_cache: Whether to use the parsed annotations cache, see load_bohs_columns()
     """
     xml_file_path = os.path.join(annotations_path, xml_file_name)
-    gt = _load_bohs_groundtruth(xml_file_path)
-    return _create_bohs_annotations(gt)
+    return _annotations_from_columns(*load_bohs_columns(xml_file_path, use_cache=use_cache))
+
+
+def read_bohs_ground_truths(
+        annotations_path: str,
+        xml_file_names: Sequence[str],
+        use_cache: bool = True,
+        max_workers: Optional[int] = None,
+) -> Dict[str, SequenceAnnotations]:
+    """
+    read_bohs_ground_truth() for several cameras. The files that need parsing (no up to date cache) are parsed in
+    parallel in a process pool, the xml parsing being pure python it wouldn't gain anything from threads.
+
+    :params annotations_path: path to the 'annotations' folder
+    :params xml_file_names: names of the xml files
+    :params max_workers: Number of processes, defaults to one per file that needs parsing
+    :returns: Dict of xml file name -> SequenceAnnotations
+    """
+    xml_file_paths = [os.path.join(annotations_path, xml_file_name) for xml_file_name in xml_file_names]
+    columns = [_read_annotations_cache(path) if use_cache else None for path in xml_file_paths]
+
+    # Only start the processes when more than one file actually needs parsing
+    to_parse = [ndx for ndx, cols in enumerate(columns) if cols is None]
+    if len(to_parse) > 1:
+        with ProcessPoolExecutor(max_workers=max_workers or len(to_parse)) as executor:
+            parsed = executor.map(load_bohs_columns, [xml_file_paths[ndx] for ndx in to_parse],
+                                  [use_cache] * len(to_parse))
+            for ndx, cols in zip(to_parse, parsed):
+                columns[ndx] = cols
+    elif to_parse:
+        columns[to_parse[0]] = load_bohs_columns(xml_file_paths[to_parse[0]], use_cache=use_cache)
+
+    return {xml_file_name: _annotations_from_columns(*cols) for xml_file_name, cols in zip(xml_file_names, columns)}
+
+
+def join_frames(camera_frames: Sequence[np.ndarray], frame_offsets: Optional[Sequence[int]] = None) -> np.ndarray:
+    """
+    Joins the frames of several cameras on their frame numbers: the rows of the result are the frames every camera
+    has, as an index into each camera's array.
+
+    Frame f of the first camera is matched with frame f + frame_offsets[c] - frame_offsets[0] of camera c, i.e. the
+    offsets are where each camera's frame numbering starts on a common timeline.
+
+    :param camera_frames: Per camera sorted array of unique frame numbers
+    :param frame_offsets: Per camera frame offset, defaults to all 0
+    :return: (n_matches, n_cameras) intp array, row i is the i'th common frame, column c the index of it in
+        camera_frames[c]. Rows are in increasing frame order.
+    """
+    if frame_offsets is None:
+        frame_offsets = [0] * len(camera_frames)
+    assert len(frame_offsets) == len(camera_frames), "Need one frame offset per camera"
+    timelines = [np.asarray(frames, dtype=np.int64) - offset for frames, offset in zip(camera_frames, frame_offsets)]
+    if not timelines:
+        return np.empty((0, 0), dtype=np.intp)
+
+    common = timelines[0]
+    for timeline in timelines[1:]:
+        common = np.intersect1d(common, timeline, assume_unique=True)
+    return np.stack([np.searchsorted(timeline, common) for timeline in timelines], axis=1)
 
 
 def get_xy_from_box(box: np.array) -> Tuple[int, int]:
@@ -5,25 +5,28 @@ import os
 
 from time import sleep
 
-from data import bohs_dataset
+from data.annotations_dataset import camera_id_from_name
 from iot.IOTClient import IOTClient
 from iot.IOTContext import IOTContext, IOTCredentials
 from iot.config import CAMERA_TOPIC
 from utils import timer as timer
-from triangulation_logic import MultiCameraTracker
-from triangulation_visualization import JETSON1_REAL_WORLD, JETSON3_REAL_WORLD, get_xy_from_box, x_y_to_detection
+from utils.config import MIRRORED_CAMERAS
+from utils.utils import get_xy_from_box, x_y_to_detection
+from triangulation_logic import MultiCameraTracker, JETSON1_REAL_WORLD, JETSON3_REAL_WORLD
 
 
 from typing import List, Optional, Generator
 
 
 class CameraNodeScript:
-    def __init__(self, cameras: Optional[List[str]], camera_id: str, iot_manager: IOTClient):
+    def __init__(self, cameras: Optional[List[str]], camera_id: int, iot_manager: IOTClient):
+        # The dataset pulls in torch, so it's only imported when we actually replay a recording
+        from data import bohs_dataset
         self.dataset = bohs_dataset.create_triangulation_dataset(small_dataset=False, cameras=cameras, single_camera=True)
-        self.tracker = MultiCameraTracker()
+        self.tracker = MultiCameraTracker(mirrored_cameras=MIRRORED_CAMERAS)
         self.tracker.add_camera(1, JETSON1_REAL_WORLD)
         self.tracker.add_camera(3, JETSON3_REAL_WORLD)
-        self.camera_id: str = camera_id
+        self.camera_id: int = int(camera_id)  # Sent in every payload, and the camera_id of its detection
         self.iot_manager: IOTClient = iot_manager
 
     def get_triangulated_data(self) -> Generator:
@@ -32,12 +35,13 @@ class CameraNodeScript:
 
             if box.size != 0:
                 x_3, y_3 = get_xy_from_box(box)
-                x_3 = 1920 - x_3  # note: mirroring for Jetson3 to bring the origins a bit closer together in the diff plances (in my mind at least, haven't tested to see if it works better yet)
-                cam_det = x_y_to_detection(x_3, y_3, i, camera_id=3)
+                # note: the raw x is sent, Jetson3's mirroring is done by the tracker (utils.config.MIRRORED_CAMERAS)
+                cam_det = x_y_to_detection(x_3, y_3, i, camera_id=self.camera_id)
 
                 payload = {
                     "camera": self.camera_id,
                     "detection": cam_det,
+                    "timestamp": i,  # So the fusion service can synchronize frames without a detection too
                     "image_path": image_path,
                 }
 
@@ -45,6 +49,7 @@ class CameraNodeScript:
                 payload = {
                     "camera": self.camera_id,
                     "detection": None,
+                    "timestamp": i,
                     "image_path": image_path,
                 }
 
@@ -64,7 +69,8 @@ def main():
     # Parse arguments
     parser = argparse.ArgumentParser(description="AWS IoT Core MQTT Client")
     parser.add_argument("-p", "--cameras", action="store", default="jetson1_date_01_04_2022_time__20_40_14_25", dest="cameras", help="The camera path as a string")
-    parser.add_argument("-n", "--camera_id", action="store", default="0", dest="camera_id", help="The camera ID (required)")
+    parser.add_argument("-n", "--camera_id", action="store", type=int, default=None, dest="camera_id",
+                        help="The tracker camera ID, defaults to the jetson number of the camera path")
     parser.add_argument("-c", "--cert_path", action="store",
                         default="../certificates/tims/camera_send_messages/3da7dc68bfa5d09b723ebb9068a96d54550c1555969088ec7398103e772196d2-certificate.pem.crt",
                         dest="cert_path", help="Cert ending in .pem.crt")
@@ -98,7 +104,8 @@ def main():
 
     # Convert the string to a list
     cameras = args.cameras.split(",")
-    camera_node_script = CameraNodeScript(cameras=cameras, camera_id=args.camera_id, iot_manager=iot_manager)
+    camera_id = args.camera_id if args.camera_id is not None else camera_id_from_name(cameras[0])
+    camera_node_script = CameraNodeScript(cameras=cameras, camera_id=camera_id, iot_manager=iot_manager)
     camera_node_script.run()
 
 
@@ -0,0 +1,326 @@
+"""
+Fusion service: consumes the payloads published by the camera nodes (see camera_node_script.py), synchronizes them by
+timestamp and runs the MultiCameraTracker on them in real time, publishing the fused ball positions.
+
+Camera nodes connect over a local transport (TCP or a Unix socket) and send one JSON payload per line, or run in the
+same process and publish through a LocalIOTClient (the in-process stand-in for iot.IOTClient).
+
+Run from the root of the repo:
+    python -m practical_testing.fusion_service --port 8765
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import logging
+from dataclasses import asdict
+from typing import Callable, Dict, List, Optional
+
+from triangulation_logic import MultiCameraTracker, JETSON1_REAL_WORLD, JETSON3_REAL_WORLD
+from utils.config import MIRRORED_CAMERAS
+from utils.data_classes import Detections
+from utils.frame_synchronizer import FrameSynchronizer, SyncedFrame
+
+
+logger = logging.getLogger(__name__)
+
+CONNECTION_QUEUE_SIZE: int = 256  # Payloads buffered per camera node connection before we stop reading from it
+FRAME_QUEUE_SIZE: int = 64  # Synchronized frames waiting for the tracker before the connections are paused
+
+
+def encode_payload(payload: Dict) -> bytes:
+    """
+    Camera node payload -> one line of JSON. The Detections object is sent as a dict.
+    """
+    payload = dict(payload)
+    if payload.get("detection") is not None:
+        payload["detection"] = asdict(payload["detection"])
+    return json.dumps(payload).encode() + b"\n"
+
+
+def decode_payload(line: bytes) -> Dict:
+    payload = json.loads(line)
+    if not isinstance(payload, dict):
+        raise TypeError(f"Payload should be a JSON object, got {type(payload).__name__}")
+    if payload.get("detection") is not None:
+        payload["detection"] = Detections(**payload["detection"])
+    return payload
+
+
+def fused_payload(frame: SyncedFrame, result) -> Dict:
+    """
+    What gets published for every frame: the tracker result (ThreeDPoints, OutOfBounds or FailedCommonSense) as a dict,
+    along with the frame's timestamp and the cameras that contributed to it.
+    """
+    return {
+        "timestamp": frame.timestamp,
+        "result": type(result).__name__,
+        "x": result.x,
+        "y": result.y,
+        "z": result.z,
+        "cameras": list(frame.cameras),
+        "complete": frame.complete,
+    }
+
+
+class LocalIOTClient:
+    """
+    In-process stand-in for iot.IOTClient, with the same connect()/ disconnect()/ publish(payload=...) interface.
+    Published payloads are kept in self.published and passed to on_publish if given.
+    """
+
+    def __init__(
+            self,
+            on_publish: Optional[Callable[[Dict], None]] = None,
+            on_disconnect: Optional[Callable[[], None]] = None,
+    ):
+        self.on_publish = on_publish
+        self.on_disconnect = on_disconnect
+        self.published: List[Dict] = []
+
+    def connect(self) -> concurrent.futures.Future:
+        future = concurrent.futures.Future()
+        future.set_result(None)
+        return future
+
+    def disconnect(self) -> concurrent.futures.Future:
+        if self.on_disconnect is not None:
+            self.on_disconnect()
+        return self.connect()
+
+    def publish(self, payload: Dict) -> None:
+        self.published.append(payload)
+        if self.on_publish is not None:
+            self.on_publish(payload)
+
+
+def logging_publisher() -> LocalIOTClient:
+    """
+    Default publisher of serve(), logs every fused payload as a line of JSON.
+    """
+    return LocalIOTClient(on_publish=lambda payload: logger.info(json.dumps(payload)))
+
+
+class FusionService:
+    """
+    Every connection gets its own bounded queue of payloads, which a pump task moves into the FrameSynchronizer. The
+    synchronized frames go through another bounded queue to a single tracker task, which runs the tracker in a worker
+    thread (so the event loop keeps reading from the cameras) and publishes the results.
+
+    Backpressure: if the tracker falls behind, the frame queue fills up, the pumps stop draining the connection queues,
+    and once those are full we stop reading from the sockets, so TCP flow control slows the camera nodes down rather
+    than us buffering without bound.
+    """
+
+    def __init__(
+            self,
+            tracker: MultiCameraTracker,
+            publisher,
+            camera_ids: List[int] = None,
+            max_wait: float = 0.1,
+            connection_queue_size: int = CONNECTION_QUEUE_SIZE,
+            frame_queue_size: int = FRAME_QUEUE_SIZE,
+    ):
+        """
+        :param tracker: Tracker with its cameras already added. The camera nodes send raw image coordinates, so it has
+            to mirror utils.config.MIRRORED_CAMERAS (i.e. MultiCameraTracker(mirrored_cameras=MIRRORED_CAMERAS))
+        :param publisher: Anything with a publish(payload=...) method (i.e. an IOTClient or LocalIOTClient), that the
+            fused positions are published to
+        :param camera_ids: Cameras making up a complete frame, defaults to all of the tracker's cameras
+        :param max_wait: Maximum seconds to wait for every camera to report for a timestamp
+        """
+        unmirrored = [camera_id for camera_id in MIRRORED_CAMERAS
+                      if camera_id in tracker.camera_ids and camera_id not in tracker.mirrored_cameras]
+        if unmirrored:
+            raise ValueError(f"Cameras {unmirrored} send raw image coordinates but the tracker doesn't mirror them, "
+                             f"create it with mirrored_cameras=utils.config.MIRRORED_CAMERAS")
+        self.tracker = tracker
+        self.publisher = publisher
+        if camera_ids is None:
+            camera_ids = [int(camera_id) for camera_id in tracker.camera_ids]
+        self.synchronizer = FrameSynchronizer(camera_ids=camera_ids, max_wait=max_wait)
+        self.connection_queue_size = connection_queue_size
+        self.frame_queue_size = frame_queue_size
+
+        # The tracker is stateful, so the frames have to be processed one at a time and in order
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="tracker")
+        self.frames: Optional[asyncio.Queue] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.tasks: List[asyncio.Task] = []
+        self.connection_tasks: List[asyncio.Task] = []
+        self.servers: List[asyncio.AbstractServer] = []
+
+        self.payloads_received: int = 0
+        self.bad_payloads: int = 0
+        self.frames_published: int = 0
+
+    async def start(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.frames = asyncio.Queue(maxsize=self.frame_queue_size)
+        self.tasks = [asyncio.ensure_future(self.track()), asyncio.ensure_future(self.deadlines())]
+
+    async def serve_tcp(self, host: str = "127.0.0.1", port: int = 0) -> asyncio.AbstractServer:
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        self.servers.append(server)
+        return server
+
+    async def serve_unix(self, path: str) -> asyncio.AbstractServer:
+        server = await asyncio.start_unix_server(self.handle_connection, path)
+        self.servers.append(server)
+        return server
+
+    def local_client(self) -> LocalIOTClient:
+        """
+        Creates a LocalIOTClient for a camera node running in another thread of this process. publish() blocks that
+        thread while the connection's queue is full, and disconnect() ends the connection. Must be called from the
+        event loop, after start().
+        """
+        queue = asyncio.Queue(maxsize=self.connection_queue_size)
+        self.connection_tasks.append(asyncio.ensure_future(self.pump(queue)))
+
+        def on_publish(payload: Dict) -> None:
+            asyncio.run_coroutine_threadsafe(queue.put(payload), self.loop).result()
+
+        def on_disconnect() -> None:
+            asyncio.run_coroutine_threadsafe(queue.put(None), self.loop).result()
+
+        return LocalIOTClient(on_publish=on_publish, on_disconnect=on_disconnect)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        queue = asyncio.Queue(maxsize=self.connection_queue_size)
+        pump = asyncio.ensure_future(self.pump(queue))
+        self.connection_tasks.append(pump)
+        try:
+            async for line in reader:
+                if not line.strip():
+                    continue
+                try:
+                    payload = decode_payload(line)
+                except (ValueError, TypeError) as e:
+                    self.bad_payloads += 1
+                    print(f"Dropping bad payload: {e}")
+                    continue
+                await queue.put(payload)
+        finally:
+            await queue.put(None)  # Tells the pump that the connection is done
+            await pump
+            writer.close()
+
+    async def pump(self, queue: asyncio.Queue) -> None:
+        """
+        Moves payloads from one connection's queue into the synchronizer, until it gets None. The camera of a payload is
+        always its "camera" field, with or without a detection.
+        """
+        while True:
+            payload = await queue.get()
+            if payload is None:
+                return
+            self.payloads_received += 1
+            try:
+                if not isinstance(payload, dict):
+                    raise TypeError(f"Payload should be a dict, got {type(payload).__name__}")
+                detection = payload.get("detection")
+                camera_id = int(payload["camera"])
+                if detection is not None and int(detection.camera_id) != camera_id:
+                    raise KeyError(f"Detection of camera {detection.camera_id} sent as camera {camera_id}")
+                if "timestamp" in payload:
+                    timestamp = payload["timestamp"]
+                elif detection is not None:
+                    timestamp = detection.timestamp
+                else:
+                    raise KeyError("Payload has neither a timestamp nor a detection")
+                frames = self.synchronizer.push(camera_id, timestamp, [detection] if detection is not None else [])
+            except (KeyError, ValueError, TypeError) as e:
+                self.bad_payloads += 1
+                print(f"Dropping payload: {e}")
+                continue
+            for frame in frames:
+                await self.frames.put(frame)
+
+    async def deadlines(self) -> None:
+        """
+        Emits frames whose deadline passed, for when a camera stops sending.
+        """
+        while True:
+            deadline = self.synchronizer.next_deadline()
+            delay = self.synchronizer.max_wait if deadline is None else deadline - self.synchronizer.clock()
+            await asyncio.sleep(max(delay, 0.001))
+            for frame in self.synchronizer.poll():
+                await self.frames.put(frame)
+
+    async def track(self) -> None:
+        while True:
+            frames = [await self.frames.get()]
+            # Take everything that is already waiting, so a backlog costs one executor hop rather than one per frame
+            while not self.frames.empty():
+                frames.append(self.frames.get_nowait())
+            try:
+                results = await self.loop.run_in_executor(self.executor, self.run_tracker, frames)
+                for frame, result in zip(frames, results):
+                    self.publisher.publish(payload=fused_payload(frame, result))
+                    self.frames_published += 1
+            except Exception as e:  # Keep the service running, but we lose these frames
+                print(f"Error tracking frames {[frame.timestamp for frame in frames]}: {e!r}")
+            for _ in frames:
+                self.frames.task_done()
+
+    def run_tracker(self, frames: List[SyncedFrame]) -> List:
+        return [self.tracker.multi_camera_analysis(frame.detections) for frame in frames]
+
+    async def close(self) -> None:
+        """
+        Stops accepting connections, waits for the connected camera nodes to finish, then tracks and publishes whatever
+        is still buffered.
+        """
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+        await asyncio.gather(*self.connection_tasks)
+        for frame in self.synchronizer.flush():
+            await self.frames.put(frame)
+        await self.frames.join()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.executor.shutdown()
+
+
+async def serve(args, publisher=None) -> None:
+    """
+    Runs the fusion service until it is cancelled.
+    :param args: The parsed command line arguments, see main()
+    :param publisher: Anything with a publish(payload=...) method (i.e. an IOTClient) that the fused positions are
+        published to, defaults to logging_publisher()
+    """
+    # The camera nodes send raw image coordinates
+    tracker = MultiCameraTracker(mirrored_cameras=MIRRORED_CAMERAS, use_lut=args.use_lut)
+    tracker.add_camera(1, JETSON1_REAL_WORLD)
+    tracker.add_camera(3, JETSON3_REAL_WORLD)
+
+    if publisher is None:
+        publisher = logging_publisher()
+    service = FusionService(tracker, publisher, max_wait=args.max_wait)
+    await service.start()
+    if args.unix_path:
+        server = await service.serve_unix(args.unix_path)
+    else:
+        server = await service.serve_tcp(args.host, args.port)
+    logger.info(f"Fusion service listening on {[s.getsockname() for s in server.sockets]}")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fuses camera node payloads with the MultiCameraTracker")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix_path", default=None, help="Listen on this Unix socket instead of TCP")
+    parser.add_argument("--max_wait", type=float, default=0.1, help="Seconds to wait for every camera per timestamp")
+    parser.add_argument("--use_lut", action="store_true", help="Project detections with the pitch lookup tables")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    asyncio.run(serve(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""
+Hosts the trackers of many concurrent matches (i.e. several pitches) on one machine, sharded over a pool of worker
+processes so that every core gets used.
+
+Every match is routed to one worker by a stable hash of its id, and that worker keeps the match's MultiCameraTracker
+for as long as the match runs, so the tracker state never moves between processes. The calibration (homographies,
+field masks and camera centres) is the same for every tracker, so it is put in shared memory once and every worker maps
+it read only, rather than each tracker building (and holding) its own field masks. The trackers of the workers also
+take the calibration tracker's projection settings (mirroring and lookup tables), so they see the detections the same
+way it does.
+
+Detections are sent to the workers as one DETECTIONS_DTYPE structured array per batch (a single contiguous buffer to
+pickle, rather than a list of objects), and come back as a RESULT_DTYPE array.
+
+Usage:
+    host = MatchHost(calibration_tracker, n_workers=4)
+    host.submit("pitch_1", detections_array)
+    match_id, results = host.get_result()
+    host.shutdown()
+"""
+import multiprocessing as mp
+import queue
+import zlib
+from multiprocessing import shared_memory
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from triangulation_logic import MultiCameraTracker
+from utils.data_classes import DETECTIONS_DTYPE, FailedCommonSense, OutOfBounds, ThreeDPoints
+
+# The tracker results sent back from the workers, one row per frame. kind indexes RESULT_TYPES.
+RESULT_DTYPE = np.dtype([
+    ('timestamp', np.float64),
+    ('x', np.float64),
+    ('y', np.float64),
+    ('z', np.float64),
+    ('kind', np.int8),
+])
+RESULT_TYPES: Tuple[type, ...] = (ThreeDPoints, OutOfBounds, FailedCommonSense)
+
+# The arrays of the tracker that make up the calibration
+CALIBRATION_ARRAYS: Tuple[str, ...] = ('camera_ids', 'homography_stack', 'field_mask_stack', 'camera_centres')
+# The settings of the tracker that change how detections are projected (and where the tables it projects them with are
+# cached), so they go along with the calibration
+CALIBRATION_SETTINGS: Tuple[str, ...] = ('mirrored_cameras', 'use_lut', 'lut_interpolation', 'use_cache', 'cache_dir')
+
+
+def worker_for(match_id: Hashable, n_workers: int) -> int:
+    """
+    Index of the worker a match is routed to. crc32 rather than hash(), as hash() of a str is different in every
+    process.
+    """
+    return zlib.crc32(str(match_id).encode()) % n_workers
+
+
+def results_to_array(results: List[ThreeDPoints]) -> np.ndarray:
+    arr = np.empty(len(results), dtype=RESULT_DTYPE)
+    for i, result in enumerate(results):
+        arr[i] = (result.timestamp, result.x, result.y, result.z, RESULT_TYPES.index(type(result)))
+    return arr
+
+
+def array_to_results(arr: np.ndarray) -> List[ThreeDPoints]:
+    return [RESULT_TYPES[kind](x=x, y=y, z=z, timestamp=timestamp)
+            for timestamp, x, y, z, kind in arr.tolist()]
+
+
+class SharedCalibration:
+    """
+    The calibration arrays of a tracker, copied into shared memory blocks, along with its CALIBRATION_SETTINGS in
+    self.settings and its field polygons (which aren't in utils.config for cameras added with their own) in
+    self.field_polygons. The creating process owns the blocks and must call unlink() when done, the workers attach() to them
+    with the picklable self.descriptor. The workers are
+    started by the owner so they share its resource tracker, which is what keeps a worker exiting from unlinking the
+    blocks.
+    """
+
+    def __init__(self, tracker: MultiCameraTracker):
+        self.blocks: List[shared_memory.SharedMemory] = []
+        self.descriptor: Dict[str, Tuple[str, tuple, str]] = {}
+        self.settings: Dict[str, object] = {name: getattr(tracker, name) for name in CALIBRATION_SETTINGS}
+        self.field_polygons: List[tuple] = [tuple(map(tuple, polygon)) for polygon in tracker.field_polygons]
+        for name in CALIBRATION_ARRAYS:
+            arr = np.ascontiguousarray(getattr(tracker, name))
+            block = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=block.buf)[...] = arr
+            self.blocks.append(block)
+            self.descriptor[name] = (block.name, arr.shape, arr.dtype.str)
+
+    @staticmethod
+    def attach(descriptor: Dict[str, Tuple[str, tuple, str]]) -> Tuple[Dict[str, np.ndarray], list]:
+        """
+        Maps the shared calibration into this process.
+        :return: Dict of read only arrays, and the SharedMemory blocks, which have to be kept alive as long as the
+            arrays are used
+        """
+        arrays, blocks = {}, []
+        for name, (block_name, shape, dtype) in descriptor.items():
+            block = shared_memory.SharedMemory(name=block_name)
+            arr = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+            arr.flags.writeable = False
+            arrays[name] = arr
+            blocks.append(block)
+        return arrays, blocks
+
+    def unlink(self) -> None:
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+def worker_main(descriptor: Dict, inbox: mp.Queue, outbox: mp.Queue, tracker_kwargs: Dict) -> None:
+    """
+    Worker process loop. Messages in the inbox are (match_id, detections array), (match_id, None) to end a match, or
+    None to stop the worker. Every batch gets a message in the outbox, the results or the exception that failed it.
+    """
+    calibration, blocks = SharedCalibration.attach(descriptor)
+    trackers: Dict[Hashable, MultiCameraTracker] = {}
+
+    while True:
+        message = inbox.get()
+        if message is None:
+            break
+        match_id, detections_array = message
+        if detections_array is None:
+            trackers.pop(match_id, None)
+            continue
+
+        try:
+            tracker = trackers.get(match_id)
+            if tracker is None:
+                tracker = MultiCameraTracker.from_camera_stacks(**calibration, **tracker_kwargs)
+                trackers[match_id] = tracker
+            outbox.put((match_id, results_to_array(tracker.analyze_sequence(detections_array))))
+        except Exception as e:  # Send the error back rather than killing the worker with all of its matches
+            outbox.put((match_id, e))
+
+    trackers.clear()
+    del calibration
+    for block in blocks:
+        block.close()
+
+
+class MatchHost:
+    def __init__(
+            self,
+            calibration_tracker: MultiCameraTracker,
+            n_workers: int = None,
+            start_method: str = None,
+            **tracker_kwargs,
+    ):
+        """
+        :param calibration_tracker: Tracker with all of the cameras added, its calibration is shared with the workers
+        :param n_workers: Number of worker processes, defaults to the number of cores
+        :param start_method: multiprocessing start method (i.e. "spawn"), defaults to the platform's default
+        :param tracker_kwargs: Passed on to every MultiCameraTracker (i.e. use_formplane=False). The
+            CALIBRATION_SETTINGS are taken from calibration_tracker instead
+        """
+        overridden = sorted(set(tracker_kwargs) & set(CALIBRATION_SETTINGS + ('field_polygons',)))
+        if overridden:
+            raise ValueError(f"{overridden} are taken from the calibration tracker, set them on it instead")
+        context = mp.get_context(start_method)
+        self.n_workers: int = n_workers or mp.cpu_count()
+        self.calibration = SharedCalibration(calibration_tracker)
+        tracker_kwargs = {**self.calibration.settings, 'field_polygons': self.calibration.field_polygons,
+                          **tracker_kwargs}
+        self.outbox: mp.Queue = context.Queue()
+        self.inboxes: List[mp.Queue] = [context.Queue() for _ in range(self.n_workers)]
+        self.workers = [
+            context.Process(target=worker_main, args=(self.calibration.descriptor, inbox, self.outbox, tracker_kwargs),
+                            daemon=True)
+            for inbox in self.inboxes
+        ]
+        for worker in self.workers:
+            worker.start()
+        self.pending: int = 0  # Batches submitted that we haven't had the results of yet
+
+    def submit(self, match_id: Hashable, detections_array: np.ndarray) -> None:
+        """
+        Sends a batch of detections (one or more frames, with the DETECTIONS_DTYPE layout) to the match's tracker.
+        Batches of the same match are processed in the order they are submitted.
+        """
+        detections_array = np.ascontiguousarray(detections_array, dtype=DETECTIONS_DTYPE)
+        self.inboxes[worker_for(match_id, self.n_workers)].put((match_id, detections_array))
+        self.pending += 1
+
+    def end_match(self, match_id: Hashable) -> None:
+        """
+        Drops the match's tracker (and its history) in its worker.
+        """
+        self.inboxes[worker_for(match_id, self.n_workers)].put((match_id, None))
+
+    def get_result(self, timeout: Optional[float] = None) -> Tuple[Hashable, np.ndarray]:
+        """
+        :return: (match_id, RESULT_DTYPE array with one row per frame of the batch), in the order the batches finish.
+            Results of the same match come back in the order they were submitted.
+        """
+        try:
+            match_id, results = self.outbox.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No results after {timeout} seconds") from None
+        self.pending -= 1
+        if isinstance(results, Exception):
+            raise RuntimeError(f"Tracker of match {match_id} failed") from results
+        return match_id, results
+
+    def shutdown(self) -> None:
+        for inbox in self.inboxes:
+            inbox.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.calibration.unlink()
+
+    def __enter__(self) -> "MatchHost":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.shutdown()
@@ -1,6 +1,7 @@
 # Import the necessary libraries
 import numpy as np
 
+from utils.calibration import fit_homographies
 from utils.camera_homography import get_coords_as_array, get_all_coords_as_arrays
 
 np.set_printoptions(suppress=True)
@@ -191,24 +192,12 @@ class HomographyMethods:
 
         real_world_coords = self.real_world_coords
 
+        # Compute the homography matrix using the n corresponding points and the (normalised) DLT algorithm
+        H = fit_homographies([image_coords], [real_world_coords])[0]
+
         # Convert the image coordinates to homogeneous coordinates
         image_coords = np.hstack((image_coords, np.ones((image_coords.shape[0], 1))))
 
-        # Convert the real world coordinates to homogeneous coordinates (i.e. add a 1 to the end of each point)
-        real_world_coords = np.hstack((real_world_coords, np.ones((real_world_coords.shape[0], 1))))
-
-        # Compute the homography matrix using the n corresponding points and the DLT algorithm
-        A = []
-        for fp, tp in zip(image_coords[:], real_world_coords[:]):
-            A.append([0, 0, 0, -fp[0], -fp[1], -1, tp[1] * fp[0], tp[1] * fp[1], tp[1]])
-            A.append([fp[0], fp[1], 1, 0, 0, 0, -tp[0] * fp[0], -tp[0] * fp[1], -tp[0]])
-        A = np.array(A)
-        U, S, V = np.linalg.svd(A)
-        H = V[-1].reshape((3, 3))
-
-        # Normalize the homography matrix
-        H = H / H[2, 2]
-
         print("\n---------------------------------\n")
         # Convert the image coordinates to real world coordinates
         real_world_coords = np.dot(H, image_coords.T)
@@ -238,54 +227,18 @@ class HomographyMethods:
 
 
 def get_new_homographies():
+    """
+    Fits the homographies of both Jetsons with utils.calibration.fit_homographies().
+    :return: Dict of camera id (str) -> (3, 3) homography
+    """
     image_coords1, image_coords2, real_world_coords1, real_world_coords2 = get_all_coords_as_arrays()
 
-    homographies = {}
-
     # Subtract the first element of each element in image_coords from 1920 to get the mirror image x coord
     # image_coords1 = np.array([[1920 - x, y] for x, y in image_coords1])  # This was the error!!!! Only for jetson3!
     image_coords2 = np.array([[1920 - x, y] for x, y in image_coords2])
 
-    # Convert the image coordinates to homogeneous coordinates
-    image_coords1 = np.hstack((image_coords1, np.ones((image_coords1.shape[0], 1))))
-
-    # Convert the real world coordinates to homogeneous coordinates (i.e. add a 1 to the end of each point)
-    real_world_coords1 = np.hstack((real_world_coords1, np.ones((real_world_coords1.shape[0], 1))))
-
-    # Compute the homography matrix using the n corresponding points and the DLT algorithm
-    A = []
-    for fp, tp in zip(image_coords1[:], real_world_coords1[:]):
-        A.append([0, 0, 0, -fp[0], -fp[1], -1, tp[1] * fp[0], tp[1] * fp[1], tp[1]])
-        A.append([fp[0], fp[1], 1, 0, 0, 0, -tp[0] * fp[0], -tp[0] * fp[1], -tp[0]])
-    A = np.array(A)
-    U, S, V = np.linalg.svd(A)
-    H = V[-1].reshape((3, 3))
-
-    # Normalize the homography matrix
-    H1 = H / H[2, 2]
-    homographies["1"] = H1
-
-    # Convert the image coordinates to homogeneous coordinates
-    image_coords2 = np.hstack((image_coords2, np.ones((image_coords2.shape[0], 1))))
-
-    # Convert the real world coordinates to homogeneous coordinates (i.e. add a 1 to the end of each point)
-    real_world_coords2 = np.hstack((real_world_coords2, np.ones((real_world_coords2.shape[0], 1))))
-
-    # Compute the homography matrix using the n corresponding points and the DLT algorithm
-    A = []
-    for fp, tp in zip(image_coords2[:], real_world_coords2[:]):
-        A.append([0, 0, 0, -fp[0], -fp[1], -1, tp[1] * fp[0], tp[1] * fp[1], tp[1]])
-        A.append([fp[0], fp[1], 1, 0, 0, 0, -tp[0] * fp[0], -tp[0] * fp[1], -tp[0]])
-    A = np.array(A)
-    U, S, V = np.linalg.svd(A)
-    H = V[-1].reshape((3, 3))
-
-    # Normalize the homography matrix
-    H2 = H / H[2, 2]
-    homographies["3"] = H2
-
-    return homographies
-
+    H1, H2 = fit_homographies([image_coords1, image_coords2], [real_world_coords1, real_world_coords2])
+    return {"1": H1, "3": H2}
 
 
 def main():
@@ -0,0 +1,19 @@
+import os
+
+import pytest
+
+from utils.cache import CACHE_DIR_ENV
+
+
+@pytest.fixture(autouse=True, scope="session")
+def cache_dir(tmp_path_factory):
+    """
+    Points the calibration caches of every test at a temporary folder, rather than the user's cache dir.
+    """
+    old = os.environ.get(CACHE_DIR_ENV)
+    os.environ[CACHE_DIR_ENV] = str(tmp_path_factory.mktemp("cache"))
+    yield os.environ[CACHE_DIR_ENV]
+    if old is None:
+        del os.environ[CACHE_DIR_ENV]
+    else:
+        os.environ[CACHE_DIR_ENV] = old
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from benchmarks.ball_simulator import create_cameras, create_tracker, simulate_detections, simulate_trajectory
+from utils.geometry import triangulate_least_squares
+
+
+@pytest.mark.parametrize("n_cameras", [2, 4])
+def test_noiseless_detections_are_triangulated_back(n_cameras: int) -> None:
+    rng = np.random.default_rng(0)
+    cameras = create_cameras(n_cameras)
+    positions = simulate_trajectory(250, rng=rng)
+    assert positions[:, 0].min() >= 0 and positions[:, 1].max() <= 105 and positions[:, 2].min() >= 0
+
+    detections = simulate_detections(cameras, positions, rng=rng, pixel_noise=0., dropout=0., false_positive_rate=0.)
+    tracker = create_tracker(cameras)
+    xs, ys = tracker.homography_stage(detections['camera_id'], detections['x'], detections['y'])
+    ground_points = np.column_stack((xs, ys, np.zeros(len(xs))))
+    camera_centres = tracker.camera_centres[tracker.camera_indices(detections['camera_id'])]
+
+    # Every frame that more than one camera sees is triangulated back to where the ball was
+    checked = 0
+    for frame in range(len(positions)):
+        rows = detections['timestamp'] == frame
+        if rows.sum() > 1:
+            assert triangulate_least_squares(ground_points[rows], camera_centres[rows]) == \
+                pytest.approx(positions[frame], abs=1e-6)
+            checked += 1
+    assert checked > 20
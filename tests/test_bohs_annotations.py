@@ -0,0 +1,150 @@
+import os
+
+import numpy as np
+import pytest
+
+from data import utils
+from data.utils import load_bohs_columns, read_bohs_ground_truth, read_bohs_ground_truths
+
+CVAT_XML = """<?xml version="1.0" encoding="utf-8"?>
+<annotations>
+  <version>1.1</version>
+  <meta>
+    <task><id>1</id><size>5</size></task>
+  </meta>
+  <track id="0" label="ball" source="manual">
+    <points frame="3" outside="0" occluded="0" keyframe="1" points="437.50,782.20" z_order="0"/>
+    <points frame="4" outside="0" occluded="0" keyframe="1" points="440.90,780.00" z_order="0"/>
+  </track>
+  <track id="1" label="ball" source="manual">
+    <points frame="4" outside="0" occluded="0" keyframe="1" points="1200.00,300.70" z_order="0"/>
+  </track>
+</annotations>
+"""
+
+
+def write_xml(folder, name: str = "camera.xml", contents: str = CVAT_XML) -> str:
+    path = os.path.join(str(folder), name)
+    with open(path, "w") as f:
+        f.write(contents)
+    return path
+
+
+def test_parse_matches_element_tree(tmp_path) -> None:
+    write_xml(tmp_path)
+    annotations = read_bohs_ground_truth(str(tmp_path), "camera.xml")
+    assert dict(annotations.ball_pos) == {3: [(437, 782)], 4: [(440, 780), (1200, 300)]}
+    assert annotations.frames.tolist() == [3, 4, 4]
+
+    # The old dict form is still there
+    gt = utils._load_bohs_groundtruth(os.path.join(str(tmp_path), "camera.xml"))
+    assert gt == {"BallPos": [[3, 3, 437, 782], [4, 4, 440, 780], [4, 4, 1200, 300]]}
+
+
+def test_cache_is_invalidated_when_the_xml_changes(tmp_path, monkeypatch) -> None:
+    path = write_xml(tmp_path)
+    frames, _, _ = load_bohs_columns(path)
+    assert os.path.exists(utils._annotations_cache_path(path))
+
+    # Warm cache, no parsing
+    def fail(xml_file_path):
+        raise AssertionError("The xml was parsed with a warm cache")
+    monkeypatch.setattr(utils, "_parse_bohs_xml", fail)
+    assert np.array_equal(load_bohs_columns(path)[0], frames)
+    monkeypatch.undo()
+
+    write_xml(tmp_path, contents=CVAT_XML.replace('frame="3"', 'frame="13"'))
+    assert load_bohs_columns(path)[0].tolist() == [13, 4, 4]
+
+
+def test_read_several_cameras(tmp_path) -> None:
+    names = ["camera1.xml", "camera3.xml"]
+    write_xml(tmp_path, names[0])
+    write_xml(tmp_path, names[1], CVAT_XML.replace('frame="4"', 'frame="5"'))
+    ground_truths = read_bohs_ground_truths(str(tmp_path), names)
+    assert sorted(ground_truths[names[0]].ball_pos) == [3, 4]
+    assert sorted(ground_truths[names[1]].ball_pos) == [3, 5]
+
+
+def test_frame_index_and_manifest(tmp_path, monkeypatch) -> None:
+    images_path = tmp_path / "camera"
+    images_path.mkdir()
+    for name in ("frame_0000001.jpg", "frame_0000002.jpg", "frame_0000010.jpg", "frame_0000003.png", "notes.txt"):
+        (images_path / name).write_bytes(b"")
+    manifest_path = str(tmp_path / ".cache" / "camera_frames.json")
+
+    expected = {number: os.path.join(str(images_path), f"frame_{number:07d}.jpg") for number in (1, 2, 10)}
+    assert utils.frame_index(str(images_path), ".jpg", manifest_path) == expected
+    assert os.path.exists(manifest_path)
+
+    # Reused while the folder is unchanged
+    def fail(images_path, image_extension):
+        raise AssertionError("The folder was scanned with an up to date manifest")
+    monkeypatch.setattr(utils, "_scan_frames", fail)
+    assert utils.frame_index(str(images_path), ".jpg", manifest_path) == expected
+    monkeypatch.undo()
+
+    (images_path / "frame_0000004.jpg").write_bytes(b"")
+    os.utime(str(images_path), ns=(0, os.stat(str(images_path)).st_mtime_ns + 1))  # In case the clock is coarse
+    assert sorted(utils.frame_index(str(images_path), ".jpg", manifest_path)) == [1, 2, 4, 10]
+
+
+def test_annotations_dataset(tmp_path) -> None:
+    from data.annotations_dataset import AnnotationsDataset
+    from triangulation_logic import MultiCameraTracker
+
+    write_xml(tmp_path, "jetson1_match.xml")
+    write_xml(tmp_path, "jetson3_match.xml", CVAT_XML.replace('frame="3"', 'frame="5"'))
+    dataset = AnnotationsDataset(str(tmp_path), cameras=("jetson3_match", "jetson1_match"))
+    assert dataset.camera_ids == [3, 1]
+    assert dataset.frame_numbers.tolist() == [3, 4, 5]
+    assert [(d.camera_id, d.x, d.y) for d in dataset[1]] == \
+        [(3, 440, 780), (3, 1200, 300), (1, 440, 780), (1, 1200, 300)]
+    assert {d.timestamp for d in dataset[1]} == {4}
+
+    arr = dataset.detections_array()
+    assert arr['timestamp'].tolist() == [3, 4, 4, 4, 4, 5]
+
+    matching = AnnotationsDataset(str(tmp_path), cameras=("jetson3_match", "jetson1_match"), only_matching_frames=True)
+    assert matching.frame_numbers.tolist() == [4]
+
+    def tracker() -> MultiCameraTracker:
+        t = MultiCameraTracker(use_formplane=False, mirrored_cameras=(3,))
+        t.add_camera(1, np.array([[-19.41], [-21.85], [7.78]]))
+        t.add_camera(3, np.array([[0.], [86.16], [7.85]]))
+        return t
+
+    frame_tracker = tracker()
+    frame_by_frame = [frame_tracker.multi_camera_analysis(detections) for detections in dataset]
+    sequence = tracker().analyze_sequence(arr)
+    assert [type(r) for r in sequence] == [type(r) for r in frame_by_frame]
+    for r, e in zip(sequence, frame_by_frame):
+        assert (r.x, r.y, r.z) == pytest.approx((e.x, e.y, e.z))
+
+
+def test_join_frames() -> None:
+    camera_frames = [np.array([1, 2, 3, 5, 8]), np.array([2, 3, 4, 5, 8, 9]), np.array([0, 2, 3, 5, 6, 8])]
+    matches = utils.join_frames(camera_frames)
+    assert [[frames[i] for frames, i in zip(camera_frames, row)] for row in matches] == \
+        [[2, 2, 2], [3, 3, 3], [5, 5, 5], [8, 8, 8]]
+
+    # Camera 2's numbering starts 1 frame later
+    matches = utils.join_frames(camera_frames[:2], frame_offsets=[0, 1])
+    assert [[frames[i] for frames, i in zip(camera_frames, row)] for row in matches] == \
+        [[1, 2], [2, 3], [3, 4], [8, 9]]
+
+
+def test_box_table(tmp_path) -> None:
+    write_xml(tmp_path)
+    table = utils.build_box_table(read_bohs_ground_truth(str(tmp_path), "camera.xml"), box_size=20, label=1)
+
+    boxes, labels = table.lookup(4)
+    assert boxes.tolist() == [[430., 770., 450., 790.], [1190., 290., 1210., 310.]]
+    assert labels.tolist() == [1, 1]
+    assert not boxes.flags.writeable
+
+    for frame in (0, 2, 100, -1):
+        boxes, labels = table.lookup(frame)
+        assert boxes.shape == (0, 4) and labels.shape == (0,)
+
+    assert table.ball_counts(np.array([-1, 0, 3, 4, 5, 1000])).tolist() == [0, 0, 1, 2, 0, 0]
@@ -0,0 +1,120 @@
+import importlib
+import os
+import sys
+import types
+
+import numpy as np
+import pytest
+from PIL import Image
+
+
+CAMERAS = ("jetson3_test", "jetson1_test")
+# Frames with an image per camera, camera 1 is missing frame 4
+IMAGE_FRAMES = {"jetson3_test": [1, 2, 3, 4, 5, 6], "jetson1_test": [1, 2, 3, 5, 6]}
+# Frames with the ball per camera
+BALL_FRAMES = {"jetson3_test": [2, 3, 5], "jetson1_test": [2, 3, 5, 6]}
+
+
+@pytest.fixture
+def bohs_dataset(monkeypatch):
+    """
+    data.bohs_dataset, imported with a stand in for torch (only torch.utils.data.Dataset is used).
+    """
+    torch = types.ModuleType("torch")
+    torch.utils = types.SimpleNamespace(data=types.SimpleNamespace(Dataset=object))
+    monkeypatch.setitem(sys.modules, "torch", torch)
+    monkeypatch.delitem(sys.modules, "data.bohs_dataset", raising=False)
+    module = importlib.import_module("data.bohs_dataset")
+    yield module
+    sys.modules.pop("data.bohs_dataset", None)
+
+
+@pytest.fixture
+def dataset_path(tmp_path) -> str:
+    """
+    A bohs-preprocessed folder with two cameras, with the camera's id as the value of every pixel of its images.
+    """
+    os.makedirs(tmp_path / "annotations")
+    for camera_id, camera in enumerate(CAMERAS):
+        images_path = tmp_path / "unpacked_jpg" / camera
+        os.makedirs(images_path)
+        for frame in IMAGE_FRAMES[camera]:
+            Image.fromarray(np.full((8, 10, 3), camera_id * 100, dtype=np.uint8)).save(
+                images_path / f"frame_{frame:07d}.png")
+
+        points = "".join(f'<points frame="{frame}" outside="0" occluded="0" keyframe="1" '
+                         f'points="{100 + frame}.00,{200 + frame}.00" z_order="0"/>' for frame in BALL_FRAMES[camera])
+        with open(tmp_path / "annotations" / f"{camera}.xml", "w") as f:
+            f.write(f'<?xml version="1.0" encoding="utf-8"?>\n<annotations><track id="0" label="ball" '
+                    f'source="manual">{points}</track></annotations>\n')
+    return str(tmp_path)
+
+
+def create_dataset(bohs_dataset, dataset_path: str, **kwargs):
+    kwargs = {"start_frame": 0, "end_frame": 100, "cameras": CAMERAS, "image_extension": ".png", **kwargs}
+    return bohs_dataset.TriangulationBohsDataset(dataset_path=dataset_path, **kwargs)
+
+
+def item_frames(dataset) -> list:
+    """
+    The (camera 3, camera 1) frame numbers of each item of dataset.image_list
+    """
+    return [tuple(int(image_ndx) for image_ndx in item[4:]) for item in dataset.image_list]
+
+
+def test_image_list_and_getitem(bohs_dataset, dataset_path) -> None:
+    dataset = create_dataset(bohs_dataset, dataset_path)
+    # Every frame up to the camera's last ball frame, that both cameras have an image of
+    assert item_frames(dataset) == [(1, 1), (2, 2), (3, 3), (5, 5)]
+    assert len(dataset) == 4
+    assert dataset.image_list[0] == (
+        os.path.join(dataset_path, "unpacked_jpg", CAMERAS[0], "frame_0000001.png"),
+        os.path.join(dataset_path, "unpacked_jpg", CAMERAS[1], "frame_0000001.png"),
+        CAMERAS[0], CAMERAS[1], "0000001", "0000001",
+    )
+    # Before the cameras are paired, the ball is in 3 of camera 3's 5 frames and 4 of camera 1's 5
+    assert len(dataset.ball_images_ndx) == 7 and len(dataset.no_ball_images_ndx) == 3
+
+    image_1, image_2, box_1, box_2, label_1, label_2, image_path_1, image_path_2 = dataset[1]
+    assert image_1.shape == image_2.shape == (8, 10, 3)
+    assert (image_1 == 0).all() and (image_2 == 100).all()  # The ball circles are outside of these tiny images
+    assert image_path_1.endswith(os.path.join(CAMERAS[0], "frame_0000002.png"))
+    assert image_path_2.endswith(os.path.join(CAMERAS[1], "frame_0000002.png"))
+    half = bohs_dataset.BALL_BBOX_SIZE / 2
+    assert np.array_equal(box_1, [[102 - half, 202 - half, 102 + half, 202 + half]])
+    assert label_1.tolist() == label_2.tolist() == [bohs_dataset.BALL_LABEL]
+
+    # No ball in frame 1
+    _, _, box_1, box_2, label_1, label_2, _, _ = dataset[0]
+    assert len(box_1) == len(box_2) == len(label_1) == len(label_2) == 0
+
+    dataset = create_dataset(bohs_dataset, dataset_path, only_ball_frames=True)
+    assert item_frames(dataset) == [(2, 2), (3, 3), (5, 5)]
+
+
+def test_small_dataset_window(bohs_dataset, dataset_path) -> None:
+    # start_frame/ end_frame slice the matching frames, rather than being frame numbers
+    dataset = create_dataset(bohs_dataset, dataset_path, small_dataset=True, start_frame=1, end_frame=3)
+    assert item_frames(dataset) == [(2, 2), (3, 3)]
+    assert len(dataset) == 2
+    assert dataset[1][-1].endswith(os.path.join(CAMERAS[1], "frame_0000003.png"))
+
+    # Past the end is just empty, and without small_dataset the window is ignored
+    assert len(create_dataset(bohs_dataset, dataset_path, small_dataset=True, start_frame=10, end_frame=20)) == 0
+    assert len(create_dataset(bohs_dataset, dataset_path, start_frame=1, end_frame=3)) == 4
+
+
+def test_frame_offsets(bohs_dataset, dataset_path) -> None:
+    # Camera 1's frame f + 1 is camera 3's frame f. Camera 3's frame 3 would be camera 1's frame 4, which is missing, so
+    # it is dropped, and camera 3's frame 6 is after its last ball frame
+    dataset = create_dataset(bohs_dataset, dataset_path, frame_offsets=[0, 1])
+    assert item_frames(dataset) == [(1, 2), (2, 3), (4, 5), (5, 6)]
+
+    # Each camera's boxes are those of its own frame
+    _, _, box_1, box_2, _, _, image_path_1, image_path_2 = dataset[2]
+    assert image_path_1.endswith("frame_0000004.png") and image_path_2.endswith("frame_0000005.png")
+    assert len(box_1) == 0
+    assert box_2[:, :2].tolist() == [[105 - bohs_dataset.BALL_BBOX_SIZE / 2, 205 - bohs_dataset.BALL_BBOX_SIZE / 2]]
+
+    _, _, box_1, box_2, _, _, _, _ = dataset[1]
+    assert box_1[0, 0] == box_2[0, 0] - 1  # Frames 2 and 3
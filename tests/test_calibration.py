@@ -0,0 +1,91 @@
+import os
+
+import numpy as np
+
+import python_learning.homography_practice
+from python_learning.homography_practice import get_new_homographies
+from triangulation_logic import MultiCameraTracker
+from utils import calibration
+from utils.cache import CACHE_DIR_ENV, default_cache_dir
+from utils.calibration import load_homographies
+
+
+def test_load_homographies_uses_cache(tmp_path, monkeypatch) -> None:
+    expected = get_new_homographies()
+
+    homographies = load_homographies(cache_dir=str(tmp_path))
+    assert sorted(homographies) == sorted(expected)
+    assert len(os.listdir(tmp_path)) == 1
+
+    # Once cached, the homographies shouldn't be recomputed
+    def fail():
+        raise AssertionError("get_new_homographies() was called with a warm cache")
+    monkeypatch.setattr(python_learning.homography_practice, "get_new_homographies", fail)
+
+    cached = load_homographies(cache_dir=str(tmp_path))
+    assert sorted(cached) == sorted(expected)
+    for camera_id in expected:
+        assert np.array_equal(cached[camera_id], expected[camera_id])
+
+
+def test_calibration_key_changes_with_version(monkeypatch) -> None:
+    key = calibration.calibration_key()
+    assert key == calibration.calibration_key()
+
+    monkeypatch.setattr(calibration, "CALIBRATION_CACHE_VERSION", calibration.CALIBRATION_CACHE_VERSION + 1)
+    assert calibration.calibration_key() != key
+
+
+def test_calibration_key_changes_with_landmarks(monkeypatch) -> None:
+    key = calibration.calibration_key()
+
+    class MovedCorner(calibration.CameraJetson3):
+        def __init__(self):
+            super().__init__()
+            self.corner1 = (1802, 298)
+    monkeypatch.setattr(calibration, "CameraJetson3", MovedCorner)
+    assert calibration.calibration_key() != key
+
+
+def test_fit_homographies_recovers_exact_homographies() -> None:
+    rng = np.random.default_rng(0)
+    truth = np.array([[[0.05, 0.01, -3.], [0.002, 0.09, 1.], [0.0001, 0.0004, 1.]],
+                      [[-0.03, 0.02, 60.], [0.001, -0.1, 90.], [-0.0002, 0.0003, 1.]]])
+    # Different numbers of points per camera, including the minimum of 4
+    image_coords = [rng.uniform((0, 0), (1920, 1080), (n, 2)) for n in (4, 11)]
+    real_world_coords = []
+    for H, points in zip(truth, image_coords):
+        projected = np.column_stack((points, np.ones(len(points)))) @ H.T
+        real_world_coords.append(projected[:, :2] / projected[:, 2:])
+
+    homographies = calibration.fit_homographies(image_coords, real_world_coords)
+    assert homographies.shape == (2, 3, 3)
+    assert np.allclose(homographies, truth, rtol=1e-6, atol=1e-9)
+
+
+def test_cache_dir(tmp_path, monkeypatch) -> None:
+    monkeypatch.setenv(CACHE_DIR_ENV, str(tmp_path / "env"))
+    assert default_cache_dir() == str(tmp_path / "env")
+    monkeypatch.setenv(CACHE_DIR_ENV, "")
+    assert default_cache_dir() is None
+    monkeypatch.delenv(CACHE_DIR_ENV)
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "user"))
+    assert default_cache_dir() == os.path.join(str(tmp_path / "user"), "triangulation")
+
+    tracker = MultiCameraTracker(use_formplane=False, cache_dir=str(tmp_path / "tracker"))
+    assert os.listdir(tmp_path / "tracker") == [os.path.basename(calibration.calibration_cache_path(""))]
+    MultiCameraTracker(use_formplane=False, use_cache=False, cache_dir=str(tmp_path / "off"))
+    assert not os.path.exists(tmp_path / "off")
+    assert sorted(load_homographies(None)) == sorted(tracker.homographies)
+
+
+def test_old_caches_are_pruned(tmp_path) -> None:
+    for i in range(calibration.CALIBRATION_CACHE_FILES + 2):
+        path = tmp_path / f"homographies_v1_{i}.npy"
+        path.write_bytes(b"")
+        os.utime(path, (i, i))
+    load_homographies(cache_dir=str(tmp_path))
+    kept = sorted(os.listdir(tmp_path))
+    assert len(kept) == calibration.CALIBRATION_CACHE_FILES
+    assert os.path.basename(calibration.calibration_cache_path(str(tmp_path))) in kept
+    assert "homographies_v1_0.npy" not in kept and "homographies_v1_5.npy" in kept
@@ -0,0 +1,60 @@
+import os
+
+import numpy as np
+from matplotlib.path import Path
+
+from utils.config import get_image_field_coordinates
+from utils.field_mask import FIELD_MASK_CACHE_FILES, build_field_mask, field_mask_path, load_field_mask, \
+    lookup_field_masks, point_in_polygon, points_in_polygon
+import utils.field_mask as field_mask
+
+
+def test_non_integer_coordinates(tmp_path) -> None:
+    polygons = [get_image_field_coordinates()['1'], get_image_field_coordinates()['3']]
+    masks = np.stack([load_field_mask(str(tmp_path), polygon) for polygon in polygons])
+
+    # Just inside of camera 3's top edge, but its pixel (739, 248) is outside
+    assert Path(polygons[1]).contains_point((739, 248.48))
+    assert not build_field_mask(polygons[1])[248, 739]
+    assert lookup_field_masks(masks, np.array([1]), np.array([739.]), np.array([248.48]), polygons)[0]
+    assert point_in_polygon(polygons[1], 739, 248.48)
+
+    rng = np.random.default_rng(0)
+    camera_ndx = rng.integers(0, 2, 20000)
+    xs, ys = rng.uniform(-10, 1930, 20000), rng.uniform(-10, 1090, 20000)
+    expected = np.array([Path(polygons[i]).contains_point((x, y)) for i, x, y in zip(camera_ndx, xs, ys)])
+    assert np.array_equal(lookup_field_masks(masks, camera_ndx, xs, ys, polygons), expected)
+    for i, polygon in enumerate(polygons):
+        rows = camera_ndx == i
+        assert np.array_equal(points_in_polygon(polygon, xs[rows], ys[rows]), expected[rows])
+
+
+def test_load_field_mask_caches(tmp_path) -> None:
+    field = ((0, 40), (200, 30), (200, 100), (0, 90))
+    packed = load_field_mask(str(tmp_path), field, width=200, height=100)
+    assert packed.shape == (100, 25) and packed.dtype == np.uint8
+    assert np.array_equal(np.unpackbits(packed, axis=1), build_field_mask(field, width=200, height=100))
+    assert len(list(tmp_path.glob('field_mask_v*.npy'))) == 1
+
+    # Loaded from disk in a new process
+    field_mask._field_mask_memo.clear()
+    assert np.array_equal(load_field_mask(str(tmp_path), field, width=200, height=100), packed)
+    assert load_field_mask(str(tmp_path), field, width=200, height=100) is \
+        load_field_mask(str(tmp_path), field, width=200, height=100)
+
+    # Only the latest masks are kept
+    for i in range(FIELD_MASK_CACHE_FILES + 2):
+        load_field_mask(str(tmp_path), ((0, i), (20, 0), (20, 10)), width=20, height=10)
+    assert len(list(tmp_path.glob('field_mask_v*.npy'))) == FIELD_MASK_CACHE_FILES
+    latest = ((0, FIELD_MASK_CACHE_FILES + 1), (20, 0), (20, 10))
+    assert os.path.exists(field_mask_path(str(tmp_path), latest, width=20, height=10))
+
+
+def test_load_field_mask_without_cache(tmp_path, monkeypatch) -> None:
+    monkeypatch.chdir(tmp_path)
+    field = ((0, 40), (200, 30), (200, 100), (0, 90))
+    field_mask._field_mask_memo.clear()
+    packed = load_field_mask(None, field, width=200, height=100)
+    assert np.array_equal(np.unpackbits(packed, axis=1), build_field_mask(field, width=200, height=100))
+    assert load_field_mask(None, field, width=200, height=100) is packed
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,84 @@
+import pytest
+
+from utils.data_classes import Detections
+from utils.frame_synchronizer import FrameSynchronizer
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def det(camera_id: int, timestamp: int) -> Detections:
+    return Detections(camera_id=camera_id, probability=0.9, timestamp=timestamp, x=800, y=800, z=0)
+
+
+def test_emits_when_all_cameras_report() -> None:
+    synchronizer = FrameSynchronizer(camera_ids=[1, 3], max_wait=0.1, clock=FakeClock())
+
+    assert synchronizer.push(3, 0, [det(3, 0)]) == []
+    frames = synchronizer.push(1, 0, [det(1, 0)])
+
+    assert len(frames) == 1
+    assert frames[0].complete
+    assert frames[0].cameras == (3, 1)
+    assert [d.camera_id for d in frames[0].detections] == [3, 1]
+    assert len(synchronizer) == 0
+
+
+def test_out_of_order_deadline_and_late_frames() -> None:
+    clock = FakeClock()
+    synchronizer = FrameSynchronizer(camera_ids=[1, 3], max_wait=0.1, clock=clock)
+
+    # Frame 1 is complete, but has to wait behind frame 0 which is missing camera 3
+    assert synchronizer.push(1, 0, [det(1, 0)]) == []
+    assert synchronizer.push(3, 1, []) == []
+    assert synchronizer.push(1, 1, [det(1, 1)]) == []
+    assert synchronizer.next_deadline() == pytest.approx(0.1)
+
+    clock.now = 0.05
+    assert synchronizer.poll() == []
+
+    clock.now = 0.1
+    frames = synchronizer.poll()
+    assert [(f.timestamp, f.complete) for f in frames] == [(0, False), (1, True)]
+
+    # Camera 3 finally reports for frame 0, which has already gone
+    assert synchronizer.push(3, 0, [det(3, 0)]) == []
+    assert synchronizer.stats() == {"complete_frames": 1, "partial_frames": 1, "overflow_frames": 0,
+                                    "late_dropped": 1, "duplicates_replaced": 0, "pending": 0}
+
+    with pytest.raises(KeyError):
+        synchronizer.push(2, 5, [])
+
+
+def test_buffer_is_bounded() -> None:
+    synchronizer = FrameSynchronizer(camera_ids=[1, 3], max_wait=10., max_pending=2, clock=FakeClock())
+    synchronizer.push(1, 0, [])
+    synchronizer.push(1, 1, [])
+
+    frames = synchronizer.push(1, 2, [])
+    assert [f.timestamp for f in frames] == [0]
+    assert synchronizer.overflow_frames == 1
+    assert [f.timestamp for f in synchronizer.flush()] == [1, 2]
+
+
+def test_duplicates_keep_the_latest() -> None:
+    synchronizer = FrameSynchronizer(camera_ids=[1, 3], max_wait=0.1, clock=FakeClock())
+
+    # Camera 1 resends timestamp 0 with a new detection, then with none
+    assert synchronizer.push(1, 0, [det(1, 0)]) == []
+    moved = Detections(camera_id=1, probability=0.9, timestamp=0, x=900, y=800, z=0)
+    assert synchronizer.push(1, 0, [moved]) == []
+    assert synchronizer.push(1, 1, [det(1, 1)]) == []
+    assert synchronizer.push(1, 1, []) == []
+
+    frames = synchronizer.push(3, 0, [det(3, 0)]) + synchronizer.push(3, 1, [])
+    assert [frame.cameras for frame in frames] == [(1, 3), (1, 3)]
+    assert all(frame.complete for frame in frames)
+    assert [(d.camera_id, d.x) for d in frames[0].detections] == [(1, 900), (3, 800)]
+    assert frames[1].detections == []
+    assert synchronizer.stats()["duplicates_replaced"] == 2
@@ -0,0 +1,183 @@
+import asyncio
+import json
+
+import numpy as np
+import pytest
+
+from practical_testing.fusion_service import FusionService, LocalIOTClient, decode_payload, encode_payload, \
+    logging_publisher
+from triangulation_logic import MultiCameraTracker
+from utils.config import MIRRORED_CAMERAS
+from utils.data_classes import Detections
+
+
+JETSON1_REAL_WORLD = np.array([[-19.41], [-21.85], [7.78]])
+JETSON3_REAL_WORLD = np.array([[0.], [86.16], [7.85]])
+PIXELS = {1: (274, 754), 3: (891, 284)}
+
+
+def initialize_tracker() -> MultiCameraTracker:
+    # The payloads have raw image coordinates, like the camera nodes send
+    tracker = MultiCameraTracker(use_formplane=False, mirrored_cameras=MIRRORED_CAMERAS)
+    tracker.add_camera(1, JETSON1_REAL_WORLD)
+    tracker.add_camera(3, JETSON3_REAL_WORLD)
+    return tracker
+
+
+def camera_payload(camera_id: int, timestamp: int) -> dict:
+    x, y = PIXELS[camera_id]
+    detection = Detections(camera_id=camera_id, probability=0.9, timestamp=timestamp, x=x, y=y, z=0)
+    return {"camera": str(camera_id), "detection": detection, "timestamp": timestamp, "image_path": "image.jpg"}
+
+
+def test_payload_round_trip() -> None:
+    payload = camera_payload(3, 7)
+    assert decode_payload(encode_payload(payload)) == payload
+
+    no_detection = {"camera": "1", "detection": None, "timestamp": 7, "image_path": "image.jpg"}
+    assert decode_payload(encode_payload(no_detection)) == no_detection
+
+
+def test_fusion_service_tcp() -> None:
+    publisher = LocalIOTClient()
+
+    async def run() -> FusionService:
+        service = FusionService(initialize_tracker(), publisher, max_wait=5.)
+        await service.start()
+        server = await service.serve_tcp()
+        host, port = server.sockets[0].getsockname()[:2]
+
+        async def camera_node(camera_id: int) -> None:
+            _, writer = await asyncio.open_connection(host, port)
+            for timestamp in range(10):
+                writer.write(encode_payload(camera_payload(camera_id, timestamp)))
+                await writer.drain()
+            writer.close()
+
+        await asyncio.gather(camera_node(1), camera_node(3))
+        await service.close()
+        return service
+
+    service = asyncio.run(run())
+
+    assert service.payloads_received == 20
+    assert [p["timestamp"] for p in publisher.published] == list(range(10))
+    assert all(p["complete"] and p["result"] == "ThreeDPoints" for p in publisher.published)
+
+    # Same results as running the tracker on the frames directly
+    tracker = initialize_tracker()
+    for payload in publisher.published:
+        expected = tracker.multi_camera_analysis([camera_payload(camera_id, payload["timestamp"])["detection"]
+                                                  for camera_id in payload["cameras"]])
+        assert payload["x"] == pytest.approx(expected.x)
+        assert payload["z"] == pytest.approx(expected.z)
+
+
+def test_fusion_service_local_client() -> None:
+    publisher = LocalIOTClient()
+
+    async def run() -> None:
+        service = FusionService(initialize_tracker(), publisher, max_wait=0.01, connection_queue_size=2)
+        await service.start()
+        camera1, camera3 = service.local_client(), service.local_client()
+
+        def camera_nodes() -> None:
+            # Camera 3 drops out after the first 5 frames
+            for timestamp in range(10):
+                camera1.publish(payload=camera_payload(1, timestamp))
+                if timestamp < 5:
+                    camera3.publish(payload=camera_payload(3, timestamp))
+            camera1.disconnect()
+            camera3.disconnect()
+
+        await asyncio.get_running_loop().run_in_executor(None, camera_nodes)
+        await service.close()
+
+    asyncio.run(run())
+
+    assert [p["timestamp"] for p in publisher.published] == list(range(10))
+    assert [p["complete"] for p in publisher.published] == [True] * 5 + [False] * 5
+
+
+def test_fusion_service_camera_field() -> None:
+    publisher = LocalIOTClient()
+
+    async def run() -> FusionService:
+        service = FusionService(initialize_tracker(), publisher, max_wait=5.)
+        await service.start()
+        camera1, camera3 = service.local_client(), service.local_client()
+
+        def camera_nodes() -> None:
+            for timestamp in range(4):
+                camera1.publish(payload=camera_payload(1, timestamp))
+                # Empty frames of camera 3 still complete the frame, the camera is always taken from "camera"
+                camera3.publish(payload={"camera": 3, "detection": None, "timestamp": timestamp, "image_path": ""})
+            # A detection that disagrees with its payload's camera is dropped
+            camera3.publish(payload=dict(camera_payload(1, 4), camera=3))
+            camera1.disconnect()
+            camera3.disconnect()
+
+        await asyncio.get_running_loop().run_in_executor(None, camera_nodes)
+        await service.close()
+        return service
+
+    service = asyncio.run(run())
+
+    assert service.bad_payloads == 1
+    assert [p["timestamp"] for p in publisher.published[:4]] == list(range(4))
+    assert all(p["complete"] for p in publisher.published[:4])
+
+
+def test_fusion_service_needs_mirroring() -> None:
+    tracker = MultiCameraTracker(use_formplane=False)
+    tracker.add_camera(1, JETSON1_REAL_WORLD)
+    tracker.add_camera(3, JETSON3_REAL_WORLD)
+    with pytest.raises(ValueError):
+        FusionService(tracker, LocalIOTClient())
+
+
+def send_lines(lines: list) -> FusionService:
+    """
+    Sends the lines over one connection, followed by a good payload of both cameras, so we can check that the
+    connection kept going after the bad ones.
+    """
+    publisher = LocalIOTClient()
+
+    async def run() -> FusionService:
+        service = FusionService(initialize_tracker(), publisher, max_wait=5.)
+        await service.start()
+        server = await service.serve_tcp()
+        host, port = server.sockets[0].getsockname()[:2]
+        _, writer = await asyncio.open_connection(host, port)
+        for line in lines:
+            writer.write(line)
+        writer.write(encode_payload(camera_payload(1, 0)) + encode_payload(camera_payload(3, 0)))
+        await writer.drain()
+        writer.close()
+        await service.close()
+        return service
+
+    service = asyncio.run(run())
+    assert [p["timestamp"] for p in publisher.published] == [0]
+    return service
+
+
+def test_payload_without_timestamp_or_detection() -> None:
+    service = send_lines([b'{"camera": 1, "detection": null}\n'])
+    assert service.bad_payloads == 1 and service.payloads_received == 3
+
+
+def test_payload_with_bad_camera_id() -> None:
+    service = send_lines([b'{"camera": "jetson1", "detection": null, "timestamp": 0}\n'])
+    assert service.bad_payloads == 1 and service.payloads_received == 3
+
+
+def test_payload_that_is_not_an_object() -> None:
+    service = send_lines([b'[1, 2, 3]\n', b'"camera"\n'])
+    assert service.bad_payloads == 2 and service.payloads_received == 2
+
+
+def test_logging_publisher(caplog) -> None:
+    with caplog.at_level("INFO", logger="practical_testing.fusion_service"):
+        logging_publisher().publish(payload={"timestamp": 3, "result": "ThreeDPoints"})
+    assert json.loads(caplog.records[-1].getMessage()) == {"timestamp": 3, "result": "ThreeDPoints"}
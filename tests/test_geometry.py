@@ -0,0 +1,91 @@
+import numpy as np
+
+from utils.geometry import intersect_vertical_plane, intersect_vertical_plane_batch, triangulate_least_squares, \
+    triangulate_least_squares_batch, triangulate_midpoint, triangulate_midpoint_batch
+
+
+JETSON1_REAL_WORLD = np.array([[-19.41], [-21.85], [7.78]])
+JETSON3_REAL_WORLD = np.array([[0.], [86.16], [7.85]])
+
+
+def baseline_triangulate(ball_p, cam_p: np.ndarray, ball_q, cam_q: np.ndarray) -> list:
+    """
+    Local copy of the original MultiCameraTracker.triangulate (object arrays), to check the kernel against.
+    """
+    ball_p = np.array([[ball_p[0]], [ball_p[1]], [ball_p[2]]], dtype=object)
+    ball_q = np.array([[ball_q[0]], [ball_q[1]], [ball_q[2]]], dtype=object)
+    l1 = ball_p - cam_p
+    l2 = ball_q - cam_q
+    r1 = np.vdot(l1, l1)
+    r2 = np.vdot(l2, l2)
+    l1_l2 = np.vdot(l1, l2)
+    balls_l1 = np.vdot((ball_q - ball_p), l1)
+    balls_l2 = np.vdot(l2, (ball_q - ball_p))
+    s = abs(((l1_l2 * balls_l2) + (balls_l1 * r2)) / ((r1 * r2) + (l1_l2 ** 2)))
+    t = abs(((l1_l2 * balls_l1) - (balls_l2 * r1)) / ((r1 * r2) + (l1_l2 ** 2)))
+    midpoint = ((((1 - s) * ball_p) + s * cam_p) + (((1 - t) * ball_q) + t * cam_q)) / 2
+    return [midpoint[0].item(), midpoint[1].item(), midpoint[2].item()]
+
+
+def test_triangulate_midpoint_matches_baseline() -> None:
+    result = triangulate_midpoint(10.5, 47.3, 0., -19.41, -21.85, 7.78, 12.1, 44.8, 0., 0., 86.16, 7.85)
+    assert type(result[0]) == float
+    # Output of the original object array implementation
+    assert np.allclose(result, [10.681648928663485, 45.437824446888364, 0.21628277103542087], rtol=1e-12, atol=0)
+
+    rng = np.random.default_rng(3)
+    for _ in range(100):
+        p = (*rng.uniform((0, 0), (68, 105)), 0.)
+        q = (*rng.uniform((0, 0), (68, 105)), 0.)
+        expected = baseline_triangulate(p, JETSON1_REAL_WORLD, q, JETSON3_REAL_WORLD)
+        result = triangulate_midpoint(*p, *JETSON1_REAL_WORLD.ravel(), *q, *JETSON3_REAL_WORLD.ravel())
+        assert np.allclose(result, expected, rtol=1e-12, atol=1e-12)
+
+
+def test_triangulate_midpoint_batch() -> None:
+    rng = np.random.default_rng(0)
+    ball_p = np.column_stack((rng.uniform(0, 68, 50), rng.uniform(0, 105, 50), np.zeros(50)))
+    ball_q = ball_p + rng.normal(0, 1, (50, 3)) * [1, 1, 0]
+    cam_p = JETSON1_REAL_WORLD.reshape(3)
+    cam_q = JETSON3_REAL_WORLD.reshape(3)
+
+    out = np.empty((50, 3))
+    result = triangulate_midpoint_batch(ball_p, cam_p, ball_q, cam_q, out=out)
+
+    assert result is out
+    for i in range(50):
+        assert np.allclose(result[i], triangulate_midpoint(*ball_p[i], *cam_p, *ball_q[i], *cam_q))
+
+
+def test_triangulate_least_squares_recovers_point() -> None:
+    ball = np.array([30., 50., 2.])
+    camera_centres = np.array([[-19.41, -21.85, 7.78], [0., 86.16, 7.85], [80., 40., 10.], [34., -10., 6.]])
+
+    # Where each camera's ray through the ball hits the ground
+    ground_points = camera_centres + (ball - camera_centres) * (camera_centres[:, 2:] / (camera_centres[:, 2:] - ball[2]))
+
+    assert np.allclose(triangulate_least_squares(ground_points, camera_centres), ball)
+    assert np.allclose(triangulate_least_squares(ground_points[:2], camera_centres[:2]), ball)
+
+    batch = triangulate_least_squares_batch(np.vstack((ground_points, ground_points[1:])),
+                                            np.vstack((camera_centres, camera_centres[1:])),
+                                            np.array([0, 4]))
+    assert np.allclose(batch, [ball, ball])
+
+
+def test_intersect_vertical_plane() -> None:
+    rng = np.random.default_rng(1)
+    ball_points = np.column_stack((rng.uniform(0, 68, 20), rng.uniform(0, 105, 20), np.zeros(20)))
+    cam = JETSON3_REAL_WORLD.reshape(3)
+    plane = np.array([-22., -5., 0., 414.])
+
+    result = intersect_vertical_plane_batch(ball_points, cam, plane)
+    for i in range(20):
+        expected = intersect_vertical_plane(*ball_points[i], *cam, -22., -5., 414.)
+        assert np.allclose(result[i], expected)
+        # The intersection is on the plane
+        assert abs(plane[0] * result[i, 0] + plane[1] * result[i, 1] + plane[3]) < 1e-9
+
+    # A stationary ball gives an all zero plane, which shouldn't raise and just returns the ball positions
+    assert intersect_vertical_plane(*ball_points[0], *cam, 0., 0., 0.) == tuple(ball_points[0])
+    assert np.array_equal(intersect_vertical_plane_batch(ball_points, cam, np.zeros(4)), ball_points)
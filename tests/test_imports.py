@@ -0,0 +1,18 @@
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_tracker_import_is_lightweight() -> None:
+    """
+    The tracker core should only need numpy, the heavy modules are imported lazily by the features that use them.
+    """
+    heavy_modules = ("cv2", "matplotlib", "torch", "PIL", "python_learning.homography_practice")
+    code = (
+        "import sys, triangulation_logic; "
+        f"print(','.join(m for m in {heavy_modules!r} if m in sys.modules))"
+    )
+    result = subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ""
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from practical_testing.match_host import MatchHost, array_to_results, worker_for
+from triangulation_logic import MultiCameraTracker
+from utils.data_classes import DETECTIONS_DTYPE
+
+
+JETSON1_REAL_WORLD = np.array([[-19.41], [-21.85], [7.78]])
+JETSON3_REAL_WORLD = np.array([[0.], [86.16], [7.85]])
+
+
+def initialize_tracker(**kwargs) -> MultiCameraTracker:
+    tracker = MultiCameraTracker(use_formplane=False, **kwargs)
+    tracker.add_camera(1, JETSON1_REAL_WORLD)
+    tracker.add_camera(3, JETSON3_REAL_WORLD)
+    return tracker
+
+
+def random_sequence(seed: int, n_frames: int = 100) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    rows = []
+    for timestamp in range(n_frames):
+        for camera_id in (1, 3):
+            for _ in range(rng.integers(0, 3)):
+                rows.append((camera_id, timestamp, rng.uniform(0, 1920), rng.uniform(200, 1080), 0., rng.uniform(0.5, 1)))
+    return np.array(rows, dtype=DETECTIONS_DTYPE)
+
+
+def test_worker_for_is_stable() -> None:
+    assert worker_for("pitch_1", 4) == worker_for("pitch_1", 4)
+    assert {worker_for(f"pitch_{i}", 4) for i in range(50)} == {0, 1, 2, 3}
+
+
+def test_match_host() -> None:
+    sequences = {f"pitch_{i}": random_sequence(i) for i in range(4)}
+
+    results = {match_id: [] for match_id in sequences}
+    # The workers' trackers have to mirror camera 3 like the calibration tracker does
+    with MatchHost(initialize_tracker(mirrored_cameras=(3,)), n_workers=2, use_formplane=False) as host:
+        # Each match is sent in 4 batches of 25 frames
+        for start in range(0, 100, 25):
+            for match_id, sequence in sequences.items():
+                batch = sequence[(sequence['timestamp'] >= start) & (sequence['timestamp'] < start + 25)]
+                host.submit(match_id, batch)
+        while host.pending:
+            match_id, batch_results = host.get_result(timeout=30)
+            results[match_id].extend(array_to_results(batch_results))
+
+    for match_id, sequence in sequences.items():
+        expected = initialize_tracker(mirrored_cameras=(3,)).analyze_sequence(sequence)
+        assert [type(r) for r in results[match_id]] == [type(r) for r in expected]
+        assert np.allclose([(r.x, r.y, r.z) for r in results[match_id]], [(r.x, r.y, r.z) for r in expected])
+
+
+def test_match_host_settings_come_from_the_calibration() -> None:
+    with pytest.raises(ValueError):
+        MatchHost(initialize_tracker(), n_workers=1, mirrored_cameras=(3,))
+
+
+def test_match_host_camera_not_in_config() -> None:
+    # A camera with its own homography and field, that utils.config doesn't know about
+    def tracker() -> MultiCameraTracker:
+        t = initialize_tracker()
+        t.add_camera(11, np.array([[30.], [-8.], [7.]]), homography=np.diag([0.1, 0.1, 1.]),
+                     image_field_coordinates=((0, 0), (1920, 0), (1920, 1080), (0, 1080)))
+        return t
+
+    sequence = random_sequence(5, n_frames=20)
+    extra = sequence[sequence['camera_id'] == 1].copy()
+    extra['camera_id'] = 11
+    sequence = np.sort(np.concatenate((sequence, extra)), order='timestamp', kind='stable')
+
+    with MatchHost(tracker(), n_workers=1, use_formplane=False) as host:
+        host.submit("pitch_1", sequence)
+        _, batch_results = host.get_result(timeout=30)
+    expected = tracker().analyze_sequence(sequence)
+    assert np.allclose([(r.x, r.y, r.z) for r in array_to_results(batch_results)], [(r.x, r.y, r.z) for r in expected])
+
+    # A tracker that can't be built is sent back as an error, rather than killing the worker
+    with MatchHost(tracker(), n_workers=1, not_a_tracker_setting=True) as host:
+        host.submit("pitch_1", sequence)
+        with pytest.raises(RuntimeError):
+            host.get_result(timeout=30)
@@ -0,0 +1,79 @@
+import os
+
+import numpy as np
+import pytest
+
+from triangulation_logic import MultiCameraTracker
+from utils.data_classes import DETECTIONS_DTYPE
+from utils.geometry import apply_homographies
+from utils.pitch_lut import PITCH_LUT_CACHE_FILES, build_pitch_lut, load_pitch_lut, lookup_pitch_lut, pitch_lut_path
+
+
+JETSON1_REAL_WORLD = np.array([[-19.41], [-21.85], [7.78]])
+JETSON3_REAL_WORLD = np.array([[0.], [86.16], [7.85]])
+HOMOGRAPHY = np.array([[0.05, 0.01, -3.], [0.002, 0.09, 1.], [0.0001, 0.0004, 1.]])
+FIELD = ((0, 40), (200, 30), (200, 100), (0, 90))  # Field polygon for a 200x100 image
+
+
+def test_lookup_matches_homography(tmp_path) -> None:
+    lut = load_pitch_lut(str(tmp_path), HOMOGRAPHY, FIELD, width=200, height=100)
+    assert isinstance(lut, np.memmap)
+    assert lut.shape == (100, 200, 2) and lut.dtype == np.float32
+
+    rng = np.random.default_rng(0)
+    xs, ys = rng.uniform(20, 180, 100), rng.uniform(50, 80, 100)
+    expected = apply_homographies(HOMOGRAPHY[None], np.zeros(100, dtype=np.intp), xs, ys)
+    assert np.allclose(lookup_pitch_lut(lut, xs, ys), expected, atol=1e-3)
+
+    nearest = lookup_pitch_lut(lut, xs, ys, interpolation="nearest")
+    assert np.array_equal(nearest, lut[np.round(ys).astype(int), np.round(xs).astype(int)])
+
+    # Outside of the field or image is NaN
+    assert np.isnan(lookup_pitch_lut(lut, np.array([100., -5., 300.]), np.array([5., 60., 60.]))).all()
+
+
+def test_lut_cache(tmp_path) -> None:
+    # No cache dir, built in memory
+    lut = load_pitch_lut(None, HOMOGRAPHY, FIELD, width=200, height=100)
+    assert not isinstance(lut, np.memmap)
+    assert np.array_equal(lut, build_pitch_lut(HOMOGRAPHY, FIELD, width=200, height=100), equal_nan=True)
+
+    # Only the latest tables are kept
+    for i in range(PITCH_LUT_CACHE_FILES + 2):
+        load_pitch_lut(str(tmp_path), HOMOGRAPHY * (1 + i / 100), FIELD, width=20, height=10)
+    assert len(list(tmp_path.glob("pitch_lut_v*.npy"))) == PITCH_LUT_CACHE_FILES
+    assert os.path.exists(pitch_lut_path(str(tmp_path), HOMOGRAPHY * (1 + (PITCH_LUT_CACHE_FILES + 1) / 100), FIELD,
+                                         width=20, height=10))
+
+
+def test_mirror_x() -> None:
+    lut = build_pitch_lut(HOMOGRAPHY, FIELD, width=200, height=100)
+    mirrored = build_pitch_lut(HOMOGRAPHY, FIELD, mirror_x=True, width=200, height=100)
+    # Raw pixel x of the mirrored table is pixel 200 - x of the unmirrored one
+    assert np.array_equal(mirrored[:, 1:], lut[:, :0:-1], equal_nan=True)
+
+
+def test_tracker_lut_and_mirroring() -> None:
+    rng = np.random.default_rng(42)
+    rows = [(camera_id, timestamp, rng.uniform(0, 1920), rng.uniform(200, 1080), 0., 0.9)
+            for timestamp in range(100) for camera_id in (1, 3) if rng.uniform() < 0.8]
+    detections_array = np.array(rows, dtype=DETECTIONS_DTYPE)
+
+    def results(detections_array: np.ndarray, **kwargs) -> list:
+        tracker = MultiCameraTracker(use_formplane=False, **kwargs)
+        tracker.add_camera(1, JETSON1_REAL_WORLD)
+        tracker.add_camera(3, JETSON3_REAL_WORLD)
+        return tracker.analyze_sequence(detections_array)
+
+    expected = results(detections_array)
+
+    # Camera 3 sending raw coordinates, mirrored by the tracker, with and without the tables
+    raw = detections_array.copy()
+    raw['x'] = np.where(raw['camera_id'] == 3, 1920 - raw['x'], raw['x'])
+    for kwargs in ({"mirrored_cameras": (3,)}, {"mirrored_cameras": (3,), "use_lut": True}):
+        result = results(raw, **kwargs)
+        assert [type(r) for r in result] == [type(r) for r in expected]
+        for r, e in zip(result, expected):
+            # Within a centimetre (or less than 0.1% far off the pitch), from the float32 tables and interpolating
+            # between pixels
+            assert (r.x, r.y, r.z) == pytest.approx((e.x, e.y, e.z), rel=1e-3, abs=1e-2)
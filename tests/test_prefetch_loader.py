@@ -0,0 +1,97 @@
+import threading
+import time
+
+import numpy as np
+
+from data.prefetch_loader import PrefetchLoader
+
+
+class SlowDataset:
+    """
+    Stands in for TriangulationBohsDataset: items take a random time to "decode", and we track how many are loaded at
+    once.
+    """
+
+    def __init__(self, n: int):
+        self.n = n
+        self.rng = np.random.default_rng(0)
+        self.delays = self.rng.uniform(0, 0.005, n)
+        self.lock = threading.Lock()
+        self.started = []
+
+    def __len__(self) -> int:
+        return self.n
+
+    def __getitem__(self, ndx: int) -> tuple:
+        with self.lock:
+            self.started.append(ndx)
+        time.sleep(self.delays[ndx])
+        image = np.full((4, 6, 3), ndx, dtype=np.uint8)
+        return image, image + 1, [[ndx, ndx, ndx, ndx]], [], [1], [], f"1_{ndx}.jpg", f"3_{ndx}.jpg"
+
+
+def test_items_come_out_in_order() -> None:
+    dataset = SlowDataset(40)
+    items = list(PrefetchLoader(dataset, num_workers=4))
+    assert [item[-2] for item in items] == [f"1_{ndx}.jpg" for ndx in range(40)]
+    assert sorted(dataset.started) == list(range(40))
+
+
+def test_batches_and_early_stop() -> None:
+    dataset = SlowDataset(10)
+    batches = list(PrefetchLoader(dataset, batch_size=4, num_workers=2))
+    assert [len(batch[0]) for batch in batches] == [4, 4, 2]
+    assert batches[1][0].shape == (4, 4, 6, 3)
+    assert batches[2][0][:, 0, 0, 0].tolist() == [8, 9]
+    assert batches[2][6] == ["1_8.jpg", "1_9.jpg"]
+
+    # Stopping early doesn't load everything else, only up to prefetch ahead
+    dataset = SlowDataset(100)
+    for i, _ in enumerate(PrefetchLoader(dataset, num_workers=2, prefetch=4)):
+        if i == 5:
+            break
+    assert len(dataset.started) <= 6 + 4 + 1
+
+
+def test_no_workers_loads_on_demand() -> None:
+    dataset = SlowDataset(10)
+    loader = PrefetchLoader(dataset, num_workers=0)
+    for i, _ in enumerate(loader):
+        # Nothing is loaded ahead
+        assert dataset.started == list(range(i + 1))
+        if i == 5:
+            break
+    assert [len(batch[0]) for batch in PrefetchLoader(SlowDataset(10), batch_size=4, num_workers=0)] == [4, 4, 2]
+
+
+class PicklingDataset:
+    """
+    Picklable 3 camera dataset, that counts how many times it is pickled.
+    """
+    pickles = 0
+
+    def __init__(self, n: int):
+        self.n = n
+
+    def __len__(self) -> int:
+        return self.n
+
+    def __getitem__(self, ndx: int) -> tuple:
+        image = np.full((4, 6, 3), ndx, dtype=np.uint8)
+        return image, image + 1, image + 2, [[ndx, ndx, ndx, ndx]], f"{ndx}.jpg"
+
+    def __getstate__(self) -> dict:
+        PicklingDataset.pickles += 1
+        return self.__dict__
+
+
+def test_processes_and_n_cameras() -> None:
+    PicklingDataset.pickles = 0
+    batches = list(PrefetchLoader(PicklingDataset(20), batch_size=4, num_workers=2, use_processes=True))
+    # Sent to each worker once at most, not with every task
+    assert PicklingDataset.pickles <= 2
+    assert len(batches) == 5
+    assert [batch[2].shape for batch in batches] == [(4, 4, 6, 3)] * 5
+    assert batches[1][2][:, 0, 0, 0].tolist() == [6, 7, 8, 9]
+    assert batches[1][3] == [[[ndx] * 4] for ndx in range(4, 8)]
+    assert batches[1][4] == ["4.jpg", "5.jpg", "6.jpg", "7.jpg"]
@@ -0,0 +1,55 @@
+import numpy as np
+
+from triangulation_logic import THREE_D_POINTS_FLAG
+from utils.data_classes import ThreeDPoints
+from utils.trajectory_history import TrajectoryHistory
+
+
+def test_history_is_bounded() -> None:
+    history = TrajectoryHistory(capacity=4, flag=THREE_D_POINTS_FLAG)
+    for i in range(10):
+        history.append(ThreeDPoints(x=float(i), y=1., z=0., timestamp=i))
+
+    assert len(history) == 4
+    assert history[-1] == ThreeDPoints(x=9., y=1., z=0., timestamp=9.)
+    assert history[0].x == 6.
+    assert history.to_arrays()[0].tolist() == [6., 7., 8., 9.]
+
+
+def test_flags_and_last_valid() -> None:
+    history = TrajectoryHistory(capacity=8, flag=THREE_D_POINTS_FLAG)
+    history.append(THREE_D_POINTS_FLAG)
+    history.append(ThreeDPoints(x=1., y=1., z=0., timestamp=1))
+    history.append(ThreeDPoints(x=2., y=2., z=0., timestamp=2))
+    history.append_flag()
+
+    assert history[-1] == THREE_D_POINTS_FLAG
+    assert [p.x for p in history.last_valid(2)] == [1., 2.]
+    assert [p.x for p in history.last_valid(5)] == [1., 2.]
+
+    # The window only looks at the most recent entries, valid or not
+    assert [p.x for p in history.last_valid(2, window=2)] == [2.]
+    for _ in range(3):
+        history.append_flag()
+    assert history.last_valid(2, window=4) == []
+
+
+def test_plane_is_kept_up_to_date() -> None:
+    rng = np.random.default_rng(3)
+    history = TrajectoryHistory(capacity=16, flag=THREE_D_POINTS_FLAG)
+    for i in range(200):
+        if rng.uniform() < 0.4:
+            history.append_flag()
+        else:
+            # Repeat the last point now and then, to get stationary planes
+            x, y = (history.last_valid(1)[0].x, history.last_valid(1)[0].y) if i and rng.uniform() < 0.1 and \
+                history.valid_count else (rng.uniform(0, 68), rng.uniform(0, 105))
+            history.append_xyz(x, y, 0., i)
+
+        last_2_points = history.last_valid(2, window=10)
+        assert history.has_plane(window=10) == (len(last_2_points) == 2)
+        if len(last_2_points) == 2:
+            a, b = last_2_points[-1], last_2_points[-2]
+            normal = (-(b.y - a.y), b.x - a.x)
+            assert history.plane.tolist() == [normal[0], normal[1], 0., -(a.x * normal[0] + a.y * normal[1])]
+            assert history.plane_stationary == (not np.any(history.plane))
@@ -5,7 +5,7 @@ import numpy as np
 from typing import List, Dict
 
 from triangulation_logic import MultiCameraTracker
-from utils.data_classes import Detections
+from utils.data_classes import Detections, DETECTIONS_DTYPE, ThreeDPoints
 
 
 JETSON1_REAL_WORLD = np.array([[-19.41], [-21.85], [7.78]])
@@ -77,12 +77,134 @@ def test_perform_homography() -> None:
 
     # Check that the homography was performed correctly
     assert len(_detections) == 5
-    assert len(_detections[0].x) == 1
-    assert type(_detections[0].x) == np.ndarray  # Not sure if this is what we want, but it's what we have for now
+    assert type(_detections[0].x) == float
+
+    # The input detections aren't modified
+    assert in_bounds_detections[0].x == 800 and in_bounds_detections[0].y == 800
 
     # Check that the outputs are reasonable
-    assert 10 < _detections[0].x[0] < 11
-    assert 46 < _detections[0].y[0] < 50
+    assert 10 < _detections[0].x < 11
+    assert 46 < _detections[0].y < 50
     assert _detections[2].x < 0  # This value is in bounds, but outside of the pitch! It should be negative (in this scenario)
     assert _detections[3].y < 0, "This value is just off the pitch, passed the side lines, so should be negative"
 
+
+def test_small_and_large_frames_agree() -> None:
+    """
+    Small frames go through the scalar paths, bigger ones through the vectorized stages, the results should match.
+    """
+    tracker = MultiCameraTracker(use_formplane=False, mirrored_cameras=(3,))
+    tracker.add_camera(1, JETSON1_REAL_WORLD)
+    tracker.add_camera(3, JETSON3_REAL_WORLD)
+
+    rng = np.random.default_rng(7)
+    detections = [Detections(camera_id=int(camera_id), probability=0.9, timestamp=0, x=x, y=y, z=0)
+                  for camera_id, x, y in zip(rng.choice([1, 3], 200), rng.uniform(-50, 1970, 200),
+                                             rng.uniform(200, 1100, 200))]
+
+    small = [d for start in range(0, 200, 2) for d in tracker.perform_homography(detections[start:start + 2])]
+    large = tracker.perform_homography(detections)
+    assert np.allclose([(d.x, d.y) for d in small], [(d.x, d.y) for d in large], rtol=1e-12)
+
+    small = [d for start in range(0, 200, 2) for d in tracker.remove_oob_detections(detections[start:start + 2])]
+    assert small == tracker.remove_oob_detections(detections)
+
+    # Just inside of camera 3's field, but not its pixel (see tests/test_field_mask.py), in both paths
+    edge = Detections(camera_id=3, probability=0.9, timestamp=0, x=1920 - 739, y=248.48, z=0)
+    assert tracker.remove_oob_detections([edge]) == [edge]
+    assert tracker.remove_oob_detections([edge] * 100) == [edge] * 100
+
+    with pytest.raises(KeyError):
+        tracker.perform_homography([Detections(camera_id=5, probability=0.9, timestamp=0, x=1, y=1, z=0)])
+
+
+def test_analyze_sequence_matches_multi_camera_analysis() -> None:
+    rng = np.random.default_rng(42)
+    rows = []
+    for timestamp in range(200):
+        for camera_id in (1, 3):
+            # Random mix of in bounds, out of bounds and missing detections for each camera
+            for _ in range(rng.integers(0, 3)):
+                rows.append((camera_id, timestamp, rng.uniform(0, 1920), rng.uniform(200, 1080), 0., rng.uniform(0.5, 1)))
+    detections_array = np.array(rows, dtype=DETECTIONS_DTYPE)
+
+    sequence_tracker = initialize_tracker()
+    results = sequence_tracker.analyze_sequence(detections_array)
+
+    frame_tracker = initialize_tracker()
+    expected = []
+    for timestamp in np.unique(detections_array['timestamp']):
+        frame = detections_array[detections_array['timestamp'] == timestamp]
+        dets = [Detections(camera_id=int(r['camera_id']), probability=float(r['probability']), timestamp=timestamp,
+                           x=float(r['x']), y=float(r['y']), z=float(r['z'])) for r in frame]
+        expected.append(frame_tracker.multi_camera_analysis(dets))
+
+    assert len(results) == len(expected)
+    for result, exp in zip(results, expected):
+        assert type(result) == type(exp)
+        assert result.x == pytest.approx(exp.x)
+        assert result.y == pytest.approx(exp.y)
+        assert result.z == pytest.approx(exp.z)
+        assert result.timestamp == exp.timestamp
+
+
+def test_n_camera_detection() -> None:
+    tracker = MultiCameraTracker(use_formplane=False)
+
+    # Cameras where 10 pixels are 1 metre on the pitch, all looking at the whole image
+    homography = np.diag([0.1, 0.1, 1.])
+    full_image = ((0, 0), (1920, 0), (1920, 1080), (0, 1080))
+    camera_centres = {11: (-5., 20., 8.), 12: (70., 30., 9.), 13: (30., -8., 7.)}
+    for camera_id, centre in camera_centres.items():
+        tracker.add_camera(camera_id, np.array(centre).reshape(3, 1), homography=homography,
+                           image_field_coordinates=full_image)
+
+    ball = np.array([30., 50., 2.])
+    dets = []
+    for camera_id, centre in camera_centres.items():
+        centre = np.array(centre)
+        ground_point = centre + (ball - centre) * centre[2] / (centre[2] - ball[2])
+        dets.append(Detections(camera_id=camera_id, probability=0.9, timestamp=3, x=ground_point[0] * 10,
+                               y=ground_point[1] * 10, z=0))
+
+    three_d_point = tracker.multi_camera_analysis(dets)
+    assert type(three_d_point) == ThreeDPoints
+    assert three_d_point.x == pytest.approx(30.)
+    assert three_d_point.y == pytest.approx(50.)
+    assert three_d_point.z == pytest.approx(2.)
+
+    # The same frame through analyze_sequence
+    tracker = MultiCameraTracker(use_formplane=False)
+    for camera_id, centre in camera_centres.items():
+        tracker.add_camera(camera_id, np.array(centre).reshape(3, 1), homography=homography,
+                           image_field_coordinates=full_image)
+    detections_array = np.array([(d.camera_id, d.timestamp, d.x, d.y, d.z, d.probability) for d in dets],
+                                dtype=DETECTIONS_DTYPE)
+    result = tracker.analyze_sequence(detections_array)[0]
+    assert result.x == pytest.approx(three_d_point.x)
+    assert result.z == pytest.approx(three_d_point.z)
+
+
+def test_stage_latencies() -> None:
+    tracker = MultiCameraTracker(use_formplane=False, instrument=True)
+    tracker.add_camera(1, JETSON1_REAL_WORLD)
+    tracker.add_camera(3, JETSON3_REAL_WORLD)
+
+    for _ in range(20):
+        tracker.multi_camera_analysis([
+            Detections(camera_id=3, probability=0.9, timestamp=9, x=891, y=284, z=0),
+            Detections(camera_id=1, probability=0.9, timestamp=9, x=274, y=754, z=0),
+        ])
+
+    percentiles = tracker.latency_percentiles()
+    assert percentiles['two_camera']['p50'] > 0
+    assert percentiles['total']['p99'] >= percentiles['homography']['p50']
+    assert percentiles['one_camera']['p50'] == 0
+
+    snapshot = tracker.latency_snapshot(reset=True)
+    assert snapshot['remove_oob']['count'] == 20
+    assert snapshot['common_sense']['count'] == 20
+    assert tracker.latency_snapshot()['total']['count'] == 0
+
+    with pytest.raises(RuntimeError):
+        initialize_tracker().latency_percentiles()
@@ -1,40 +1,174 @@
 # Generally inspired from: https://github.com/HaziqRazali/Soccer-Tracker
 
-import copy
 from collections import namedtuple
-from typing import Dict, List, Union, Tuple
+from time import perf_counter_ns
+from typing import Dict, List, Optional, Sequence, Union, Tuple
 
 import numpy as np
-from matplotlib.path import Path
 from statistics import mean
 
-from utils.camera_homography import *
+from utils.cache import default_cache_dir
+from utils.calibration import load_homographies
 from utils.data_classes import Camera, Detections, ThreeDPoints, OutOfBounds, FailedCommonSense
-from utils.config import get_image_field_coordinates
-from python_learning.homography_practice import get_new_homographies
+from utils.field_mask import load_field_mask, lookup_field_masks, point_in_polygon
+from utils.pitch_lut import load_pitch_lut, lookup_pitch_lut
+from utils.trajectory_history import TrajectoryHistory
+from utils.geometry import apply_homography, apply_homographies, intersect_vertical_plane, intersect_vertical_plane_batch, \
+    triangulate_least_squares, triangulate_least_squares_batch, triangulate_midpoint, triangulate_midpoint_batch
+from utils.config import get_image_field_coordinates, IMAGE_HEIGHT, IMAGE_WIDTH
+from utils.timer import LatencyHistogram
 
 
 JETSON1_REAL_WORLD = np.array([[-19.41], [-21.85], [7.78]])
 JETSON3_REAL_WORLD = np.array([[0.], [86.16], [7.85]])
 MAX_SPEED: int = 40
 MAX_DELTA_T: int = 75  # TODO: this should be a config value; it is the maximum number of frames (4 sec timeout @ 25FPS)
+TRAJECTORY_HISTORY_SIZE: int = 1500  # Number of past 3D points kept by the tracker (1 min @ 25FPS)
 THREE_D_POINTS_FLAG: ThreeDPoints = ThreeDPoints(x=999., y=999., z=999., timestamp=0)  # Flag used for when we have no detections
 
+# Stages of multi_camera_analysis() that are timed when the tracker is created with instrument=True. The camera path
+# stages include the common_sense time of that frame.
+TRACKER_STAGES: Tuple[str, ...] = ('remove_oob', 'filter_most_confident', 'homography', 'one_camera', 'two_camera',
+                                   'n_camera', 'common_sense', 'total')
+
+# Frames with at most this many detections take the scalar (plain Python float) paths of the per frame stages, which
+# beat the vectorized numpy ones until there are ~16 detections
+SMALL_FRAME_DETECTIONS: int = 8
+# The same for remove_oob_detections(). The polygon test is ~1.5us per detection, while the mask lookup has ~100us of
+# fixed overhead, so the scalar path wins for far bigger frames
+SMALL_FRAME_OOB_DETECTIONS: int = 64
+
 FieldDimensions = namedtuple('FieldDimensions', 'width length')
 
 
 class MultiCameraTracker:
-    def __init__(self, use_formplane: bool = True):
+    def __init__(
+            self,
+            use_formplane: bool = True,
+            history_size: int = TRAJECTORY_HISTORY_SIZE,
+            instrument: bool = False,
+            homographies: Dict = None,
+            use_lut: bool = False,
+            lut_interpolation: str = "bilinear",
+            mirrored_cameras: Tuple[int, ...] = (),
+            use_cache: bool = True,
+            cache_dir: Optional[str] = None,
+    ):
+        """
+        :param homographies: Optional dict of camera id (str) -> (3, 3) homography, instead of the calibrated ones from
+            load_homographies()
+        :param use_lut: Project detections with a precomputed pixel -> pitch lookup table per camera (see
+            utils.pitch_lut) instead of the homography. Falls back to the homography near the edge of the field.
+            Note that in numpy only lut_interpolation="nearest" is actually faster than the (vectorized) homography.
+        :param lut_interpolation: "bilinear" or "nearest", see utils.pitch_lut.lookup_pitch_lut()
+        :param mirrored_cameras: Cameras whose detections come in raw image coordinates but whose homography and field
+            coordinates are mirrored (i.e. utils.config.MIRRORED_CAMERAS). The tracker mirrors their x coordinates
+            itself, so callers don't have to apply x = 1920 - x.
+        :param use_cache: Cache the homographies, field masks and lookup tables on disk, so they are only computed once
+            per calibration
+        :param cache_dir: Folder for the caches, defaults to utils.cache.default_cache_dir() (outside of the repo)
+        """
         self.cameras: Dict[str, Camera] = {}
-        self.homographies: Dict = get_new_homographies()  # TODO: this needs refactoring when time to cleanup
+        self.use_cache: bool = use_cache
+        self.cache_dir: Optional[str] = (cache_dir if cache_dir is not None else default_cache_dir()) if use_cache \
+            else None
+        # Cached, only recomputed when the calibration inputs change
+        self.homographies: Dict = load_homographies(self.cache_dir) if homographies is None else homographies
         self.image_field_coordinates: Dict[str, Tuple[Tuple[int, int], Tuple[int, int], Tuple[int, int], Tuple[int, int]]] = get_image_field_coordinates()
-        self.three_d_points: List[ThreeDPoints] = [THREE_D_POINTS_FLAG]  # Initialize with a flag
-        self.plane: Union[List[np.array], None] = None
-        # self.plane: Tuple(np.array, np.array, np.array, np.array) = None
+        self.three_d_points: TrajectoryHistory = TrajectoryHistory(capacity=history_size, flag=THREE_D_POINTS_FLAG)
+        self.three_d_points.append_flag()  # Initialize with a flag
+        self.plane: Union[np.ndarray, None] = None  # (4,) float64 coefficients of the vertical plane, see form_plane()
+        self.plane_stationary: bool = False  # Whether self.plane is all 0's (i.e. the ball was still)
+        self.plane_buffer: np.ndarray = np.zeros(4, dtype=np.float64)  # self.plane points here once it is formed
         self.field_model: Tuple = FieldDimensions(68, 105)
         self.use_formplane: bool = use_formplane
         self.last_det_used_two_cameras: bool = False  # This state is used for smoothing transitions between 1 and 2 cameras
 
+        # Homographies of the added cameras stacked into one (C, 3, 3) array, in the order of the sorted camera ids
+        self.camera_ids: np.ndarray = np.empty(0, dtype=np.int64)
+        self.homography_stack: np.ndarray = np.empty((0, 3, 3), dtype=np.float64)
+        # Bit packed field masks, only built (or loaded from the cache) the first time they are needed, see field_mask_stack
+        self._field_mask_stack: Union[np.ndarray, None] = None
+        self.camera_centres: np.ndarray = np.empty((0, 3), dtype=np.float64)
+        self.mirrored_cameras: Tuple[int, ...] = tuple(int(camera_id) for camera_id in mirrored_cameras)
+        self.mirrored_stack: np.ndarray = np.empty(0, dtype=bool)  # Whether each camera in self.camera_ids is mirrored
+        self.use_lut: bool = use_lut
+        self.lut_interpolation: str = lut_interpolation
+        self.pitch_luts: List[np.ndarray] = []  # (H, W, 2) memory mapped lookup table per camera, if use_lut
+        # Camera id -> (the 9 floats of its homography, whether it's mirrored), for the scalar homography path
+        self.homography_rows: Dict[int, Tuple[Tuple[float, ...], bool]] = {}
+        self.field_polygons: List[Tuple] = []  # Image field coordinates of each camera in self.camera_ids
+        # Camera id -> (its image field coordinates, whether it's mirrored), for the scalar out of bounds path
+        self.camera_field_polygons: Dict[int, Tuple[Tuple, bool]] = {}
+
+        # Per stage latency histograms, only kept if instrument=True so that the default path doesn't pay for timing
+        self.stage_latencies: Union[Dict[str, LatencyHistogram], None] = \
+            {stage: LatencyHistogram() for stage in TRACKER_STAGES} if instrument else None
+
+    @classmethod
+    def from_camera_stacks(
+            cls,
+            camera_ids: np.ndarray,
+            homography_stack: np.ndarray,
+            field_mask_stack: np.ndarray,
+            camera_centres: np.ndarray,
+            field_polygons: Sequence[Tuple] = None,
+            **kwargs,
+    ) -> "MultiCameraTracker":
+        """
+        Creates a tracker straight from the per camera stacks of another tracker (i.e. tracker.homography_stack), rather
+        than with add_camera(). The stacks are used as they are, without copying, so they can be views of read only
+        shared memory that many trackers use at once (see practical_testing.match_host).
+        :param camera_ids: (C,) sorted camera ids
+        :param homography_stack: (C, 3, 3) float64 homographies
+        :param field_mask_stack: (C, height, ceil(width / 8)) uint8 bit packed field masks, see
+            utils.field_mask.load_field_mask()
+        :param camera_centres: (C, 3) float64 real world camera coordinates
+        :param field_polygons: Image field coordinates of each camera (i.e. tracker.field_polygons), defaults to the
+            ones in utils.config, which only has the Jetsons
+        :param kwargs: Passed on to MultiCameraTracker()
+        """
+        tracker = cls(homographies={str(camera_id): homography_stack[i] for i, camera_id in enumerate(camera_ids)},
+                      **kwargs)
+        if field_polygons is not None:
+            for camera_id, polygon in zip(camera_ids.tolist(), field_polygons):
+                tracker.image_field_coordinates[str(camera_id)] = polygon
+        for i, camera_id in enumerate(camera_ids.tolist()):
+            tracker.cameras[str(camera_id)] = Camera(
+                id=camera_id,
+                homography=homography_stack[i],
+                real_world_camera_coords=camera_centres[i].reshape(3, 1),
+                image_field_coordinates=tracker.image_field_coordinates.get(str(camera_id)),
+                field_mask=field_mask_stack[i],
+            )
+        tracker.camera_ids = camera_ids
+        tracker.homography_stack = homography_stack
+        tracker.field_mask_stack = field_mask_stack
+        tracker.camera_centres = camera_centres
+        tracker.build_projection_tables()
+        return tracker
+
+    @property
+    def field_mask_stack(self) -> np.ndarray:
+        """
+        (C, height, ceil(width / 8)) uint8 stack of the bit packed field masks of self.camera_ids. It is stacked once, the
+        first time a detection is checked against the masks after the cameras were added, and the masks themselves are
+        cached next to the homographies (see utils.field_mask.load_field_mask()), so they are only rasterized once per
+        calibration.
+        """
+        if self._field_mask_stack is None:
+            if len(self.camera_ids) == 0:
+                return np.empty((0, IMAGE_HEIGHT, (IMAGE_WIDTH + 7) // 8), dtype=np.uint8)
+            self._field_mask_stack = np.stack([
+                load_field_mask(self.cache_dir, self.image_field_coordinates[str(camera_id)])
+                for camera_id in self.camera_ids.tolist()
+            ])
+        return self._field_mask_stack
+
+    @field_mask_stack.setter
+    def field_mask_stack(self, field_mask_stack: np.ndarray) -> None:
+        self._field_mask_stack = field_mask_stack
+
     @property
     def camera_count(self) -> int:
         """
@@ -42,36 +176,115 @@ class MultiCameraTracker:
         """
         return len(self.cameras)
 
-    def add_camera(self, idx: int, real_world_camera_coords: Tuple):
+    def add_camera(
+            self,
+            idx: int,
+            real_world_camera_coords: Tuple,
+            homography: np.ndarray = None,
+            image_field_coordinates: Tuple = None,
+    ):
         """
         Adds a camera to the MultiCameraTracker object.
         :param idx (int): The camera ID
         :param real_world_camera_coords (Tuple): The real world coordinates of the camera
+        :param homography (np.ndarray): Optional homography for the camera, for cameras that aren't in the calibrated
+            self.homographies yet
+        :param image_field_coordinates (Tuple): Optional field bounds in the image, for cameras that aren't in
+            utils.config yet
         """
+        if homography is not None:
+            self.homographies[str(idx)] = homography
+        if image_field_coordinates is not None:
+            self.image_field_coordinates[str(idx)] = image_field_coordinates
+
         cam = Camera(
             id=idx,
             homography=self.homographies[str(idx)],
             real_world_camera_coords=real_world_camera_coords,
-            image_field_coordinates=self.image_field_coordinates[str(idx)]
+            image_field_coordinates=self.image_field_coordinates[str(idx)],
         )
         self.cameras[str(idx)] = cam
 
+        self.camera_ids = np.array(sorted(int(camera.id) for camera in self.cameras.values()), dtype=np.int64)
+        self.homography_stack = np.ascontiguousarray(
+            [self.homographies[str(camera_id)] for camera_id in self.camera_ids], dtype=np.float64
+        ).reshape(-1, 3, 3)
+        # Restacked lazily, see field_mask_stack
+        self._field_mask_stack = None
+        # Camera centres are precomputed here so the per frame triangulation doesn't need to gather them
+        self.camera_centres = np.array(
+            [np.ravel(self.cameras[str(camera_id)].real_world_camera_coords) for camera_id in self.camera_ids],
+            dtype=np.float64,
+        )
+        self.build_projection_tables()
+
+    def build_projection_tables(self) -> None:
+        """
+        Sets up the mirroring and (if use_lut) loads the lookup tables of the cameras in self.camera_ids. The tables are
+        cached on disk next to the homographies and memory mapped, so building them is only paid once per calibration.
+        """
+        self.mirrored_stack = np.isin(self.camera_ids, self.mirrored_cameras)
+        self.homography_rows = {
+            camera_id: (tuple(self.homography_stack[i].ravel().tolist()), bool(self.mirrored_stack[i]))
+            for i, camera_id in enumerate(self.camera_ids.tolist())
+        }
+        self.field_polygons = [self.image_field_coordinates[str(camera_id)] for camera_id in self.camera_ids.tolist()]
+        self.camera_field_polygons = {
+            camera_id: (self.field_polygons[i], bool(self.mirrored_stack[i]))
+            for i, camera_id in enumerate(self.camera_ids.tolist())
+        }
+        if self.use_lut:
+            self.pitch_luts = [
+                load_pitch_lut(self.cache_dir, self.homography_stack[i],
+                               self.image_field_coordinates[str(camera_id)], mirror_x=bool(self.mirrored_stack[i]))
+                for i, camera_id in enumerate(self.camera_ids.tolist())
+            ]
+
+    def camera_indices(self, camera_ids: np.ndarray) -> np.ndarray:
+        """
+        Maps camera ids to their index in the per camera stacks (i.e. self.homography_stack)
+        :param camera_ids: Array of camera ids
+        :return: Array of indices, the same shape as camera_ids
+        """
+        camera_ids = np.asarray(camera_ids, dtype=np.int64)
+        ndx = np.searchsorted(self.camera_ids, camera_ids)
+        ndx = np.minimum(ndx, len(self.camera_ids) - 1)
+        if len(self.camera_ids) == 0 or np.any(self.camera_ids[ndx] != camera_ids):
+            raise KeyError(f"Camera ids {np.setdiff1d(camera_ids, self.camera_ids)} have not been added to the tracker")
+        return ndx
+
     def remove_oob_detections(self, _detections: List[Detections]) -> List[Union[Detections, None]]:
         """
         Removes any detections that are out of bounds of the field in the image frame.
-        The image field coords/ bounds are currently set in utils.config in the get_image_field_coordinates() function
+        The image field coords/ bounds are currently set in utils.config in the get_image_field_coordinates() function,
+        and are rasterized into a (cached) field mask per camera, see field_mask_stack. Small frames are checked against
+        the polygons directly, one detection at a time.
 
         :param _detections (List[Detections]): List of detections objects
         :return _detections (List[Union[Detections, None]]): List of detections objects with the out of bound detections removed.
         """
-        for det in _detections.copy():
-            image_field_coordinates = self.image_field_coordinates[str(det.camera_id)]
-            # Create the path of the rhombus
-            rhombus_path = Path(image_field_coordinates)
-            # Check if the point is within the rhombus
-            if not rhombus_path.contains_point((det.x, det.y)):
-                _detections.remove(det)
-        return _detections
+        if len(_detections) == 0:
+            return []
+
+        if len(_detections) <= SMALL_FRAME_OOB_DETECTIONS:
+            # Scalar path, like perform_homography()
+            kept = []
+            for det in _detections:
+                row = self.camera_field_polygons.get(int(det.camera_id))
+                if row is None:
+                    raise KeyError(f"Camera ids [{det.camera_id}] have not been added to the tracker")
+                polygon, mirrored = row
+                x, y = (IMAGE_WIDTH - float(det.x) if mirrored else float(det.x)), float(det.y)
+                if 0 <= x < IMAGE_WIDTH and 0 <= y < IMAGE_HEIGHT and point_in_polygon(polygon, x, y):
+                    kept.append(det)
+            return kept
+
+        in_field = self.in_field_mask(
+            np.fromiter((det.camera_id for det in _detections), dtype=np.int64, count=len(_detections)),
+            np.fromiter((det.x for det in _detections), dtype=np.float64, count=len(_detections)),
+            np.fromiter((det.y for det in _detections), dtype=np.float64, count=len(_detections)),
+        )
+        return [det for det, keep in zip(_detections, in_field.tolist()) if keep]
 
     # TODO: Remove the None type once I figure out how to handle the case where we have no detections if they're all
     #  removed by the remove_oob_detections() method above (should use the OutOfBounds class somehow)
@@ -130,25 +343,54 @@ class MultiCameraTracker:
         :return: Triangulated ThreeDPoints object with the 3D position of the ball
         """
 
-        # deleting the plane
-        self.plane = None
-
         cam1 = self.cameras[str(cam_list[0])].real_world_camera_coords
         cam2 = self.cameras[str(cam_list[1])].real_world_camera_coords
-        # TODO: gains np.arrays here
-        three_d_pos = self.triangulate(detections[0], cam1, detections[1], cam2)
-        # this assumes that the detections coming through have the same timestamp
-        three_d_pos = ThreeDPoints(x=three_d_pos[0], y=three_d_pos[1], z=three_d_pos[2],
-                                   timestamp=detections[0].timestamp)
+        det1, det2 = detections[0], detections[1]
+        x, y, z = triangulate_midpoint(
+            float(det1.x), float(det1.y), float(det1.z), cam1.item(0), cam1.item(1), cam1.item(2),
+            float(det2.x), float(det2.y), float(det2.z), cam2.item(0), cam2.item(1), cam2.item(2),
+        )
+        # this assumes that the detections coming through have the same timestamp (see utils.frame_synchronizer)
+        three_d_pos = ThreeDPoints(x=x, y=y, z=z, timestamp=det1.timestamp)
+
+        return self.handle_triangulated_point(three_d_pos)
+
+    def n_camera_detection(self, detections: List[Detections], cam_list: List) -> ThreeDPoints:
+        """
+        This method triangulates three or more detections of the ball with a least squares fit of all of the camera
+        rays. The two camera case keeps using two_camera_detection() and mid-point triangulation.
+        :param detections: List of detections, one per camera
+        :param cam_list: Camera ids of the detections
+        :return: Triangulated ThreeDPoints object with the 3D position of the ball
+        """
+        ball_points = np.array([[det.x, det.y, det.z] for det in detections], dtype=np.float64)
+        camera_centres = self.camera_centres[self.camera_indices(cam_list)]
+        x, y, z = triangulate_least_squares(ball_points, camera_centres).tolist()
+
+        # this assumes that the detections coming through have the same timestamp (see utils.frame_synchronizer)
+        three_d_pos = ThreeDPoints(x=x, y=y, z=z, timestamp=detections[0].timestamp)
+
+        return self.handle_triangulated_point(three_d_pos)
+
+    def handle_triangulated_point(self, three_d_pos: ThreeDPoints) -> Union[ThreeDPoints, OutOfBounds, FailedCommonSense]:
+        """
+        Runs the stateful part of the two (or more) camera path on an already triangulated point: bounds and common sense checks,
+        appending to self.three_d_points and smoothing the transition from 1 to 2 cameras.
+        :param three_d_pos: Triangulated ThreeDPoints object
+        :return: ThreeDPoints, or OutOfBounds/ FailedCommonSense if the point was rejected
+        """
+        # deleting the plane
+        self.plane = None
+        self.plane_stationary = False
 
         if (self.field_model.width > three_d_pos.x > 0) and (self.field_model.length > three_d_pos.y > 0):
-            if self.common_sense(three_d_pos):
-                self.three_d_points.append(copy.deepcopy(three_d_pos))
+            if self.timed_common_sense(three_d_pos):
+                self.three_d_points.append(three_d_pos)
             else:
-                self.three_d_points.append(copy.deepcopy(THREE_D_POINTS_FLAG))
+                self.three_d_points.append_flag()
                 three_d_pos = FailedCommonSense.from_three_d_points(three_d_pos)
         else:
-            self.three_d_points.append(copy.deepcopy(THREE_D_POINTS_FLAG))
+            self.three_d_points.append_flag()
             three_d_pos = OutOfBounds.from_three_d_points(three_d_pos)
 
         if not self.last_det_used_two_cameras:
@@ -182,8 +424,7 @@ class MultiCameraTracker:
         if self.plane is not None:  # Check that the ball was recently detected by two cameras
 
             # Flag for whether to just use homography or use form plane.
-            if all(np.all(arr == 0) for arr in
-                   self.plane) or not self.use_formplane:  # Check if the plane is all 0's (i.e. if the ball is still) (unncesarily complicated expression as are plane isn't just a single np.array, its 4 in a list atm)
+            if self.plane_stationary or not self.use_formplane:  # The plane is all 0's if the ball is still
                 three_d_estimation = ThreeDPoints(
                     x=detections[0].x,
                     y=detections[0].y,
@@ -202,19 +443,19 @@ class MultiCameraTracker:
             if (self.field_model.width > three_d_estimation.x > 0) and \
                     (self.field_model.length > three_d_estimation.y > 0):
 
-                if self.common_sense(three_d_estimation):
+                if self.timed_common_sense(three_d_estimation):
                     if self.last_det_used_two_cameras:
                         # Transitioning from two cameras to one camera
                         three_d_estimation = self.transition_smoothing(three_d_estimation)
                         self.last_det_used_two_cameras = False
 
-                    self.three_d_points.append(copy.deepcopy(three_d_estimation))
+                    self.three_d_points.append(three_d_estimation)
                     return three_d_estimation
                 else:
-                    self.three_d_points.append(copy.deepcopy(THREE_D_POINTS_FLAG))
+                    self.three_d_points.append_flag()
                     return FailedCommonSense.from_three_d_points(three_d_estimation)
             else:
-                self.three_d_points.append(copy.deepcopy(THREE_D_POINTS_FLAG))
+                self.three_d_points.append_flag()
                 return OutOfBounds.from_three_d_points(three_d_estimation)
         else:
             # Return the detection as a ThreeDPoints object unchanged
@@ -236,10 +477,20 @@ class MultiCameraTracker:
             Returns:
                 3D world position of the ball
         """
+        timing = self.stage_latencies is not None
+        if timing:
+            start = stage_start = perf_counter_ns()
+
         # TODO: right now, it'll return None if all the dets are oob. This isn't good.
         _detections = self.remove_oob_detections(_detections)
+        if timing:
+            stage_start = self.record_stage('remove_oob', stage_start)
         _detections = self.filter_most_confident_dets(_detections)
+        if timing:
+            stage_start = self.record_stage('filter_most_confident', stage_start)
         detections = self.perform_homography(_detections)
+        if timing:
+            stage_start = self.record_stage('homography', stage_start)
 
         # Prepare for Triangulation
         # Create a list with the different camera ids
@@ -247,37 +498,270 @@ class MultiCameraTracker:
 
         # In case there are no detections
         three_d_pos = None
+        stage = None
 
         if len(detections) == 2:
             three_d_pos = self.two_camera_detection(detections, cam_list)
+            stage = 'two_camera'
         elif len(detections) == 1:
             three_d_pos = self.one_camera_detection(detections)
+            stage = 'one_camera'
+        elif len(detections) > 2:
+            three_d_pos = self.n_camera_detection(detections, cam_list)
+            stage = 'n_camera'
         else:
             # Temp fix
             three_d_pos = OutOfBounds(x=0, y=0, z=0, timestamp=0)
 
+        if timing:
+            if stage is not None:
+                self.record_stage(stage, stage_start)
+            self.record_stage('total', start)
+
         return three_d_pos
 
+    def record_stage(self, stage: str, stage_start: int) -> int:
+        """
+        Records the time since stage_start (from perf_counter_ns) against stage.
+        :return: The current perf_counter_ns, so it can be used as the start of the next stage
+        """
+        now = perf_counter_ns()
+        self.stage_latencies[stage].record(now - stage_start)
+        return now
+
+    def timed_common_sense(self, possible_detection) -> bool:
+        """
+        Calls common_sense(), timing it if the tracker is instrumented.
+        """
+        if self.stage_latencies is None:
+            return self.common_sense(possible_detection)
+        stage_start = perf_counter_ns()
+        passed = self.common_sense(possible_detection)
+        self.record_stage('common_sense', stage_start)
+        return passed
+
+    def latency_percentiles(self) -> Dict[str, Dict[str, float]]:
+        """
+        :return: p50/ p95/ p99 latency in ns of each instrumented stage, i.e. {'homography': {'p50': ..., ...}, ...}
+        """
+        if self.stage_latencies is None:
+            raise RuntimeError("The tracker wasn't created with instrument=True")
+        return {
+            stage: {'p50': hist.percentile(50), 'p95': hist.percentile(95), 'p99': hist.percentile(99)}
+            for stage, hist in self.stage_latencies.items()
+        }
+
+    def latency_snapshot(self, reset: bool = False) -> Dict[str, dict]:
+        """
+        :param reset: Whether to clear the histograms after taking the snapshot
+        :return: Copy of every stage's histogram (counts, totals and percentiles), see LatencyHistogram.snapshot()
+        """
+        if self.stage_latencies is None:
+            raise RuntimeError("The tracker wasn't created with instrument=True")
+        snapshot = {stage: hist.snapshot() for stage, hist in self.stage_latencies.items()}
+        if reset:
+            for hist in self.stage_latencies.values():
+                hist.reset()
+        return snapshot
+
+    def analyze_sequence(self, detections_array: np.ndarray) -> List[Union[ThreeDPoints, OutOfBounds, FailedCommonSense]]:
+        """
+        Offline version of multi_camera_analysis() for a whole recorded sequence at once.
+
+        The geometry stages (removing oob detections, keeping the most confident detection per camera, homography and
+        triangulation) are run vectorized over every detection in the sequence. The stateful stages
+        (transition smoothing, forming the plane, the flags in self.three_d_points) then run as a sequential pass over
+        the frames, so the results are the same as calling multi_camera_analysis() frame by frame.
+
+        :param detections_array: Columnar detections, one row per detection. Either a structured array with the
+            utils.data_classes.DETECTIONS_DTYPE layout, or a dict of equal length arrays with the keys camera_id,
+            timestamp, x, y, probability (and optionally z, which defaults to 0). Rows with the same timestamp make up
+            one frame.
+        :return: One result per frame (i.e. per unique timestamp), in increasing timestamp order
+        """
+        camera_ids = np.asarray(detections_array['camera_id'], dtype=np.int64)
+        timestamps = np.asarray(detections_array['timestamp'])
+        xs = np.asarray(detections_array['x'], dtype=np.float64)
+        ys = np.asarray(detections_array['y'], dtype=np.float64)
+        probabilities = np.asarray(detections_array['probability'], dtype=np.float64)
+        try:
+            zs = np.asarray(detections_array['z'], dtype=np.float64)
+        except (KeyError, ValueError):
+            zs = np.zeros(len(xs), dtype=np.float64)
+
+        if len(timestamps) == 0:
+            return []
+
+        frame_timestamps, frame_ndx = np.unique(timestamps, return_inverse=True)
+        n_frames = len(frame_timestamps)
+
+        # Remove oob detections
+        rows = np.flatnonzero(self.in_field_mask(camera_ids, xs, ys))
+        if len(rows) == 0:
+            return [OutOfBounds(x=0, y=0, z=0, timestamp=0) for _ in range(n_frames)]
+
+        # Most confident detection per camera per frame. Ties keep the earliest row, and cameras are ordered by their
+        # first (in bounds) row within the frame, which matches filter_most_confident_dets()
+        rows = rows[np.lexsort((rows, -probabilities[rows], camera_ids[rows], frame_ndx[rows]))]
+        row_frames, row_cameras = frame_ndx[rows], camera_ids[rows]
+        group_starts = np.flatnonzero(np.r_[True, (row_frames[1:] != row_frames[:-1]) |
+                                            (row_cameras[1:] != row_cameras[:-1])])
+        selected = rows[group_starts]
+        first_seen = np.minimum.reduceat(rows, group_starts)
+        selected = selected[np.lexsort((first_seen, frame_ndx[selected]))]
+
+        selected_frames = frame_ndx[selected]
+        dets_per_frame = np.bincount(selected_frames, minlength=n_frames)
+        frame_offsets = np.r_[0, np.cumsum(dets_per_frame)[:-1]]
+
+        # Homography
+        hom_xs, hom_ys = self.homography_stage(camera_ids[selected], xs[selected], ys[selected])
+        hom_zs = zs[selected]
+
+        # Triangulate every two camera frame in one go
+        two_cam_frames = np.flatnonzero(dets_per_frame == 2)
+        first = frame_offsets[two_cam_frames]
+        second = first + 1
+        ball_points = np.column_stack((hom_xs, hom_ys, hom_zs))
+        camera_coords = self.camera_centres[self.camera_indices(camera_ids[selected])]
+        triangulated = triangulate_midpoint_batch(
+            ball_points[first], camera_coords[first], ball_points[second], camera_coords[second]
+        ).tolist()
+
+        # And every frame with three or more cameras, with one least squares solve per frame
+        n_cam_frames = np.flatnonzero(dets_per_frame > 2)
+        n_cam_rows = np.repeat(dets_per_frame > 2, dets_per_frame)
+        n_cam_starts = np.r_[0, np.cumsum(dets_per_frame[n_cam_frames])[:-1]]
+        n_cam_triangulated = []
+        if len(n_cam_frames):
+            n_cam_triangulated = triangulate_least_squares_batch(
+                ball_points[n_cam_rows], self.camera_centres[self.camera_indices(camera_ids[selected][n_cam_rows])],
+                n_cam_starts,
+            ).tolist()
+
+        # Sequential pass through the stateful stages
+        frame_timestamps = frame_timestamps.tolist()
+        dets_per_frame = dets_per_frame.tolist()
+        frame_offsets = frame_offsets.tolist()
+        selected_camera_ids = camera_ids[selected].tolist()
+        selected_probabilities = probabilities[selected].tolist()
+        hom_xs, hom_ys, hom_zs = hom_xs.tolist(), hom_ys.tolist(), hom_zs.tolist()
+
+        results = []
+        two_cam_ndx = 0
+        n_cam_ndx = 0
+        for frame in range(n_frames):
+            n_dets = dets_per_frame[frame]
+            timestamp = frame_timestamps[frame]
+            if n_dets == 2:
+                x, y, z = triangulated[two_cam_ndx]
+                two_cam_ndx += 1
+                three_d_pos = self.handle_triangulated_point(ThreeDPoints(x=x, y=y, z=z, timestamp=timestamp))
+            elif n_dets > 2:
+                x, y, z = n_cam_triangulated[n_cam_ndx]
+                n_cam_ndx += 1
+                three_d_pos = self.handle_triangulated_point(ThreeDPoints(x=x, y=y, z=z, timestamp=timestamp))
+            elif n_dets == 1:
+                i = frame_offsets[frame]
+                det = Detections(camera_id=selected_camera_ids[i], probability=selected_probabilities[i],
+                                 timestamp=timestamp, x=hom_xs[i], y=hom_ys[i], z=hom_zs[i])
+                three_d_pos = self.one_camera_detection([det])
+            else:
+                # Temp fix, same as multi_camera_analysis()
+                three_d_pos = OutOfBounds(x=0, y=0, z=0, timestamp=0)
+            results.append(three_d_pos)
+
+        return results
+
+    def in_field_mask(self, camera_ids: np.ndarray, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """
+        Checks a batch of detections against the precomputed field masks of their cameras, in one lookup (the few
+        within a pixel of the edge of the field are checked against the polygon itself).
+        :return: Boolean array, True where the detection is within the image field coordinates of its camera
+        """
+        if len(xs) == 0:
+            return np.zeros(0, dtype=bool)
+        camera_ndx = self.camera_indices(camera_ids)
+        return lookup_field_masks(self.field_mask_stack, camera_ndx, self.mirror_xs(camera_ndx, xs), ys,
+                                  self.field_polygons)
+
+    def homography_stage(self, camera_ids: np.ndarray, xs: np.ndarray, ys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Batched homography stage. Every point is transformed by its camera's homography in a single einsum over
+        self.homography_stack, so the cost doesn't depend on how many detections or cameras there are per frame.
+        With use_lut, points are looked up in the cameras' pitch lookup tables instead, and only the ones the tables
+        don't cover go through the homography.
+        :param camera_ids: (N,) camera id of each detection
+        :param xs: (N,) pixel x coordinates
+        :param ys: (N,) pixel y coordinates
+        :return: Homographied (x, y) columns
+        """
+        if len(xs) == 0:
+            return np.empty(0, dtype=np.float64), np.empty(0, dtype=np.float64)
+        camera_ndx = self.camera_indices(camera_ids)
+
+        if not self.use_lut:
+            out = apply_homographies(self.homography_stack, camera_ndx, self.mirror_xs(camera_ndx, xs), ys)
+            return out[:, 0], out[:, 1]
+
+        # The tables have the mirroring baked in, so they are looked up with the raw coordinates
+        out = np.empty((len(xs), 2), dtype=np.float64)
+        for i, lut in enumerate(self.pitch_luts):
+            rows = camera_ndx == i
+            if rows.any():
+                out[rows] = lookup_pitch_lut(lut, xs[rows], ys[rows], self.lut_interpolation)
+        missing = np.isnan(out[:, 0])
+        if missing.any():
+            # Outside the field, or too close to its edge to interpolate
+            out[missing] = apply_homographies(self.homography_stack, camera_ndx[missing],
+                                              self.mirror_xs(camera_ndx[missing], xs[missing]), ys[missing])
+        return out[:, 0], out[:, 1]
+
+    def mirror_xs(self, camera_ndx: np.ndarray, xs: np.ndarray) -> np.ndarray:
+        """
+        :return: xs, with x -> IMAGE_WIDTH - x applied to the detections of mirrored cameras
+        """
+        if not self.mirrored_cameras:
+            return xs
+        return np.where(self.mirrored_stack[camera_ndx], IMAGE_WIDTH - np.asarray(xs, dtype=np.float64), xs)
+
     def perform_homography(self, detections: List[Detections]) -> List[Detections]:
 
         """
         Just a convenience method however should maybe change the Detections class/ structure so that it automatically
-        calculates and stores the homography information
+        calculates and stores the homography information. Small frames are done one detection at a time with plain
+        floats, bigger ones by homography_stage().
         Args:
             *detections: Detections objects iterable, where detection.z=1.0 (we've hard coded that in here)
-        Returns: list of Detections objects with homographied x and y coordinates
+        Returns: list of new Detections objects with homographied x and y coordinates (the inputs aren't modified)
         """
 
-        dets_ = []
-
-        for det in detections:
-            temp = self.homographies[str(det.camera_id)] @ np.array([[det.x], [det.y], [1.0]], dtype=object)
-            temp = temp / temp[2]
-            temp = temp.tolist()
-            det.x, det.y = temp[0][0], temp[1][0]
-            dets_.append(det)
+        if len(detections) == 0:
+            return []
+
+        if len(detections) <= SMALL_FRAME_DETECTIONS and not self.use_lut:
+            # Scalar path, a typical frame only has a detection or two
+            dets_ = []
+            for det in detections:
+                row = self.homography_rows.get(int(det.camera_id))
+                if row is None:
+                    raise KeyError(f"Camera ids [{det.camera_id}] have not been added to the tracker")
+                homography, mirrored = row
+                x, y = apply_homography(homography, IMAGE_WIDTH - float(det.x) if mirrored else float(det.x),
+                                        float(det.y))
+                dets_.append(Detections(det.camera_id, det.probability, det.timestamp, x, y, det.z, det.x_hom,
+                                        det.y_hom))
+            return dets_
+
+        xs, ys = self.homography_stage(
+            np.fromiter((det.camera_id for det in detections), dtype=np.int64, count=len(detections)),
+            np.fromiter((det.x for det in detections), dtype=np.float64, count=len(detections)),
+            np.fromiter((det.y for det in detections), dtype=np.float64, count=len(detections)),
+        )
 
-        return dets_
+        # Built directly rather than with dataclasses.replace(), which costs several times more per object
+        return [Detections(det.camera_id, det.probability, det.timestamp, x, y, det.z, det.x_hom, det.y_hom)
+                for det, x, y in zip(detections, xs.tolist(), ys.tolist())]
 
     def form_plane(self):
         """
@@ -287,75 +771,59 @@ class MultiCameraTracker:
 
         # TODO: do note that we delete the plane once we have two detections (I think I had a point but have forgot)
 
-        try:
-            # Instead of relying on the ball being out of frame for 1 frame, we'll make it 10.
-            last_10_points = self.three_d_points[-10:]
-            try:
-                last_2_points = [p for p in last_10_points if p != THREE_D_POINTS_FLAG][-2:]
-            except IndexError:
-                print("Not enough points to create a plane!")
-                return None
-
-            temp1 = last_2_points[-1]
-            # this is probably not 'good code' but it works, we need to subtract two vectors
-
-            a = np.array([[temp1.x], [temp1.y], [temp1.z]])
-            temp2 = last_2_points[-2]
-            b = np.array([[temp2.x], [temp2.y], [temp2.z]])
-        except IndexError:
+        # Instead of relying on the ball being out of frame for 1 frame, we'll make it 10.
+        # The plane through the last 2 valid points is kept up to date by self.three_d_points as points are appended,
+        # so this is just a copy of it (the plane has to stay the same until the next two camera detection).
+        if not self.three_d_points.has_plane(window=10):
             print("theres no last points to form the plane")
             return
 
-        ab = b - a
-
-        # Normal vector of ab which is lying on the ground plane (a, b, 0)
-        # However one thing to note is that I'm not sure if my homography is in the 'ground plane' or 1 metre above it
-        normal = np.array([-ab[1], ab[0], 0], dtype=object)
-
-        # Equation of the plane, ax + by + cz + constant = 0... and where the plane is vertical so z is always zero
-        # constant = -(ax + by + cz) = -ax - by
-        plane = np.array([normal[0], normal[1], 0, -(a[0] * normal[0] + a[1] * normal[1])], dtype=object)
+        np.copyto(self.plane_buffer, self.three_d_points.plane)
+        self.plane_stationary = self.three_d_points.plane_stationary
+        self.plane = self.plane_buffer
 
-        self.plane = plane
+        return self.plane
 
-        return plane
+    def internal_height_estimation(self, detections: List[Detections]) -> Tuple[float, float, float]:
+        """
+        Estimates the 3D position of the ball in the scenario where there is just one detection, as the point where the
+        ray from the camera through the (homographied) detection crosses the vertical plane from form_plane().
+        The camera coordinates are only read, so the result doesn't depend on what was called before.
+        Args:
+            detections: List of detections (there will be just one if this function is called, only the first is used)
+        Returns:
+            (x, y, z) of the estimated position, or the detection itself if the plane is degenerate
+        """
+        det = detections[0]
+        c = self.cameras[str(det.camera_id)].real_world_camera_coords
+        return intersect_vertical_plane(
+            float(det.x), float(det.y), float(det.z), c.item(0), c.item(1), c.item(2),
+            float(self.plane.item(0)), float(self.plane.item(1)), float(self.plane.item(3)),
+        )
 
-    # TODO: fix the typing and data types here, its all over the place
-    def internal_height_estimation(self, detections):
-        # There will be just one detection if this function is called
-        # This function estimates the height of the ball in the scenario where there is just one detection
-        for i in detections:
-            _id = i.camera_id
-            c = self.cameras[str(_id)].real_world_camera_coords
-            ball_coords = np.array([[i.x], [i.y], [i.z]], dtype=object)
-
-            # projection of the camera onto xy plane, point d
-            d = c
-            d[-1] = 0
-
-            # Vector from projected camera to the ball, vector DA
-            # This is coming out wrong!
-            da = ball_coords - c
-
-            try:
-                t = (-self.plane[3] - c[0] * self.plane[0] - c[1] * self.plane[1]) / \
-                    (da[0] * self.plane[0] + da[1] * self.plane[1])
-            except IndexError:  # TODO: also need to catch division by zero error
-                # Print the error and return the last known position
-                print("Error in internal height estimation")
-                t = 0
-                # TODO: need to check if this is the best way to handle this, or if we even should be getting a
-                #  ZeroDivisionError here (when the ball stays in the same position)
-
-            # Change from (3, 1) to (3,)
-            da = da.reshape(3,)
-            c = c.reshape(3,)
-            t = t.reshape(1,)
-
-            # Point of intersection
-            intersection = float((da[0] * t + c[0])), float((da[1] * t + c[1])), float((da[1] * t + c[1]))
-
-            return intersection
+    def internal_height_estimation_batch(
+            self,
+            camera_ids: np.ndarray,
+            xs: np.ndarray,
+            ys: np.ndarray,
+            zs: np.ndarray = None,
+    ) -> np.ndarray:
+        """
+        Batched version of internal_height_estimation() for many single camera detections against the current plane.
+        :param camera_ids: (N,) camera id of each detection
+        :param xs: (N,) homographied x coordinates
+        :param ys: (N,) homographied y coordinates
+        :param zs: (N,) z coordinates, defaults to 0
+        :return: (N, 3) float64 array of estimated positions
+        """
+        ball_points = np.zeros((len(xs), 3), dtype=np.float64)
+        ball_points[:, 0] = xs
+        ball_points[:, 1] = ys
+        if zs is not None:
+            ball_points[:, 2] = zs
+        return intersect_vertical_plane_batch(
+            ball_points, self.camera_centres[self.camera_indices(camera_ids)], self.plane, out=ball_points
+        )
 
     def inv_triangulate(self, detections):
         # This is to locate the xy coordinates of the ball when there is just one detection
@@ -425,37 +893,15 @@ class MultiCameraTracker:
         camP and camQ are the cameras real world positions with attribute x, y and z.
         This function uses mid-point triangulation ->
         https://en.wikipedia.org/wiki/Triangulation_(computer_vision)#Mid-point_method
-        """
-        ball_p = np.array([[ball_p.x], [ball_p.y], [ball_p.z]], dtype=object)
-        ball_q = np.array([[ball_q.x], [ball_q.y], [ball_q.z]], dtype=object)
 
-        l1 = ball_p - cam_p  # direction vectors (i.e. from camera to
-        # ball)
-        l2 = ball_q - cam_q
-
-        r1 = np.vdot(l1, l1)  # this is the squared norm/ magnitude of L1
-        r2 = np.vdot(l2, l2)  # same for L2
-
-        l1_l2 = np.vdot(l1, l2)  # dot product of L1 and L2
-
-        balls_l1 = np.vdot((ball_q - ball_p), l1)  # dot product of direction vector between the balls, and L1
-        balls_l2 = np.vdot(l2, (ball_q - ball_p))  # same but for L2
-
-        s = (((l1_l2 * balls_l2) + (balls_l1 * r2)) / ((r1 * r2) + (l1_l2 ** 2)))
-        t = (((l1_l2 * balls_l1) - (balls_l2 * r1)) / ((r1 * r2) + (l1_l2 ** 2)))
-
-        s = abs(s)
-        t = abs(t)
-
-        shortest_point1 = ((1 - s) * ball_p) + s * cam_p
-        shortest_point2 = ((1 - t) * ball_q) + t * cam_q
-
-        midpoint = (shortest_point1 + shortest_point2) / 2
-
-        # This is to convert the numpy array to a list
-        intersection = [midpoint[0].item(), midpoint[1].item(), midpoint[2].item()]
-
-        return intersection
+        The maths itself lives in utils.geometry.triangulate_midpoint, which works on plain float64 scalars rather than
+        object arrays.
+        """
+        x, y, z = triangulate_midpoint(
+            float(ball_p.x), float(ball_p.y), float(ball_p.z), cam_p.item(0), cam_p.item(1), cam_p.item(2),
+            float(ball_q.x), float(ball_q.y), float(ball_q.z), cam_q.item(0), cam_q.item(1), cam_q.item(2),
+        )
+        return [x, y, z]
 
 
 def get_test_cases() -> List[Dict[str, Union[List[Detections], str]]]:
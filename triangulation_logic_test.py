@@ -216,9 +216,13 @@ class TestMultiCameraTracker(unittest.TestCase):
         # Note: This will only be called if our plane is not None! So we can set it manually for now.
         self.tracker.plane = np.array([[-22], [-5], [0], [414]])  # Value retrieved by stepping through the real code with debugger.
         height = self.tracker.internal_height_estimation(processed_val)
-        # Assert that height is close to :[array([1.1996040147356337], dtype=object), array([77.52174233516322], dtype=object), array([77.52174233516322], dtype=object)]
-        self.assertAlmostEqual(int(height[2]), 77)
-        # Note: this test could be cleaned up!
+        # Assert that the intersection is close to (1.1996040147356337, 77.52174233516322, 6.788876402365799)
+        self.assertAlmostEqual(height[0], 1.1996, places=3)
+        self.assertAlmostEqual(int(height[1]), 77)
+        self.assertAlmostEqual(height[2], 6.7889, places=3)
+        # The camera's coordinates aren't modified, so calling it again gives the same result
+        self.assertEqual(self.tracker.cameras["3"].real_world_camera_coords[2], 7.85)
+        self.assertEqual(self.tracker.internal_height_estimation(processed_val), height)
 
     def test_filter_most_confident_dets(self):
         dets = [
@@ -1,12 +1,14 @@
 import cv2
-from copy import deepcopy
 from PIL import Image
 import numpy as np
 import matplotlib.pyplot as plt
 
+import argparse
 from typing import Tuple, List, Generator
 
 from data.bohs_dataset import create_triangulation_dataset
+from data.prefetch_loader import PrefetchLoader
+from utils.config import MIRRORED_CAMERAS
 from utils.data_classes import Detections
 from utils.timer import Timer
 from utils.utils import x_y_to_detection, get_xy_from_box, draw_bboxes_red
@@ -30,15 +32,21 @@ class TriangulationVisualization:
                  use_formplane: bool = False,
                  draw_text: bool = False,
                  visualize_homography: bool = False,
+                 num_workers: int = 0,
                  ):
+        """
+        :param num_workers: Threads decoding the camera images ahead of the rendering, see data.prefetch_loader. 0 (the
+            default) reads the dataset directly on this thread, None uses one thread per core (at most 8)
+        """
         self.dataset = create_triangulation_dataset(small_dataset=small_dataset)
+        self.num_workers: int = num_workers
         self.pitch_image: np.array = np.array(Image.open("images/pitch.jpg"))
         self.pitch_width: int = self.pitch_image.shape[1]
         self.pitch_height: int = self.pitch_image.shape[0]
         self.timer: Timer = Timer()
         self.use_formplane: bool = use_formplane
 
-        self.tracker = MultiCameraTracker(use_formplane=self.use_formplane)  # TODO: this should be passed in
+        self.tracker = MultiCameraTracker(use_formplane=self.use_formplane, mirrored_cameras=MIRRORED_CAMERAS)  # TODO: this should be passed in
         self.tracker.add_camera(1, self.JETSON1_REAL_WORLD)
         self.tracker.add_camera(3, self.JETSON3_REAL_WORLD)
         self.draw_text: bool = draw_text
@@ -61,7 +69,7 @@ class TriangulationVisualization:
 
     def visualize_individual_cam_homography(self, tracker: MultiCameraTracker, single_cam_det: Detections,
                                             camera_id: int) -> None:
-        cam_hom = tracker.perform_homography([deepcopy(single_cam_det)])[0]
+        cam_hom = tracker.perform_homography([single_cam_det])[0]
         cam_hom.x, cam_hom.y = self.convert_det_to_pixels(cam_hom)
         self.pitch_image = self.draw_point(int(cam_hom.x), int(cam_hom.y), camera_id=camera_id)
 
@@ -144,13 +152,8 @@ class TriangulationVisualization:
             # Draw bounding boxes on the image
             image = draw_bboxes_red(image, x, y)
 
-            # Adjust x for Jetson3
-            if jetson_number == 3:
-                # note: mirroring for Jetson3 to bring the origins a bit closer together
-                # in the diff planes (in my mind at least, haven't tested to see if it works better yet)
-                x = 1920 - x
-
-                # Transform x, y to detection and append to list
+            # Note: Jetson3 is mirrored (x = 1920 - x) by the tracker, see utils.config.MIRRORED_CAMERAS
+            # Transform x, y to detection and append to list
             cam_det = x_y_to_detection(x, y, index, camera_id=jetson_number)
             dets.append(cam_det)
 
@@ -161,8 +164,9 @@ class TriangulationVisualization:
         return image
 
     def get_triangulated_images(self, short_video: bool = False) -> Generator:
-        for i, (image_3, image_1, box_3, box_1, label_3, label_1, image_path_3, image_path_1) in enumerate(
-                self.dataset):
+        # With num_workers, the next frames are decoded in the background while this one is processed
+        frames = PrefetchLoader(self.dataset, num_workers=self.num_workers)
+        for i, (image_3, image_1, box_3, box_1, label_3, label_1, image_path_3, image_path_1) in enumerate(frames):
 
             self.pitch_image = np.array(Image.open("images/pitch.jpg"))  # Clear the image
 
@@ -249,8 +253,13 @@ class TriangulationVisualization:
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Renders the triangulated detections of both cameras to a video")
+    parser.add_argument("--num_workers", type=int, default=0,
+                        help="Threads decoding the frames ahead of the rendering, 0 (the default) doesn't prefetch")
+    args = parser.parse_args()
+
     triangulation = TriangulationVisualization(small_dataset=False, use_formplane=False, visualize_homography=False,
-                                               draw_text=False)
+                                               draw_text=False, num_workers=args.num_workers)
     # triangulation.run("14_22_time_20_40_14_25__v1__16_1_23.avi.avi", show_images=False, save_video=True)
     triangulation.run("test_5_with_smoothing_no_text.avi", show_images=False, save_video=True, short_video=False)
 
@@ -0,0 +1,32 @@
+import glob
+import os
+from typing import Optional
+
+# Overrides where the homographies, field masks and pitch lookup tables are cached, an empty value turns the cache off
+CACHE_DIR_ENV: str = 'TRIANGULATION_CACHE_DIR'
+
+
+def default_cache_dir() -> Optional[str]:
+    """
+    Where the calibration caches go by default: $TRIANGULATION_CACHE_DIR if it is set (None if it is empty, i.e. no
+    caching), otherwise a 'triangulation' folder in the user's cache dir ($XDG_CACHE_HOME, or ~/.cache), so that
+    nothing is written into the repo.
+    """
+    cache_dir = os.environ.get(CACHE_DIR_ENV)
+    if cache_dir is not None:
+        return cache_dir or None
+    user_cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(user_cache_dir, 'triangulation')
+
+
+def prune_cache(cache_dir: str, pattern: str, keep: int) -> None:
+    """
+    Deletes all but the keep most recently written files of cache_dir matching pattern (i.e. 'pitch_lut_v*.npy'), so
+    that the caches of old calibrations don't pile up. Files that can't be deleted (i.e. mapped on Windows) are left.
+    """
+    paths = sorted(glob.glob(os.path.join(cache_dir, pattern)), key=os.path.getmtime, reverse=True)
+    for path in paths[keep:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
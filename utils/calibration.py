@@ -0,0 +1,157 @@
+import hashlib
+import os
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+from utils.cache import default_cache_dir, prune_cache
+from utils.camera_homography import CameraJetson1, CameraJetson3, RealWorldPitchCoords
+
+# Bump this whenever the way the homographies are computed changes, so that old cache files are ignored
+CALIBRATION_CACHE_VERSION: int = 3
+CALIBRATION_CACHE_FILES: int = 4  # Homography caches kept in the cache dir, older ones are deleted
+# Where utils.camera_homography saves the fitted h1.npy/ h2.npy (in the repo, unlike the caches)
+HOMOGRAPHY_MATRICES_DIR: str = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data',
+                                            'homography_matrices')
+# Layout of the cache file, one record per camera, so the (C, 3, 3) homographies are a single view of it
+CALIBRATION_DTYPE: np.dtype = np.dtype([('camera_id', np.int64), ('homography', np.float64, (3, 3))])
+
+
+def hartley_normalization(points: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """
+    Similarity transforms that move the centroid of each camera's points to the origin and scale them so their mean
+    distance from it is sqrt(2), which is what keeps the DLT well conditioned with pixel and metre coordinates mixed.
+    :param points: (C, N, 2) points, padded
+    :param mask: (C, N) bool, True for the real (non padding) points
+    :return: (C, 3, 3) transforms
+    """
+    counts = mask.sum(axis=1)
+    centroids = (points * mask[..., None]).sum(axis=1) / counts[:, None]
+    distances = np.linalg.norm(points - centroids[:, None], axis=2)
+    mean_distances = (distances * mask).sum(axis=1) / counts
+    scales = np.sqrt(2) / np.maximum(mean_distances, 1e-12)
+
+    transforms = np.zeros((len(points), 3, 3), dtype=np.float64)
+    transforms[:, 0, 0] = transforms[:, 1, 1] = scales
+    transforms[:, :2, 2] = -centroids * scales[:, None]
+    transforms[:, 2, 2] = 1.
+    return transforms
+
+
+def fit_homographies(image_coords: Sequence[np.ndarray], real_world_coords: Sequence[np.ndarray]) -> np.ndarray:
+    """
+    Fits the image -> real world homography of every camera at once with the normalised DLT (Hartley & Zisserman,
+    algorithm 4.2).
+
+    The cameras can have different numbers of correspondences, they're padded to the longest with rows of zeros in A,
+    which don't change its null space. A for all of the cameras is built in one go and solved with a single batched SVD.
+    :param image_coords: Per camera (N_i, 2) pixel coordinates, N_i >= 4
+    :param real_world_coords: Per camera (N_i, 2) real world coordinates of the same points
+    :return: (C, 3, 3) homographies, normalised so that H[2, 2] == 1
+    """
+    if len(image_coords) != len(real_world_coords):
+        raise ValueError(f"Got image coordinates for {len(image_coords)} cameras but real world coordinates for "
+                         f"{len(real_world_coords)}")
+    counts = np.array([len(coords) for coords in image_coords])
+    for ndx, (image, world) in enumerate(zip(image_coords, real_world_coords)):
+        if len(image) != len(world):
+            raise ValueError(f"Camera {ndx} has {len(image)} image points but {len(world)} real world points")
+        if len(image) < 4:
+            raise ValueError(f"Camera {ndx} has {len(image)} points, at least 4 are needed for a homography")
+
+    n_cameras, n_points = len(counts), int(counts.max())
+    mask = np.arange(n_points)[None, :] < counts[:, None]
+    src = np.zeros((n_cameras, n_points, 2), dtype=np.float64)
+    dst = np.zeros((n_cameras, n_points, 2), dtype=np.float64)
+    for ndx, (image, world) in enumerate(zip(image_coords, real_world_coords)):
+        src[ndx, :counts[ndx]] = np.asarray(image, dtype=np.float64).reshape(-1, 2)
+        dst[ndx, :counts[ndx]] = np.asarray(world, dtype=np.float64).reshape(-1, 2)
+
+    src_transforms = hartley_normalization(src, mask)
+    dst_transforms = hartley_normalization(dst, mask)
+    src = src * src_transforms[:, None, (0, 1), (0, 1)] + src_transforms[:, None, :2, 2]
+    dst = dst * dst_transforms[:, None, (0, 1), (0, 1)] + dst_transforms[:, None, :2, 2]
+
+    # 2 rows per correspondence, same rows as the old per camera loops:
+    #   [0, 0, 0, -x, -y, -1, Y * x, Y * y, Y] and [x, y, 1, 0, 0, 0, -X * x, -X * y, -X]
+    x, y = src[..., 0], src[..., 1]
+    big_x, big_y = dst[..., 0], dst[..., 1]
+    ones = mask.astype(np.float64)
+    A = np.zeros((n_cameras, n_points, 2, 9), dtype=np.float64)
+    A[:, :, 0, 3:6] = -np.stack((x, y, ones), axis=-1)
+    A[:, :, 0, 6:] = big_y[..., None] * np.stack((x, y, ones), axis=-1)
+    A[:, :, 1, :3] = np.stack((x, y, ones), axis=-1)
+    A[:, :, 1, 6:] = -big_x[..., None] * np.stack((x, y, ones), axis=-1)
+    A *= mask[:, :, None, None]  # Padding rows are all zeros
+    A = A.reshape(n_cameras, 2 * n_points, 9)
+
+    # The full V is needed for the null vector when there are exactly 4 points (A is 8x9)
+    _, _, vt = np.linalg.svd(A, full_matrices=True)
+    normalised = vt[:, -1].reshape(n_cameras, 3, 3)
+
+    # Undo the normalisation: H = T_dst^-1 @ H_norm @ T_src
+    homographies = np.linalg.inv(dst_transforms) @ normalised @ src_transforms
+    return homographies / homographies[:, 2:, 2:]
+
+
+def calibration_key() -> str:
+    """
+    Hash of everything the homographies are computed from: the landmark correspondences of each camera, the camera
+    positions and the cache version. If any of them change, so does the key, and the homographies get recomputed.
+
+    The raw landmark constants are hashed, rather than the arrays get_all_coords_as_arrays() builds from them, which
+    takes longer than the rest of load_homographies() put together.
+    """
+    sha = hashlib.sha1()
+    sha.update(str(CALIBRATION_CACHE_VERSION).encode())
+    for landmarks in (CameraJetson1(), CameraJetson3(), RealWorldPitchCoords()):
+        # i.e. {'corner1': (807, 1005), ..., 'real_world_x': -19.41, ...}
+        sha.update(repr(vars(landmarks)).encode())
+    return sha.hexdigest()[:16]
+
+
+def calibration_cache_path(cache_dir: str) -> str:
+    return os.path.join(cache_dir, f'homographies_v{CALIBRATION_CACHE_VERSION}_{calibration_key()}.npy')
+
+
+def load_homographies(cache_dir: Optional[str] = None) -> Dict[str, np.ndarray]:
+    """
+    Returns the same dict of homographies as python_learning.homography_practice.get_new_homographies(), but reads them
+    from a cache file when the calibration inputs haven't changed, so that creating a MultiCameraTracker doesn't run
+    an SVD per camera every time.
+
+    The cache is a .npy of CALIBRATION_DTYPE records in cache_dir, named after calibration_key(). It is written on the
+    first call with new inputs. If it can't be written (i.e. read only file system), the homographies are just computed.
+    A warm load is a few times faster than computing them (most of which is get_all_coords_as_arrays()).
+    :param cache_dir: Folder to keep the cache files in (i.e. utils.cache.default_cache_dir()), None to not cache them.
+        Only the CALIBRATION_CACHE_FILES latest are kept
+    :return: Dict of camera id (str) -> (3, 3) homography
+    """
+    path = calibration_cache_path(cache_dir) if cache_dir is not None else None
+
+    if path is not None and os.path.exists(path):
+        cache = np.load(path)
+        return {str(camera_id): homography for camera_id, homography in zip(cache['camera_id'].tolist(),
+                                                                             cache['homography'])}
+
+    # Imported here as it is only needed when the cache is missing
+    from python_learning.homography_practice import get_new_homographies
+    homographies = get_new_homographies()
+    if path is None:
+        return homographies
+
+    cache = np.empty(len(homographies), dtype=CALIBRATION_DTYPE)
+    cache['camera_id'] = sorted(int(camera_id) for camera_id in homographies)
+    cache['homography'] = [homographies[str(camera_id)] for camera_id in cache['camera_id'].tolist()]
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write to a temp file first, so that another process never sees a half written cache
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            np.save(f, cache)
+        os.replace(temp_path, path)
+        prune_cache(cache_dir, 'homographies_v*.npy', CALIBRATION_CACHE_FILES)
+    except OSError as e:
+        print(f"Couldn't write the calibration cache {path}: {e}")
+
+    return homographies
@@ -1,5 +1,6 @@
+import os
+
 import numpy as np
-import cv2
 
 from typing import NamedTuple, Tuple, List
 
@@ -189,17 +190,14 @@ def compute_homographies():
     assert j1_arr.shape[1] == 2, "The jetson 1 array is not 2D"
     assert j2_arr.shape[1] == 2, "The jetson 2 array is not 2D"
 
-    # Compute the homography
-    h1, status1 = cv2.findHomography(j1_arr, world_points1)
-    h2, status2 = cv2.findHomography(j2_arr, world_points2)
+    # Imported here as utils.calibration imports this module
+    from utils.calibration import HOMOGRAPHY_MATRICES_DIR, fit_homographies
+    h1, h2 = fit_homographies([j1_arr, j2_arr], [world_points1, world_points2])
 
-    # # Save the homography
-    np.save("../data/homography_matrices/h1.npy", h1)
-    np.save("../data/homography_matrices/h2.npy", h2)
-    #
-    # # Load the homography
-    h1 = np.load("../data/homography_matrices/h1.npy")
-    h2 = np.load("../data/homography_matrices/h2.npy")
+    # Save the homography (relative to the repo, rather than wherever this is run from)
+    os.makedirs(HOMOGRAPHY_MATRICES_DIR, exist_ok=True)
+    np.save(os.path.join(HOMOGRAPHY_MATRICES_DIR, "h1.npy"), h1)
+    np.save(os.path.join(HOMOGRAPHY_MATRICES_DIR, "h2.npy"), h2)
 
     # Test the homography
     # Fix here: https://answers.opencv.org/question/252/cv2perspectivetransform-with-python/
@@ -263,6 +261,7 @@ def legacy_compute_homographies():
                            [10.837, 33.9567]])
 
     # homographies from pixel coords to real world
+    import cv2
     h5, status5 = cv2.findHomography(image_pts5, world_pts5)
     h6, status6 = cv2.findHomography(image_pts6, world_pts6)
 
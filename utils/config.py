@@ -13,3 +13,13 @@ def get_image_field_coordinates() -> Dict[str, Tuple[Tuple[int, int], Tuple[int,
         "1": ((0, 580), (1918, 576), (1920, 1080), (0, 1080)),
         "3": ((0, 260), (1920, 230), (1920, 980), (0, 740)),
     }
+
+
+# Resolution of the camera images, in pixels
+IMAGE_WIDTH: int = 1920
+IMAGE_HEIGHT: int = 1080
+
+# Cameras whose homography and field coordinates are in mirrored image coordinates (x -> IMAGE_WIDTH - x), see
+# python_learning.homography_practice.get_new_homographies. The tracker mirrors their detections itself when created
+# with mirrored_cameras=MIRRORED_CAMERAS.
+MIRRORED_CAMERAS: Tuple[int, ...] = (3,)
@@ -0,0 +1,198 @@
+import hashlib
+import os
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.cache import prune_cache
+from utils.config import IMAGE_HEIGHT, IMAGE_WIDTH
+
+# Bump this whenever the way the masks are built changes, so that old cache files are ignored
+FIELD_MASK_VERSION: int = 1
+FIELD_MASK_CACHE_FILES: int = 16  # Masks kept in the cache dir (~260KB each at full resolution), older ones are deleted
+
+# Masks already loaded in this process, keyed by (polygon, width, height), so every tracker shares one copy
+_field_mask_memo: Dict[tuple, np.ndarray] = {}
+
+
+def build_field_mask(
+        image_field_coordinates: Sequence[Tuple[int, int]],
+        width: int = IMAGE_WIDTH,
+        height: int = IMAGE_HEIGHT,
+) -> np.ndarray:
+    """
+    Rasterizes the field polygon of a camera into a (height, width) boolean mask, so that checking whether a detection
+    is within the field is a single lookup rather than a point in polygon test.
+
+    Pixel (x, y) is inside if the point (x, y) is inside the polygon, using the even-odd rule (a point is inside if a
+    horizontal ray from it crosses the polygon's edges an odd number of times).
+
+    :param image_field_coordinates: Polygon vertices in (x, y) pixel coordinates, as in utils.config
+    :param width: Image width in pixels
+    :param height: Image height in pixels
+    :return: (height, width) boolean array, indexed as mask[y, x]
+    """
+    vertices = np.asarray(image_field_coordinates, dtype=np.float64)
+    xs = np.arange(width, dtype=np.float64)
+    ys = np.arange(height, dtype=np.float64)
+
+    mask = np.zeros((height, width), dtype=bool)
+    for (x1, y1), (x2, y2) in zip(vertices, np.roll(vertices, -1, axis=0)):
+        if y1 == y2:
+            # Horizontal edges are never crossed by a horizontal ray
+            continue
+        straddles = (y1 > ys) != (y2 > ys)
+        crossing_x = x1 + (ys - y1) * (x2 - x1) / (y2 - y1)
+        mask ^= straddles[:, None] & (xs[None, :] < crossing_x[:, None])
+
+    return mask
+
+
+def point_in_polygon(image_field_coordinates: Sequence[Tuple[int, int]], x: float, y: float) -> bool:
+    """
+    Scalar even-odd test of a single point, with plain Python floats. Same rule as build_field_mask() (and
+    matplotlib's Path.contains_point), but exact for non integer coordinates. This is the fast path for the handful of
+    detections of a live frame.
+    """
+    inside = False
+    x1, y1 = image_field_coordinates[-1]
+    for x2, y2 in image_field_coordinates:
+        if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+            inside = not inside
+        x1, y1 = x2, y2
+    return inside
+
+
+def points_in_polygon(image_field_coordinates: Sequence[Tuple[int, int]], xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+    """
+    Vectorized version of point_in_polygon() for N points.
+    :return: (N,) boolean array
+    """
+    vertices = np.asarray(image_field_coordinates, dtype=np.float64)
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+
+    inside = np.zeros(len(xs), dtype=bool)
+    for (x1, y1), (x2, y2) in zip(vertices, np.roll(vertices, -1, axis=0)):
+        if y1 == y2:
+            continue
+        straddles = (y1 > ys) != (y2 > ys)
+        inside ^= straddles & (xs < x1 + (ys - y1) * (x2 - x1) / (y2 - y1))
+    return inside
+
+
+def field_mask_path(
+        cache_dir: str,
+        image_field_coordinates: Sequence[Tuple[int, int]],
+        width: int = IMAGE_WIDTH,
+        height: int = IMAGE_HEIGHT,
+) -> str:
+    """
+    Path of the cached (bit packed) mask for this polygon, named after a hash of the polygon and image size.
+    """
+    sha = hashlib.sha1()
+    sha.update(f"{FIELD_MASK_VERSION} {width} {height}".encode())
+    sha.update(np.ascontiguousarray(image_field_coordinates, dtype=np.float64).tobytes())
+    return os.path.join(cache_dir, f"field_mask_v{FIELD_MASK_VERSION}_{sha.hexdigest()[:16]}.npy")
+
+
+def load_field_mask(
+        cache_dir: Optional[str],
+        image_field_coordinates: Sequence[Tuple[int, int]],
+        width: int = IMAGE_WIDTH,
+        height: int = IMAGE_HEIGHT,
+) -> np.ndarray:
+    """
+    Returns the mask from build_field_mask(), bit packed along x (see np.packbits) into a read only
+    (height, ceil(width / 8)) uint8 array, 8x smaller than the bool mask.
+
+    Rasterizing a full resolution mask takes ~10ms, so the packed mask is cached as a .npy in cache_dir (next to the
+    homographies, only the FIELD_MASK_CACHE_FILES latest are kept) and kept in memory for the rest of the process, so
+    it is only built once per calibration. If cache_dir is None, or the cache can't be written, the mask is just built
+    (and only kept in memory).
+    """
+    key = (tuple(map(tuple, image_field_coordinates)), width, height)
+    packed = _field_mask_memo.get(key)
+    if packed is not None:
+        return packed
+
+    path = field_mask_path(cache_dir, image_field_coordinates, width, height) if cache_dir is not None else None
+    if path is not None and os.path.exists(path):
+        packed = np.load(path)
+    else:
+        packed = np.packbits(build_field_mask(image_field_coordinates, width, height), axis=1)
+        if path is not None:
+            _save_field_mask(cache_dir, path, packed)
+
+    packed.flags.writeable = False
+    _field_mask_memo[key] = packed
+    return packed
+
+
+def _save_field_mask(cache_dir: str, path: str, packed: np.ndarray) -> None:
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write to a temp file first, so that another process never reads a half written mask
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            np.save(f, packed)
+        os.replace(temp_path, path)
+        prune_cache(cache_dir, "field_mask_v*.npy", FIELD_MASK_CACHE_FILES)
+    except OSError as e:
+        print(f"Couldn't write the field mask {path}: {e}")
+
+
+def _sample_packed(field_masks: np.ndarray, camera_ndx: np.ndarray, x_ndx: np.ndarray, y_ndx: np.ndarray) -> np.ndarray:
+    return (field_masks[camera_ndx, y_ndx, x_ndx >> 3] >> (7 - (x_ndx & 7)).astype(np.uint8)) & 1 == 1
+
+
+def lookup_field_masks(
+        field_masks: np.ndarray,
+        camera_ndx: np.ndarray,
+        xs: np.ndarray,
+        ys: np.ndarray,
+        polygons: Sequence[Sequence[Tuple[int, int]]],
+        width: int = IMAGE_WIDTH,
+) -> np.ndarray:
+    """
+    Checks a batch of detections against a stack of bit packed field masks.
+
+    The mask is sampled at the 4 pixels around each point. Where they all agree (and there is no polygon vertex
+    between them) that is the answer. Otherwise the point is within a pixel of the edge of the field, and those few
+    points get the exact point_in_polygon test, so non integer coordinates give the same result as the polygon itself.
+
+    :param field_masks: (C, height, ceil(width / 8)) uint8 stack of masks from load_field_mask()
+    :param camera_ndx: (N,) index into field_masks for each detection
+    :param xs: (N,) pixel x coordinates
+    :param ys: (N,) pixel y coordinates
+    :param polygons: The field polygon of each camera of the stack
+    :param width: Image width in pixels (the packed masks are padded to a multiple of 8)
+    :return: (N,) boolean array, True where the detection is inside its camera's field
+    """
+    height = field_masks.shape[1]
+    camera_ndx = np.asarray(camera_ndx, dtype=np.intp)
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+
+    # Anything outside of the image is outside of the field (this also catches NaNs)
+    in_image = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+    x0 = np.where(in_image, xs, 0).astype(np.intp)  # floor, as the coordinates are >= 0
+    y0 = np.where(in_image, ys, 0).astype(np.intp)
+    x1 = np.minimum(x0 + 1, width - 1)
+    y1 = np.minimum(y0 + 1, height - 1)
+
+    inside = _sample_packed(field_masks, camera_ndx, x0, y0)
+    edge = (inside != _sample_packed(field_masks, camera_ndx, x1, y0)) | \
+        (inside != _sample_packed(field_masks, camera_ndx, x0, y1)) | \
+        (inside != _sample_packed(field_masks, camera_ndx, x1, y1)) | \
+        (x0 == width - 1) | (y0 == height - 1)  # Their neighbours are clamped, so the samples can't see an edge there
+
+    for i, polygon in enumerate(polygons):
+        vertices = np.asarray(polygon, dtype=np.float64)
+        # A vertex in the cell can poke in without changing any of its 4 pixels
+        near_vertex = ((np.abs(xs[:, None] - vertices[:, 0]) <= 1) & (np.abs(ys[:, None] - vertices[:, 1]) <= 1)).any(axis=1)
+        rows = (camera_ndx == i) & (edge | near_vertex) & in_image
+        if rows.any():
+            inside[rows] = points_in_polygon(vertices, xs[rows], ys[rows])
+
+    return inside & in_image
@@ -0,0 +1,165 @@
+import heapq
+import time
+from typing import Callable, Dict, Iterable, List, NamedTuple, Tuple
+
+from utils.data_classes import Detections
+
+
+class SyncedFrame(NamedTuple):
+    """
+    All of the detections for one timestamp, ready to be passed to MultiCameraTracker.multi_camera_analysis()
+    """
+    timestamp: float
+    detections: List[Detections]
+    cameras: Tuple[int, ...]  # Cameras that reported for this timestamp, in the order they reported
+    complete: bool  # False if the frame was emitted because the deadline passed before every camera reported
+
+
+class _PendingFrame:
+    __slots__ = ('deadline', 'detections')
+
+    def __init__(self, deadline: float):
+        self.deadline: float = deadline
+        self.detections: Dict[int, List[Detections]] = {}  # Per camera, in the order they first reported
+
+
+class FrameSynchronizer:
+    """
+    Streaming stage in front of the tracker that aligns the per camera detection streams by timestamp.
+
+    Each camera pushes what it saw for a timestamp (an empty list if it didn't see the ball, so that we know it has
+    reported). A frame is emitted as soon as every camera has reported for it, or once max_wait seconds have passed
+    since the first camera reported for it, whichever comes first. Frames are always emitted in timestamp order, so a
+    complete frame waits for older incomplete ones, but never for longer than their deadline.
+
+    If a camera sends a timestamp again before it is emitted (i.e. a retry), the latest detections replace the earlier
+    ones rather than being added to them. Anything arriving for a timestamp that has already been emitted is too late
+    and is dropped (and counted). The buffer is bounded: when more than max_pending timestamps are waiting, the oldest
+    is emitted straight away.
+
+    Usage:
+        synchronizer = FrameSynchronizer(camera_ids=[1, 3], max_wait=0.1)
+        for frame in synchronizer.push(camera_id, timestamp, detections):
+            tracker.multi_camera_analysis(frame.detections)
+        # And periodically, so that frames are emitted even if a camera stops sending
+        for frame in synchronizer.poll():
+            ...
+    """
+
+    def __init__(
+            self,
+            camera_ids: Iterable[int],
+            max_wait: float = 0.1,
+            max_pending: int = 64,
+            clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        :param camera_ids: Ids of the cameras that make up a complete frame
+        :param max_wait: Maximum seconds to wait for the rest of the cameras once one has reported for a timestamp
+        :param max_pending: Maximum number of timestamps waiting in the buffer
+        :param clock: Returns the current time in seconds, can be replaced for testing
+        """
+        assert max_pending > 0, "The buffer needs to be able to hold at least one frame"
+        self.camera_ids: frozenset = frozenset(int(camera_id) for camera_id in camera_ids)
+        self.max_wait: float = max_wait
+        self.max_pending: int = max_pending
+        self.clock: Callable[[], float] = clock
+
+        self.pending: Dict[float, _PendingFrame] = {}
+        self.pending_timestamps: List[float] = []  # Heap of the keys of self.pending
+        self.last_emitted = None  # Timestamp of the last emitted frame
+
+        # Counters
+        self.complete_frames: int = 0
+        self.partial_frames: int = 0
+        self.overflow_frames: int = 0  # Partial frames emitted early because the buffer was full
+        self.late_dropped: int = 0
+        self.duplicates_replaced: int = 0
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def push(self, camera_id: int, timestamp: float, detections: List[Detections]) -> List[SyncedFrame]:
+        """
+        Adds one camera's detections for a timestamp.
+        :return: The frames that are ready to be emitted, oldest first (usually none or one)
+        """
+        camera_id = int(camera_id)
+        if camera_id not in self.camera_ids:
+            raise KeyError(f"Camera {camera_id} isn't one of the synchronized cameras {sorted(self.camera_ids)}")
+
+        if self.last_emitted is not None and timestamp <= self.last_emitted:
+            self.late_dropped += 1
+            return []
+
+        now = self.clock()
+        frame = self.pending.get(timestamp)
+        if frame is None:
+            frame = _PendingFrame(deadline=now + self.max_wait)
+            self.pending[timestamp] = frame
+            heapq.heappush(self.pending_timestamps, timestamp)
+        if camera_id in frame.detections:
+            self.duplicates_replaced += 1
+        frame.detections[camera_id] = list(detections)
+
+        ready = []
+        while len(self.pending) > self.max_pending:
+            self.overflow_frames += 1
+            ready.append(self._emit_oldest())
+        ready.extend(self._emit_ready(now))
+        return ready
+
+    def poll(self) -> List[SyncedFrame]:
+        """
+        Emits the frames whose deadline has passed (and any complete frames that were waiting behind them).
+        """
+        if not self.pending:
+            return []
+        return self._emit_ready(self.clock())
+
+    def flush(self) -> List[SyncedFrame]:
+        """
+        Emits everything in the buffer, i.e. at the end of a stream.
+        """
+        return [self._emit_oldest() for _ in range(len(self.pending))]
+
+    def next_deadline(self):
+        """
+        :return: The clock time at which the oldest pending frame will be emitted at the latest, or None if nothing is
+            pending. Useful for knowing how long to sleep before the next poll().
+        """
+        if not self.pending:
+            return None
+        return self.pending[self.pending_timestamps[0]].deadline
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "complete_frames": self.complete_frames,
+            "partial_frames": self.partial_frames,
+            "overflow_frames": self.overflow_frames,
+            "late_dropped": self.late_dropped,
+            "duplicates_replaced": self.duplicates_replaced,
+            "pending": len(self.pending),
+        }
+
+    def _emit_ready(self, now: float) -> List[SyncedFrame]:
+        ready = []
+        while self.pending_timestamps:
+            frame = self.pending[self.pending_timestamps[0]]
+            if len(frame.detections) < len(self.camera_ids) and now < frame.deadline:
+                break
+            ready.append(self._emit_oldest())
+        return ready
+
+    def _emit_oldest(self) -> SyncedFrame:
+        timestamp = heapq.heappop(self.pending_timestamps)
+        frame = self.pending.pop(timestamp)
+        complete = len(frame.detections) == len(self.camera_ids)
+        if complete:
+            self.complete_frames += 1
+        else:
+            self.partial_frames += 1
+        self.last_emitted = timestamp
+        detections = [detection for camera_detections in frame.detections.values() for detection in camera_detections]
+        return SyncedFrame(timestamp=timestamp, detections=detections, cameras=tuple(frame.detections),
+                           complete=complete)
@@ -0,0 +1,240 @@
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+# Rays whose direction has a smaller component than this along a plane's normal are treated as parallel to it
+PARALLEL_EPS: float = 1e-12
+
+
+def triangulate_midpoint(
+        px: float, py: float, pz: float,
+        cpx: float, cpy: float, cpz: float,
+        qx: float, qy: float, qz: float,
+        cqx: float, cqy: float, cqz: float,
+) -> Tuple[float, float, float]:
+    """
+    Scalar mid-point triangulation of two rays, each going from a camera (cp, cq) through the ball position seen by
+    that camera (p, q). Everything is done with plain Python floats so that a single call doesn't allocate any numpy
+    temporaries, which makes it the fast path for the per frame two camera case.
+
+    This follows the exact same arithmetic as the original MultiCameraTracker.triangulate, so results are identical.
+    https://en.wikipedia.org/wiki/Triangulation_(computer_vision)#Mid-point_method
+
+    :return: (x, y, z) of the midpoint of the shortest segment between the two rays
+    """
+    # Direction vectors (i.e. from camera to ball)
+    l1x, l1y, l1z = px - cpx, py - cpy, pz - cpz
+    l2x, l2y, l2z = qx - cqx, qy - cqy, qz - cqz
+
+    # Vector between the two balls
+    bx, by, bz = qx - px, qy - py, qz - pz
+
+    r1 = l1x * l1x + l1y * l1y + l1z * l1z  # squared norm of l1
+    r2 = l2x * l2x + l2y * l2y + l2z * l2z  # squared norm of l2
+    l1_l2 = l1x * l2x + l1y * l2y + l1z * l2z
+    balls_l1 = bx * l1x + by * l1y + bz * l1z
+    balls_l2 = l2x * bx + l2y * by + l2z * bz
+
+    denominator = (r1 * r2) + (l1_l2 ** 2)
+    s = abs(((l1_l2 * balls_l2) + (balls_l1 * r2)) / denominator)
+    t = abs(((l1_l2 * balls_l1) - (balls_l2 * r1)) / denominator)
+
+    return (
+        (((1 - s) * px + s * cpx) + ((1 - t) * qx + t * cqx)) / 2,
+        (((1 - s) * py + s * cpy) + ((1 - t) * qy + t * cqy)) / 2,
+        (((1 - s) * pz + s * cpz) + ((1 - t) * qz + t * cqz)) / 2,
+    )
+
+
+def triangulate_midpoint_batch(
+        ball_p: np.ndarray,
+        cam_p: np.ndarray,
+        ball_q: np.ndarray,
+        cam_q: np.ndarray,
+        out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Vectorized version of triangulate_midpoint() for N pairs of rays at once.
+
+    :param ball_p: (N, 3) float64 ball positions seen by the first camera
+    :param cam_p: (N, 3) or (3,) float64 positions of the first camera
+    :param ball_q: (N, 3) float64 ball positions seen by the second camera
+    :param cam_q: (N, 3) or (3,) float64 positions of the second camera
+    :param out: Optional (N, 3) float64 array to write the result into
+    :return: (N, 3) float64 array of triangulated points
+    """
+    ball_p = np.asarray(ball_p, dtype=np.float64)
+    ball_q = np.asarray(ball_q, dtype=np.float64)
+    cam_p = np.asarray(cam_p, dtype=np.float64)
+    cam_q = np.asarray(cam_q, dtype=np.float64)
+
+    l1 = ball_p - cam_p
+    l2 = ball_q - cam_q
+    balls = ball_q - ball_p
+
+    r1 = np.einsum('ij,ij->i', l1, l1)
+    r2 = np.einsum('ij,ij->i', l2, l2)
+    l1_l2 = np.einsum('ij,ij->i', l1, l2)
+    balls_l1 = np.einsum('ij,ij->i', balls, l1)
+    balls_l2 = np.einsum('ij,ij->i', l2, balls)
+
+    denominator = (r1 * r2) + (l1_l2 ** 2)
+    s = np.abs(((l1_l2 * balls_l2) + (balls_l1 * r2)) / denominator)[:, None]
+    t = np.abs(((l1_l2 * balls_l1) - (balls_l2 * r1)) / denominator)[:, None]
+
+    if out is None:
+        out = np.empty(ball_p.shape, dtype=np.float64)
+    np.add((1 - s) * ball_p + s * cam_p, (1 - t) * ball_q + t * cam_q, out=out)
+    out /= 2
+    return out
+
+
+def apply_homography(homography: Sequence[float], x: float, y: float) -> Tuple[float, float]:
+    """
+    Scalar version of apply_homographies() for a single point, with plain Python floats. The per frame path only has a
+    couple of detections, for which the numpy call overhead of the batched version costs more than the maths.
+
+    :param homography: The 9 values of the (3, 3) homography, row major (i.e. tuple(H.ravel().tolist()))
+    :return: Real world (x, y)
+    """
+    h0, h1, h2, h3, h4, h5, h6, h7, h8 = homography
+    w = h6 * x + h7 * y + h8
+    return (h0 * x + h1 * y + h2) / w, (h3 * x + h4 * y + h5) / w
+
+
+def apply_homographies(
+        homographies: np.ndarray,
+        camera_ndx: np.ndarray,
+        xs: np.ndarray,
+        ys: np.ndarray,
+        out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Applies each point's camera homography to a batch of pixel coordinates, with the perspective divide done vectorized.
+
+    :param homographies: (C, 3, 3) float64 stack of homographies
+    :param camera_ndx: (N,) index into homographies for each point
+    :param xs: (N,) pixel x coordinates
+    :param ys: (N,) pixel y coordinates
+    :param out: Optional (N, 2) float64 array to write the result into
+    :return: (N, 2) float64 array of real world (x, y) coordinates
+    """
+    points = np.empty((len(xs), 3), dtype=np.float64)
+    points[:, 0] = xs
+    points[:, 1] = ys
+    points[:, 2] = 1.0
+
+    transformed = np.einsum('nij,nj->ni', homographies[camera_ndx], points)
+
+    if out is None:
+        out = np.empty((len(xs), 2), dtype=np.float64)
+    np.divide(transformed[:, :2], transformed[:, 2:], out=out)
+    return out
+
+
+def triangulate_least_squares(ball_points: np.ndarray, camera_centres: np.ndarray) -> np.ndarray:
+    """
+    Linear least squares triangulation of N >= 2 rays, each going from a camera centre through the ball position seen
+    by that camera. Finds the point X minimising the sum of squared distances to all of the rays, by solving
+        sum_i (I - d_i d_i^T) X = sum_i (I - d_i d_i^T) c_i
+    where d_i is the unit direction of ray i and c_i its camera centre.
+
+    :param ball_points: (N, 3) ball positions seen by each camera
+    :param camera_centres: (N, 3) real world positions of the cameras
+    :return: (3,) float64 triangulated point
+    """
+    ball_points = np.asarray(ball_points, dtype=np.float64)
+    return triangulate_least_squares_batch(ball_points, camera_centres, np.zeros(1, dtype=np.intp))[0]
+
+
+def triangulate_least_squares_batch(
+        ball_points: np.ndarray,
+        camera_centres: np.ndarray,
+        group_starts: np.ndarray,
+) -> np.ndarray:
+    """
+    Vectorized version of triangulate_least_squares() for many frames at once. The rays of each frame are consecutive
+    rows, and frame f starts at row group_starts[f].
+
+    :param ball_points: (M, 3) ball positions seen by each camera, for all frames
+    :param camera_centres: (M, 3) real world position of the camera of each row
+    :param group_starts: (F,) sorted row index at which each frame's rays start
+    :return: (F, 3) float64 triangulated points
+    """
+    ball_points = np.asarray(ball_points, dtype=np.float64)
+    camera_centres = np.asarray(camera_centres, dtype=np.float64)
+
+    directions = ball_points - camera_centres
+    directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+
+    # Projection onto the plane orthogonal to each ray
+    projections = np.eye(3)[None, :, :] - directions[:, :, None] * directions[:, None, :]
+    targets = np.einsum('nij,nj->ni', projections, camera_centres)
+
+    lhs = np.add.reduceat(projections, group_starts, axis=0)
+    rhs = np.add.reduceat(targets, group_starts, axis=0)
+
+    try:
+        return np.linalg.solve(lhs, rhs[:, :, None])[:, :, 0]
+    except np.linalg.LinAlgError:
+        # Only happens if every ray in a frame is parallel, fall back to the minimum norm solution
+        return np.einsum('nij,nj->ni', np.linalg.pinv(lhs), rhs)
+
+
+def intersect_vertical_plane(
+        ax: float, ay: float, az: float,
+        cx: float, cy: float, cz: float,
+        plane_a: float, plane_b: float, plane_d: float,
+) -> Tuple[float, float, float]:
+    """
+    Scalar intersection of the ray going from a camera (c) through the ball position seen by that camera (a) with a
+    vertical plane plane_a * x + plane_b * y + plane_d = 0. This is how the height of the ball is estimated when only one
+    camera sees it, with the plane formed from the ball's recent trajectory.
+
+    If the ray is parallel to the plane (or the plane is all zeros, i.e. the ball was stationary) there's no
+    intersection, and the ball position (a) is returned unchanged.
+
+    :return: (x, y, z) of the intersection
+    """
+    dx, dy, dz = ax - cx, ay - cy, az - cz
+    denominator = plane_a * dx + plane_b * dy
+    if abs(denominator) < PARALLEL_EPS:
+        return ax, ay, az
+
+    t = -(plane_a * cx + plane_b * cy + plane_d) / denominator
+    return cx + t * dx, cy + t * dy, cz + t * dz
+
+
+def intersect_vertical_plane_batch(
+        ball_points: np.ndarray,
+        camera_centres: np.ndarray,
+        plane: np.ndarray,
+        out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Vectorized version of intersect_vertical_plane() for N rays and the same plane.
+
+    :param ball_points: (N, 3) float64 ball positions seen by each camera
+    :param camera_centres: (N, 3) or (3,) float64 positions of the cameras
+    :param plane: (4,) plane coefficients (a, b, c, d) of ax + by + cz + d = 0, c is ignored as the plane is vertical
+    :param out: Optional (N, 3) float64 array to write the result into
+    :return: (N, 3) float64 array of intersections, rows without an intersection are the unchanged ball positions
+    """
+    ball_points = np.asarray(ball_points, dtype=np.float64)
+    camera_centres = np.asarray(camera_centres, dtype=np.float64)
+    plane_a, plane_b, _, plane_d = np.asarray(plane, dtype=np.float64).reshape(4).tolist()
+
+    directions = ball_points - camera_centres
+    denominator = plane_a * directions[:, 0] + plane_b * directions[:, 1]
+    parallel = np.abs(denominator) < PARALLEL_EPS
+
+    # Where there is no intersection, t=1 lands on the ball position itself
+    numerator = -(plane_a * camera_centres[..., 0] + plane_b * camera_centres[..., 1] + plane_d)
+    t = np.divide(numerator, denominator, out=np.ones_like(denominator), where=~parallel)
+
+    if out is None:
+        out = np.empty(ball_points.shape, dtype=np.float64)
+    np.multiply(directions, t[:, None], out=out)
+    out += camera_centres
+    out[parallel] = ball_points[parallel]  # Exact, rather than c + 1 * (a - c)
+    return out
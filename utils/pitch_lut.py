@@ -0,0 +1,158 @@
+import hashlib
+import os
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.cache import prune_cache
+from utils.config import IMAGE_HEIGHT, IMAGE_WIDTH
+from utils.field_mask import build_field_mask
+
+# Bump this whenever the way the tables are built changes, so that old cache files are ignored
+PITCH_LUT_VERSION: int = 1
+PITCH_LUT_CACHE_FILES: int = 8  # Tables kept in the cache dir (~16MB each at full resolution), older ones are deleted
+ROWS_PER_CHUNK: int = 64  # Rows of the image projected at once when building a table, to bound the temporary memory
+
+
+def build_pitch_lut(
+        homography: np.ndarray,
+        image_field_coordinates: Sequence[Tuple[int, int]],
+        mirror_x: bool = False,
+        width: int = IMAGE_WIDTH,
+        height: int = IMAGE_HEIGHT,
+) -> np.ndarray:
+    """
+    Precomputes where every pixel of a camera lands on the pitch, so that projecting a detection is a memory read
+    rather than a 3x3 homography and a divide.
+
+    Pixel (x, y) of the table is the homography applied at the point (x, y), so the pixels line up with the field
+    masks from utils.field_mask. Pixels outside of the field polygon are NaN.
+
+    :param homography: (3, 3) homography of the camera
+    :param image_field_coordinates: Field polygon of the camera, as in utils.config
+    :param mirror_x: Bakes the x -> width - x mirroring into the table (i.e. for Jetson3, whose homography and field
+        polygon are in mirrored image coordinates), so the table is indexed with the raw image coordinates
+    :return: (height, width, 2) float32 table of real world (x, y), indexed as lut[y, x]
+    """
+    homography = np.asarray(homography, dtype=np.float64)
+    xs = np.arange(width, dtype=np.float64)
+    if mirror_x:
+        xs = width - xs
+        # The mirrored coordinates go from width down to 1, so the mask needs the extra column
+        field_mask = build_field_mask(image_field_coordinates, width=width + 1, height=height)[:, width - np.arange(width)]
+    else:
+        field_mask = build_field_mask(image_field_coordinates, width=width, height=height)
+
+    lut = np.empty((height, width, 2), dtype=np.float32)
+    for start in range(0, height, ROWS_PER_CHUNK):
+        ys = np.arange(start, min(start + ROWS_PER_CHUNK, height), dtype=np.float64)
+        # Homography applied to every (x, y, 1) of these rows, broadcast rather than building the points
+        transformed = homography[:, 0, None, None] * xs[None, None, :] + \
+            homography[:, 1, None, None] * ys[None, :, None] + homography[:, 2, None, None]
+        lut[start:start + len(ys), :, 0] = transformed[0] / transformed[2]
+        lut[start:start + len(ys), :, 1] = transformed[1] / transformed[2]
+
+    lut[~field_mask] = np.nan
+    return lut
+
+
+def lookup_pitch_lut(lut: np.ndarray, xs: np.ndarray, ys: np.ndarray, interpolation: str = "bilinear") -> np.ndarray:
+    """
+    Looks up a batch of points in a table from build_pitch_lut().
+
+    With "bilinear" the 4 pixels surrounding each point are interpolated, which is accurate to within a few millimetres
+    on the pitch, but costs 4 random reads per point. "nearest" reads the single closest pixel, which is the fastest
+    (about twice as fast as the homography in numpy), but is off by up to half a pixel, which is metres at the far end
+    of the pitch.
+
+    :param lut: (height, width, 2) table, can be a memory map
+    :param xs: (N,) pixel x coordinates
+    :param ys: (N,) pixel y coordinates
+    :param interpolation: "bilinear" or "nearest"
+    :return: (N, 2) float64 real world (x, y). NaN for points outside of the image or field (for bilinear, also within a
+        pixel of the field's edge), for which the caller should fall back to the homography
+    """
+    height, width = lut.shape[:2]
+    flat = np.asarray(lut).reshape(-1, 2)
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+
+    # The comparisons also catch NaNs
+    in_image = (xs >= 0) & (xs <= width - 1) & (ys >= 0) & (ys <= height - 1)
+    xs = np.where(in_image, xs, 0.)
+    ys = np.where(in_image, ys, 0.)
+
+    if interpolation == "nearest":
+        out = flat[(ys + 0.5).astype(np.intp) * width + (xs + 0.5).astype(np.intp)].astype(np.float64)
+    elif interpolation == "bilinear":
+        x0 = np.minimum(xs.astype(np.intp), width - 2)
+        y0 = np.minimum(ys.astype(np.intp), height - 2)
+        fx, fy = xs - x0, ys - y0
+
+        # The 4 surrounding pixels with a single gather, (N, 4, 2)
+        corners = flat[(y0 * width + x0)[:, None] + np.array([0, 1, width, width + 1])]
+        weights = np.empty((len(xs), 4), dtype=np.float64)
+        weights[:, 0] = (1 - fx) * (1 - fy)
+        weights[:, 1] = fx * (1 - fy)
+        weights[:, 2] = (1 - fx) * fy
+        weights[:, 3] = fx * fy
+        out = np.einsum('nk,nkc->nc', weights, corners)
+    else:
+        raise ValueError(f"Unknown interpolation {interpolation}, should be 'bilinear' or 'nearest'")
+
+    out[~in_image] = np.nan
+    return out
+
+
+def pitch_lut_path(
+        cache_dir: str,
+        homography: np.ndarray,
+        image_field_coordinates: Sequence[Tuple[int, int]],
+        mirror_x: bool = False,
+        width: int = IMAGE_WIDTH,
+        height: int = IMAGE_HEIGHT,
+) -> str:
+    """
+    Path of the cached table for these inputs, named after a hash of everything the table is built from.
+    """
+    sha = hashlib.sha1()
+    sha.update(f"{PITCH_LUT_VERSION} {mirror_x} {width} {height}".encode())
+    sha.update(np.ascontiguousarray(homography, dtype=np.float64).tobytes())
+    sha.update(np.ascontiguousarray(image_field_coordinates, dtype=np.float64).tobytes())
+    return os.path.join(cache_dir, f"pitch_lut_v{PITCH_LUT_VERSION}_{sha.hexdigest()[:16]}.npy")
+
+
+def load_pitch_lut(
+        cache_dir: Optional[str],
+        homography: np.ndarray,
+        image_field_coordinates: Sequence[Tuple[int, int]],
+        mirror_x: bool = False,
+        width: int = IMAGE_WIDTH,
+        height: int = IMAGE_HEIGHT,
+) -> np.ndarray:
+    """
+    Returns the table from build_pitch_lut() as a read only memory map of a .npy file in cache_dir, building and
+    saving it first if there isn't one for these inputs yet. Every process (i.e. the workers of
+    practical_testing.match_host) that maps the same file shares the one copy in the page cache. Only the
+    PITCH_LUT_CACHE_FILES latest tables are kept.
+    If cache_dir is None, or the cache can't be written, the table is just built in memory.
+    """
+    if cache_dir is None:
+        return build_pitch_lut(homography, image_field_coordinates, mirror_x, width, height)
+    path = pitch_lut_path(cache_dir, homography, image_field_coordinates, mirror_x, width, height)
+
+    if not os.path.exists(path):
+        lut = build_pitch_lut(homography, image_field_coordinates, mirror_x, width, height)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # Write to a temp file first, so that another process never maps a half written table
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, "wb") as f:
+                np.save(f, lut)
+            os.replace(temp_path, path)
+            prune_cache(cache_dir, "pitch_lut_v*.npy", PITCH_LUT_CACHE_FILES)
+        except OSError as e:
+            print(f"Couldn't write the pitch lookup table {path}: {e}")
+            return lut
+
+    return np.load(path, mmap_mode="r")
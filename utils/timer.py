@@ -16,3 +16,81 @@ class Timer:
 
     def get_elapsed_time(self):
         return self.elapsed_time
+
+
+class LatencyHistogram:
+    """
+    Fixed size, log-linear histogram of latencies in nanoseconds (similar to an HDR histogram). All of the buckets are
+    allocated up front, so recording a sample is a couple of integer operations and never allocates.
+
+    Values below 2**SUB_BUCKET_BITS ns get their own bucket, after that every power of two is split into
+    2**(SUB_BUCKET_BITS - 1) buckets, so percentiles are accurate to within ~6%.
+    """
+    SUB_BUCKET_BITS = 5
+    MAX_EXPONENT = 40  # ~18 minutes, anything slower ends up in the last bucket
+
+    def __init__(self):
+        self.linear_buckets = 1 << self.SUB_BUCKET_BITS
+        self.sub_buckets = 1 << (self.SUB_BUCKET_BITS - 1)
+        self.n_buckets = self.linear_buckets + self.MAX_EXPONENT * self.sub_buckets
+        self.counts = [0] * self.n_buckets
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def bucket(self, ns: int) -> int:
+        if ns < self.linear_buckets:
+            return max(ns, 0)
+        shift = ns.bit_length() - self.SUB_BUCKET_BITS
+        ndx = self.linear_buckets + (shift - 1) * self.sub_buckets + (ns >> shift) - self.sub_buckets
+        return min(ndx, self.n_buckets - 1)
+
+    def bucket_bounds(self, ndx: int):
+        """
+        :return: (lower, upper) bounds in ns of the values that land in bucket ndx
+        """
+        if ndx < self.linear_buckets:
+            return ndx, ndx + 1
+        shift = (ndx - self.linear_buckets) // self.sub_buckets + 1
+        mantissa = (ndx - self.linear_buckets) % self.sub_buckets + self.sub_buckets
+        return mantissa << shift, (mantissa + 1) << shift
+
+    def record(self, ns: int) -> None:
+        self.counts[self.bucket(ns)] += 1
+        self.count += 1
+        self.total_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+
+    def percentile(self, p: float) -> float:
+        """
+        :param p: Percentile between 0 and 100
+        :return: Estimated latency in ns at that percentile (the midpoint of its bucket), 0 if nothing was recorded
+        """
+        if self.count == 0:
+            return 0.
+        target = max(1, int(round(self.count * p / 100)))
+        seen = 0
+        for ndx, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target:
+                lower, upper = self.bucket_bounds(ndx)
+                return min((lower + upper) / 2, float(self.max_ns))
+        return float(self.max_ns)
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "total_ns": self.total_ns,
+            "max_ns": self.max_ns,
+            "p50_ns": self.percentile(50),
+            "p95_ns": self.percentile(95),
+            "p99_ns": self.percentile(99),
+            "counts": list(self.counts),
+        }
+
+    def reset(self) -> None:
+        self.counts = [0] * self.n_buckets
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
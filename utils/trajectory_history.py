@@ -0,0 +1,148 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from utils.data_classes import ThreeDPoints
+
+
+class TrajectoryHistory:
+    """
+    Fixed capacity ring buffer of the 3D points the tracker has produced, stored as a struct of float64/ bool arrays
+    instead of a list of dataclasses. Once it is full, appending overwrites the oldest entry, so memory use is bounded
+    no matter how long the tracker runs.
+
+    Entries are either valid points, or flags (i.e. the frame had no usable detection). Flags are stored with
+    valid=False and are handed back as the flag object the history was created with, so code indexing into the history
+    (i.e. `history[-1] == THREE_D_POINTS_FLAG`) works the same as with the old list.
+    """
+
+    def __init__(self, capacity: int, flag: ThreeDPoints):
+        assert capacity > 0, "The history needs to be able to hold at least one point"
+        self.capacity: int = capacity
+        self.flag: ThreeDPoints = flag
+
+        self.x = np.zeros(capacity, dtype=np.float64)
+        self.y = np.zeros(capacity, dtype=np.float64)
+        self.z = np.zeros(capacity, dtype=np.float64)
+        self.timestamp = np.zeros(capacity, dtype=np.float64)
+        self.valid = np.zeros(capacity, dtype=bool)
+
+        # Total number of entries ever appended. The next entry goes in slot count % capacity.
+        self.count: int = 0
+
+        # Sequence numbers (i.e. the value of self.count when they were appended) of the most recent valid entries, in
+        # their own ring buffer so that "last n valid points" doesn't need to scan the history.
+        self.valid_seq = np.zeros(capacity, dtype=np.int64)
+        self.valid_count: int = 0
+
+        # Vertical plane through the last two valid points, (a, b, c, d) of ax + by + cz + d = 0 with c always 0. It is
+        # updated on every append, so the tracker can read it when it needs it rather than rescanning the history.
+        # plane_stationary caches whether it is all zeros (i.e. the last two points are at the same x, y).
+        self.plane = np.zeros(4, dtype=np.float64)
+        self.plane_stationary: bool = True
+        self._last_x: float = 0.
+        self._last_y: float = 0.
+
+    def __len__(self) -> int:
+        return min(self.count, self.capacity)
+
+    def __getitem__(self, ndx: int) -> ThreeDPoints:
+        """
+        Returns the entry at position ndx (negative indices count back from the most recent entry) as a ThreeDPoints
+        object, or the flag if that entry isn't valid.
+        """
+        length = len(self)
+        if ndx < 0:
+            ndx += length
+        if not 0 <= ndx < length:
+            raise IndexError("TrajectoryHistory index out of range")
+        return self._point_at(self._slot(self.count - length + ndx))
+
+    def append(self, point: ThreeDPoints) -> None:
+        """
+        Appends a point, or the flag, to the history in O(1). The point's values are copied so the caller is free to
+        keep modifying it.
+        """
+        if point == self.flag:
+            self.append_flag()
+        else:
+            self.append_xyz(point.x, point.y, point.z, point.timestamp)
+
+    def append_xyz(self, x: float, y: float, z: float, timestamp: float) -> None:
+        slot = self._slot(self.count)
+        self.x[slot] = x
+        self.y[slot] = y
+        self.z[slot] = z
+        self.timestamp[slot] = timestamp
+        self.valid[slot] = True
+
+        self.valid_seq[self.valid_count % self.capacity] = self.count
+        self.valid_count += 1
+        self.count += 1
+
+        # Plane through the previous valid point (prev) and this one (new): its normal is perpendicular to prev -> new
+        # in the xy plane and it passes through the new point. Same as MultiCameraTracker.form_plane() always did.
+        normal_x, normal_y = -(self._last_y - y), self._last_x - x
+        plane = self.plane
+        plane[0] = normal_x
+        plane[1] = normal_y
+        plane[3] = -(x * normal_x + y * normal_y)
+        self.plane_stationary = normal_x == 0 and normal_y == 0
+        self._last_x, self._last_y = x, y
+
+    def append_flag(self) -> None:
+        self.valid[self._slot(self.count)] = False
+        self.count += 1
+
+    def last_valid(self, n: int, window: Optional[int] = None) -> List[ThreeDPoints]:
+        """
+        Returns up to the last n valid points, oldest first, in O(n).
+        :param n: Maximum number of points to return
+        :param window: If given, only look at the last `window` entries of the history (valid or not)
+        """
+        return [self._point_at(self._slot(seq)) for seq in self.last_valid_seq(n, window)]
+
+    def last_valid_seq(self, n: int, window: Optional[int] = None) -> List[int]:
+        """
+        Same as last_valid() but returns the sequence numbers of the entries rather than the points themselves.
+        """
+        oldest_seq = self.count - len(self)
+        if window is not None:
+            oldest_seq = max(oldest_seq, self.count - window)
+
+        seqs = []
+        for i in range(1, min(n, self.valid_count, self.capacity) + 1):
+            seq = int(self.valid_seq[(self.valid_count - i) % self.capacity])
+            if seq < oldest_seq:
+                break
+            seqs.append(seq)
+        seqs.reverse()
+        return seqs
+
+    def has_plane(self, window: Optional[int] = None) -> bool:
+        """
+        Whether self.plane is formed from two valid points, that are both within the last `window` entries of the
+        history. O(1), equivalent to len(self.last_valid(2, window)) == 2.
+        """
+        if self.valid_count < 2 or self.capacity < 2:
+            return False
+        oldest_seq = self.count - len(self)
+        if window is not None:
+            oldest_seq = max(oldest_seq, self.count - window)
+        return self.valid_seq.item((self.valid_count - 2) % self.capacity) >= oldest_seq
+
+    def to_arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        :return: Copies of the (x, y, z, timestamp, valid) columns in chronological order
+        """
+        order = self._slot(np.arange(self.count - len(self), self.count))
+        return self.x[order], self.y[order], self.z[order], self.timestamp[order], self.valid[order]
+
+    def _slot(self, seq):
+        return seq % self.capacity
+
+    def _point_at(self, slot: int) -> ThreeDPoints:
+        if not self.valid[slot]:
+            return self.flag
+        return ThreeDPoints(x=self.x[slot].item(), y=self.y[slot].item(), z=self.z[slot].item(),
+                            timestamp=self.timestamp[slot].item())
@@ -1,9 +1,9 @@
-import cv2
 from typing import List, Tuple
 from utils.data_classes import Detections
 
 
 def draw_bboxes_red(image, x, y):
+    import cv2  # Only needed for drawing, so it isn't imported with the rest of the module
     return cv2.circle(image, (int(x), int(y)), 5, (255, 0, 0), 2)
 
 